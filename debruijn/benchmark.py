@@ -0,0 +1,728 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    A copy of the GNU General Public License is available at
+#    http://www.gnu.org/licenses/gpl-3.0.html
+
+"""Benchmarks of the debruijn assembler."""
+# Modul importation
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import debruijn
+
+__author__ = "Lynda"
+__copyright__ = "Universite  de Paris "
+__credits__ = ["Lynda"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Lynda"
+__email__ = "lyndamessad96@gmail.com"
+__status__ = "Developpement"
+
+
+def int_list(text):
+    """Parse a comma separated list of integers"""
+    try:
+        return [int(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a comma separated list of integers".format(text))
+
+
+def float_list(text):
+    """Parse a comma separated list of floats"""
+    try:
+        return [float(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a comma separated list of numbers".format(text))
+
+
+def get_arguments():
+    """Retrieves the arguments of the program.
+      Returns: An object that contains the arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__, usage=
+                                     "{0} -h"
+                                     .format(sys.argv[0]))
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parallel = subparsers.add_parser('parallel', help="Scaling of the "
+                                     "multi-process k-mer counting")
+    parallel.add_argument('-i', dest='fastq_file', type=debruijn.isfile,
+                          required=True, help="Fastq file")
+    parallel.add_argument('-k', dest='kmer_size', type=int,
+                          default=21, help="K-mer size (default 21)")
+    parallel.add_argument('--size', dest='size', type=float, default=0,
+                          help="Replicate the fastq file up to this size "
+                          "in GB (default: no replication)")
+    parallel.add_argument('--threads', dest='threads', type=int_list,
+                          default=[1, 2, 4, 8, 16, 32],
+                          help="Comma separated numbers of processes")
+    parallel.add_argument('--packed', dest='packed', action='store_true',
+                          help="Count 2-bit packed k-mers")
+
+    backends = subparsers.add_parser('backends', help="Memory and time of "
+                                     "the networkx and CSR graph backends")
+    backends.add_argument('-i', dest='fastq_file', type=debruijn.isfile,
+                          required=True, help="Fastq file")
+    backends.add_argument('-k', dest='kmer_size', type=int,
+                          default=21, help="K-mer size (default 21)")
+    backends.add_argument('--packed', dest='packed', action='store_true',
+                          help="Use 2-bit packed k-mers")
+
+    bubbles = subparsers.add_parser('bubbles', help="Bubble removal on "
+                                    "synthetic graphs with SNP bubbles")
+    bubbles.add_argument('-k', dest='kmer_size', type=int,
+                         default=21, help="K-mer size (default 21)")
+    bubbles.add_argument('--bubbles', dest='bubbles', type=int_list,
+                         default=[100, 1000, 5000],
+                         help="Comma separated numbers of bubbles")
+    bubbles.add_argument('--spacing', dest='spacing', type=int, default=100,
+                         help="Distance between 2 SNPs (default 100)")
+    bubbles.add_argument('--max-bubble-length', dest='max_bubble_length',
+                         type=int, default=100,
+                         help="Maximum bubble length of the bounded search "
+                         "(default 100)")
+    bubbles.add_argument('--skip-lca', dest='skip_lca', action='store_true',
+                         help="Only time the bounded search")
+
+    trimming = subparsers.add_parser('trimming', help="Bases, distinct "
+                                     "k-mers and simplification time with "
+                                     "quality trimming of the reads")
+    trimming.add_argument('-i', dest='fastq_file', type=debruijn.isfile,
+                          required=True, help="Fastq file")
+    trimming.add_argument('-k', dest='kmer_size', type=int,
+                          default=21, help="K-mer size (default 21)")
+    trimming.add_argument('--min-qual', dest='min_quals', type=int_list,
+                          default=[10, 20, 30],
+                          help="Comma separated minimum qualities "
+                          "(default 10,20,30)")
+    trimming.add_argument('--min-fragment-length',
+                          dest='min_fragment_length', type=int, default=0,
+                          help="Minimum length of the fragments (default 0)")
+    trimming.add_argument('--max-bubble-length', dest='max_bubble_length',
+                          type=int, default=100,
+                          help="Maximum bubble length (default 100)")
+    trimming.add_argument('--max-tip-length', dest='max_tip_length',
+                          type=int, default=100,
+                          help="Maximum tip length (default 100)")
+
+    correction = subparsers.add_parser('correction', help="Distinct k-mers "
+                                       "and simplification time with the "
+                                       "error correction of the reads")
+    correction.add_argument('-i', dest='fastq_file', type=debruijn.isfile,
+                            required=True, help="Fastq file")
+    correction.add_argument('-k', dest='kmer_size', type=int,
+                            default=21, help="K-mer size (default 21)")
+    correction.add_argument('--solid-count', dest='solid_counts',
+                            type=int_list, default=[2, 3, 5],
+                            help="Comma separated minimum occurences of "
+                            "the solid k-mers (default 2,3,5)")
+    correction.add_argument('--threads', dest='threads', type=int,
+                            default=1, help="Number of processes "
+                            "(default 1)")
+    correction.add_argument('--max-bubble-length', dest='max_bubble_length',
+                            type=int, default=100,
+                            help="Maximum bubble length (default 100)")
+    correction.add_argument('--max-tip-length', dest='max_tip_length',
+                            type=int, default=100,
+                            help="Maximum tip length (default 100)")
+
+    suite = subparsers.add_parser('suite', help="Time and memory of each "
+                                  "stage on simulated genomes and reads")
+    suite.add_argument('-i', dest='fastq_file', type=debruijn.isfile,
+                       help="Fastq file to use instead of simulated reads")
+    suite.add_argument('-k', dest='kmer_size', type=int,
+                       default=21, help="K-mer size (default 21)")
+    suite.add_argument('--genome-size', dest='genome_sizes', type=int_list,
+                       default=[10000, 100000],
+                       help="Comma separated genome sizes in bases")
+    suite.add_argument('--repeats', dest='repeats', type=float, default=0,
+                       help="Fraction of the genome made of repeats "
+                       "(default 0)")
+    suite.add_argument('--repeat-length', dest='repeat_length', type=int,
+                       default=500, help="Length of a repeat (default 500)")
+    suite.add_argument('--coverage', dest='coverage', type=float, default=20,
+                       help="Coverage of the reads (default 20)")
+    suite.add_argument('--read-length', dest='read_length', type=int,
+                       default=100, help="Length of the reads (default 100)")
+    suite.add_argument('--error-rate', dest='error_rates', type=float_list,
+                       default=[0, 0.01],
+                       help="Comma separated substitution rates of the "
+                       "reads (default 0,0.01)")
+    suite.add_argument('--seed', dest='seed', type=int, default=9001,
+                       help="Seed of the simulation (default 9001)")
+    suite.add_argument('--max-bubble-length', dest='max_bubble_length',
+                       type=int, default=100,
+                       help="Bounded bubble search, like debruijn.py "
+                       "(default 100)")
+    suite.add_argument('--max-tip-length', dest='max_tip_length', type=int,
+                       default=100, help="One pass tip clipping, like "
+                       "debruijn.py (default 100)")
+    suite.add_argument('--legacy', dest='legacy', action='store_true',
+                       help="Profile the lowest common ancestor bubble "
+                       "search and the two tip passes instead (very slow "
+                       "on reads with errors)")
+    suite.add_argument('--no-memory', dest='memory', action='store_false',
+                       help="Do not trace the memory of each stage")
+    suite.add_argument('-o', dest='json_file', type=str, default=None,
+                       help="JSON output file (default: standard output)")
+    args = parser.parse_args()
+    if args.benchmark == 'suite' and args.legacy:
+        args.max_bubble_length = args.max_tip_length = None
+    return args
+
+
+def replicate_fastq(fastq_file : str, size : float, directory : str):
+    """
+    This function writes copies of a fastq file one after the other until
+    the given size is reached.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file to replicate
+    size: float // size wanted in GB
+    directory: str // directory of the replicated file
+
+    Return:
+    ------
+    str // path of the replicated file
+    """
+    with open(fastq_file, "rb") as file:
+        content = file.read()
+    if not content.endswith(b"\n"):
+        content += b"\n"
+    output_file = os.path.join(directory, "replicated.fq")
+    copies = max(1, int(size * 1e9 / len(content)))
+    with open(output_file, "wb") as file:
+        for _ in range(copies):
+            file.write(content)
+    return output_file
+
+
+def benchmark_parallel(fastq_file : str, k_size : int, threads : list,
+                       packed : bool):
+    """
+    This function times build_kmer_dict() with each number of processes.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file with sequence
+    k_size: int // size of the kmer
+    threads: list // numbers of processes to try
+    packed: boolean // count packed kmers
+
+    Return:
+    ------
+    list of tuple // [(threads, seconds, speedup)]
+    """
+    results = []
+    for n_threads in threads:
+        start = time.perf_counter()
+        debruijn.build_kmer_dict(fastq_file, k_size, encoded=packed,
+                                 threads=n_threads)
+        elapsed = time.perf_counter() - start
+        speedup = results[0][1] / elapsed if results else 1.0
+        results.append((n_threads, elapsed, speedup))
+        print("{0}\t{1:.2f}\t{2:.2f}".format(n_threads, elapsed, speedup))
+    return results
+
+
+def simplify(graph):
+    """Run the simplification and contig stages of debruijn.main()"""
+    nodes_in = debruijn.get_starting_nodes(graph)
+    nodes_out = debruijn.get_sink_nodes(graph)
+    graph = debruijn.simplify_bubbles(graph)
+    graph = debruijn.solve_entry_tips(graph, nodes_in)
+    graph = debruijn.solve_out_tips(graph, nodes_out)
+    return debruijn.get_contigs(graph, debruijn.get_starting_nodes(graph),
+                                debruijn.get_sink_nodes(graph))
+
+
+def benchmark_backends(fastq_file : str, k_size : int, packed : bool):
+    """
+    This function compares the graph backends: memory allocated by
+    build_graph(), time of build_graph() and of the simplification.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file with sequence
+    k_size: int // size of the kmer
+    packed: boolean // use packed kmers
+
+    Return:
+    ------
+    list of tuple // [(backend, nodes, MB, build seconds, simplify seconds)]
+    """
+    kmer_dict = debruijn.build_kmer_dict(fastq_file, k_size, encoded=packed)
+    results = []
+    for backend in ("networkx", "csr"):
+        tracemalloc.start()
+        start = time.perf_counter()
+        graph = debruijn.build_graph(kmer_dict, backend)
+        build_time = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        nodes = graph.number_of_nodes()
+        start = time.perf_counter()
+        simplify(graph)
+        simplify_time = time.perf_counter() - start
+        results.append((backend, nodes, memory, build_time, simplify_time))
+        print("{0}\t{1}\t{2:.2f}\t{3:.3f}\t{4:.3f}".format(*results[-1]))
+    return results
+
+
+def benchmark_trimming(fastq_file : str, k_size : int, min_quals : list,
+                       min_fragment_length=0, max_bubble_length=100,
+                       max_tip_length=100):
+    """
+    This function compares the assembly of the reads without trimming and
+    trimmed at each minimum quality (see debruijn.ReadTrimmer): bases kept,
+    distinct kmers, graph nodes, time of the counting and of the bounded
+    simplification (bubbles and tips).
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file with sequence
+    k_size: int // size of the kmer
+    min_quals: list of int // minimum qualities
+    min_fragment_length: int // minimum length of the fragments
+    max_bubble_length: int // see debruijn.simplify_bubbles_bounded()
+    max_tip_length: int // see debruijn.clip_tips()
+
+    Return:
+    ------
+    list of tuple // [(min quality or None, bases, distinct kmers,
+                       count seconds, nodes, simplify seconds, contigs)]
+    """
+    offset = debruijn.detect_phred_offset(fastq_file)
+    results = []
+    for min_qual in [None] + min_quals:
+        trim = None
+        if min_qual is not None:
+            trim = debruijn.ReadTrimmer(min_qual, offset, min_fragment_length)
+        start = time.perf_counter()
+        kmer_dict = debruijn.build_kmer_dict(fastq_file, k_size, trim=trim)
+        count_time = time.perf_counter() - start
+        bases = trim.kept_bases if trim else \
+            sum(len(read) for read in debruijn.read_fastq(fastq_file))
+        results.append((min_qual, bases, len(kmer_dict), count_time,
+                        *simplify_bounded(kmer_dict, max_bubble_length,
+                                          max_tip_length)))
+        print("{0}\t{1}\t{2}\t{3:.3f}\t{4}\t{5:.3f}\t{6}".format(
+            "-" if min_qual is None else min_qual, *results[-1][1:]))
+    return results
+
+
+def benchmark_correction(fastq_file : str, k_size : int, solid_counts : list,
+                         threads=1, max_bubble_length=100,
+                         max_tip_length=100):
+    """
+    This function compares the assembly of the reads without correction
+    and corrected with the kmers seen at least each solid count (see
+    debruijn.build_corrected_kmer_dict()): bases corrected, distinct kmers,
+    graph nodes, time of the counting and of the bounded simplification.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file with sequence
+    k_size: int // size of the kmer
+    solid_counts: list of int // minimum occurences of the solid kmers
+    threads: int // number of processes of the counting and correction
+    max_bubble_length: int // see debruijn.simplify_bubbles_bounded()
+    max_tip_length: int // see debruijn.clip_tips()
+
+    Return:
+    ------
+    list of tuple // [(solid count or None, bases corrected, distinct kmers,
+                       count seconds, nodes, simplify seconds, contigs)]
+    """
+    results = []
+    for solid_count in [None] + solid_counts:
+        start = time.perf_counter()
+        if solid_count is None:
+            kmer_dict = debruijn.build_kmer_dict(fastq_file, k_size,
+                                                 threads=threads)
+            corrected = 0
+        else:
+            kmer_dict, report = debruijn.build_corrected_kmer_dict(
+                fastq_file, k_size, solid_count, threads=threads)
+            corrected = report["corrected_bases"]
+        count_time = time.perf_counter() - start
+        results.append((solid_count, corrected, len(kmer_dict), count_time,
+                        *simplify_bounded(kmer_dict, max_bubble_length,
+                                          max_tip_length)))
+        print("{0}\t{1}\t{2}\t{3:.3f}\t{4}\t{5:.3f}\t{6}".format(
+            "-" if solid_count is None else solid_count, *results[-1][1:]))
+    return results
+
+
+def simplify_bounded(kmer_dict, max_bubble_length : int,
+                     max_tip_length : int):
+    """
+    Build the graph of the kmers, solve its bubbles and its tips with the
+    bounded searches and find the contigs: (nodes, seconds, contigs).
+    """
+    graph = debruijn.build_graph(kmer_dict)
+    nodes = graph.number_of_nodes()
+    start = time.perf_counter()
+    graph = debruijn.simplify_bubbles_bounded(graph, max_bubble_length)
+    graph = debruijn.clip_tips(graph, max_tip_length)
+    contigs = debruijn.get_contigs(graph, debruijn.get_starting_nodes(graph),
+                                   debruijn.get_sink_nodes(graph))
+    return nodes, time.perf_counter() - start, len(contigs)
+
+
+def snp_bubble_kmers(n_bubbles : int, spacing : int, k_size : int):
+    """
+    This function simulates the k-mers of a random genome with a SNP every
+    spacing bases: the reference k-mers are seen 10 times and the k-mers of
+    the variant 2 times, each SNP makes a bubble of the de Bruijn graph.
+
+    Parameter:
+    ---------
+    n_bubbles: int // number of SNP
+    spacing: int // distance between 2 SNP, greater than k_size
+    k_size: int // size of the kmer
+
+    Return:
+    ------
+    dict // {kmer: occurrence}
+    """
+    rand = random.Random(9001)
+    genome = [rand.choice("ACGT") for _ in range((n_bubbles + 1) * spacing)]
+    variant = list(genome)
+    for position in range(spacing, len(genome), spacing):
+        variant[position] = rand.choice("ACGT".replace(genome[position], ""))
+    kmer_dict = {}
+    for sequence, count in (("".join(genome), 10), ("".join(variant), 2)):
+        for kmer in debruijn.cut_kmer(sequence, k_size):
+            kmer_dict[kmer] = kmer_dict.get(kmer, 0) + count
+    return kmer_dict
+
+
+def benchmark_bubbles(k_size : int, bubbles : list, spacing : int,
+                      max_bubble_length : int, skip_lca : bool):
+    """
+    This function times simplify_bubbles() and simplify_bubbles_bounded()
+    on graphs with an increasing number of SNP bubbles, and checks that
+    both keep the same contigs.
+
+    Parameter:
+    ---------
+    k_size: int // size of the kmer
+    bubbles: list // numbers of bubbles to try
+    spacing: int // distance between 2 SNP
+    max_bubble_length: int // bound of simplify_bubbles_bounded()
+    skip_lca: boolean // do not time simplify_bubbles()
+
+    Return:
+    ------
+    list of tuple // [(bubbles, nodes, lca seconds, bounded seconds, same
+                      contigs or None)]
+    """
+    results = []
+    for n_bubbles in bubbles:
+        kmer_dict = snp_bubble_kmers(n_bubbles, spacing, k_size)
+        times, contigs = [], []
+        methods = [lambda graph: debruijn.simplify_bubbles_bounded(
+            graph, max_bubble_length)]
+        if not skip_lca:
+            methods.insert(0, debruijn.simplify_bubbles)
+        for method in methods:
+            graph = debruijn.build_graph(kmer_dict)
+            nodes = graph.number_of_nodes()
+            start = time.perf_counter()
+            graph = method(graph)
+            times.append(time.perf_counter() - start)
+            contigs.append(debruijn.get_contigs(
+                graph, debruijn.get_starting_nodes(graph),
+                debruijn.get_sink_nodes(graph)))
+        same = None
+        if skip_lca:
+            times.insert(0, float("nan"))
+        else:
+            same = contigs[0] == contigs[1]
+        results.append((n_bubbles, nodes, times[0], times[-1], same))
+        print("{0}\t{1}\t{2:.3f}\t{3:.3f}\t{4}".format(*results[-1]))
+    return results
+
+
+def simulate_genome(size : int, repeats=0.0, repeat_length=500, seed=9001):
+    """
+    This function generates a random genome. A fraction of it can be made
+    of copies of a few repeats, inserted at random positions.
+
+    Parameter:
+    ---------
+    size: int // genome size in bases
+    repeats: float // fraction of the genome made of repeats
+    repeat_length: int // length of a repeat
+    seed: int // seed of the simulation
+
+    Return:
+    ------
+    str // genome sequence
+    """
+    rand = random.Random(seed)
+    n_copies = int(size * repeats / repeat_length)
+    families = ["".join(rand.choices("ACGT", k=repeat_length))
+                for _ in range(max(1, n_copies // 10))]
+    genome = rand.choices("ACGT", k=size - n_copies * repeat_length)
+    # Insert the copies from the end, so the positions stay valid
+    for position in sorted(rand.choices(range(len(genome) + 1), k=n_copies),
+                           reverse=True):
+        genome[position:position] = rand.choice(families)
+    return "".join(genome)
+
+
+def simulate_reads(genome : str, fastq_file : str, coverage=20.0,
+                   read_length=100, error_rate=0.0, seed=9001):
+    """
+    This function writes reads of the 5' -> 3' strand of the genome, of
+    fixed length and without indel, like the art_illumina command of the
+    README. The substituted bases have a quality of 20, the others 41.
+
+    Parameter:
+    ---------
+    genome: str // genome sequence
+    fastq_file: str // output fastq file
+    coverage: float // mean coverage of the genome
+    read_length: int // length of the reads
+    error_rate: float // probability of substitution of each base
+    seed: int // seed of the simulation
+
+    Return:
+    ------
+    int // number of reads
+    """
+    rand = random.Random(seed)
+    n_reads = int(coverage * len(genome) / read_length)
+    with open(fastq_file, "w") as file:
+        for number in range(n_reads):
+            start = rand.randrange(len(genome) - read_length + 1)
+            read = list(genome[start:start + read_length])
+            quality = ["J"] * read_length
+            if error_rate > 0:
+                for position in range(read_length):
+                    if rand.random() < error_rate:
+                        read[position] = rand.choice(
+                            "ACGT".replace(read[position], ""))
+                        quality[position] = "5"
+            file.write("@read{0}-{1}\n{2}\n+\n{3}\n".format(
+                number, start, "".join(read), "".join(quality)))
+    return n_reads
+
+
+def profile_stages(fastq_file : str, k_size : int, output_file : str,
+                   measures : dict, trace_memory : bool,
+                   max_bubble_length=None, max_tip_length=None):
+    """
+    This function runs the stages of debruijn.main() one after the other
+    and measures each of them: time, or peak of memory allocated by
+    python when trace_memory is True (tracemalloc slows down the stages,
+    so the two are measured by different runs). The measures are added
+    to the dict as soon as each stage ends, so they are kept if a later
+    stage fails.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file with sequence
+    k_size: int // size of the kmer
+    output_file: str // contigs file
+    measures: dict // {stage: seconds or MB}, filled by the function
+    trace_memory: boolean // measure the memory instead of the time
+    max_bubble_length: int // use simplify_bubbles_bounded(), None for
+                              simplify_bubbles()
+    max_tip_length: int // use clip_tips(), None for solve_entry_tips() and
+                           solve_out_tips()
+
+    Return:
+    ------
+    list of tuple // contigs [(contig, len(contig))]
+    """
+    def measure(stage, function, *args):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if trace_memory:
+            measures[stage] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        else:
+            measures[stage] = elapsed
+        return result
+
+    # Same random choices as debruijn.main()
+    random.seed(9001)
+    measure("read_fastq", lambda: sum(
+        1 for _ in debruijn.read_fastq(fastq_file)))
+    kmer_dict = measure("build_kmer_dict", debruijn.build_kmer_dict,
+                        fastq_file, k_size)
+    graph = measure("build_graph", debruijn.build_graph, kmer_dict)
+    del kmer_dict
+    # The tips are searched from the ends of the graph before the bubbles
+    nodes_in = debruijn.get_starting_nodes(graph)
+    nodes_out = debruijn.get_sink_nodes(graph)
+    if max_bubble_length is None:
+        graph = measure("simplify_bubbles", debruijn.simplify_bubbles, graph)
+    else:
+        graph = measure("simplify_bubbles", debruijn.simplify_bubbles_bounded,
+                        graph, max_bubble_length)
+    if max_tip_length is None:
+        graph = measure("solve_entry_tips", debruijn.solve_entry_tips,
+                        graph, nodes_in)
+        graph = measure("solve_out_tips", debruijn.solve_out_tips, graph,
+                        nodes_out)
+    else:
+        graph = measure("clip_tips", debruijn.clip_tips, graph,
+                        max_tip_length)
+    contigs = measure("get_contigs", lambda: debruijn.get_contigs(
+        graph, debruijn.get_starting_nodes(graph),
+        debruijn.get_sink_nodes(graph)))
+    measure("save_contigs", debruijn.save_contigs, contigs, output_file)
+    return contigs
+
+
+def benchmark_suite(args):
+    """
+    This function simulates a genome and reads for each genome size and
+    error rate (or uses the given fastq file), then profiles each stage
+    with profile_stages().
+
+    Parameter:
+    ---------
+    args: object // arguments of the suite subcommand
+
+    Return:
+    ------
+    dict // parameters and measures of each run, for the JSON output
+    """
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        if args.fastq_file:
+            runs.append(run_suite_dataset(
+                args, {"fastq_file": args.fastq_file}, args.fastq_file,
+                directory))
+        for genome_size in [] if args.fastq_file else args.genome_sizes:
+            genome = simulate_genome(genome_size, args.repeats,
+                                     args.repeat_length, args.seed)
+            for error_rate in args.error_rates:
+                fastq_file = os.path.join(directory, "reads.fq")
+                n_reads = simulate_reads(genome, fastq_file, args.coverage,
+                                         args.read_length, error_rate,
+                                         args.seed)
+                parameters = {
+                    "genome_size": genome_size, "repeats": args.repeats,
+                    "repeat_length": args.repeat_length,
+                    "coverage": args.coverage,
+                    "read_length": args.read_length,
+                    "error_rate": error_rate, "reads": n_reads,
+                    "seed": args.seed}
+                runs.append(run_suite_dataset(args, parameters, fastq_file,
+                                              directory))
+    return {"python": platform.python_version(),
+            "platform": platform.platform(), "cpu": os.cpu_count(),
+            "runs": runs}
+
+
+def run_suite_dataset(args, parameters : dict, fastq_file : str,
+                      directory : str):
+    """Profile the stages on one fastq file, see benchmark_suite()"""
+    output_file = os.path.join(directory, "contigs.fasta")
+    seconds, peaks, contigs, error = {}, {}, [], None
+    try:
+        contigs = profile_stages(fastq_file, args.kmer_size, output_file,
+                                 seconds, False, args.max_bubble_length,
+                                 args.max_tip_length)
+        if args.memory:
+            profile_stages(fastq_file, args.kmer_size, output_file, peaks,
+                           True, args.max_bubble_length, args.max_tip_length)
+    except Exception as error_stage: # pylint: disable=broad-except
+        # Keep the stages measured before the failure
+        tracemalloc.stop()
+        error = "{0}: {1}".format(type(error_stage).__name__, error_stage)
+    stages = [{"stage": stage, "seconds": round(value, 6)}
+              for stage, value in seconds.items()]
+    for stage in stages:
+        if stage["stage"] in peaks:
+            stage["peak_mb"] = round(peaks[stage["stage"]], 3)
+    lengths = [length for _, length in contigs]
+    result = dict(parameters, kmer_size=args.kmer_size,
+                  max_bubble_length=args.max_bubble_length,
+                  max_tip_length=args.max_tip_length,
+                  fastq_bytes=os.path.getsize(fastq_file), stages=stages,
+                  error=error, contigs=len(lengths),
+                  assembly_length=sum(lengths),
+                  longest_contig=max(lengths, default=0),
+                  n50=debruijn.n50(lengths))
+    print(" ".join("{0}={1:.3f}s".format(stage["stage"], stage["seconds"])
+                   for stage in stages), error or "", file=sys.stderr)
+    return result
+
+
+#==============================================================
+# Main program
+#==============================================================
+def main():
+    """
+    Main program function
+    """
+    args = get_arguments()
+
+    if args.benchmark == 'parallel':
+        with tempfile.TemporaryDirectory() as directory:
+            fastq_file = args.fastq_file
+            if args.size > 0:
+                fastq_file = replicate_fastq(fastq_file, args.size, directory)
+            print("{0}: {1:.1f} MB, {2} CPU".format(
+                fastq_file, os.path.getsize(fastq_file) / 1e6,
+                os.cpu_count()))
+            print("threads\tseconds\tspeedup")
+            benchmark_parallel(fastq_file, args.kmer_size, args.threads,
+                               args.packed)
+    elif args.benchmark == 'backends':
+        print("backend\tnodes\tMB\tbuild\tsimplify")
+        benchmark_backends(args.fastq_file, args.kmer_size, args.packed)
+    elif args.benchmark == 'bubbles':
+        print("bubbles\tnodes\tlca\tbounded\tsame contigs")
+        benchmark_bubbles(args.kmer_size, args.bubbles, args.spacing,
+                          args.max_bubble_length, args.skip_lca)
+    elif args.benchmark == 'trimming':
+        print("min_qual\tbases\tkmers\tcount\tnodes\tsimplify\tcontigs")
+        benchmark_trimming(args.fastq_file, args.kmer_size, args.min_quals,
+                           args.min_fragment_length, args.max_bubble_length,
+                           args.max_tip_length)
+    elif args.benchmark == 'correction':
+        print("solid\tcorrected\tkmers\tcount\tnodes\tsimplify\tcontigs")
+        benchmark_correction(args.fastq_file, args.kmer_size,
+                             args.solid_counts, args.threads,
+                             args.max_bubble_length, args.max_tip_length)
+    elif args.benchmark == 'suite':
+        results = benchmark_suite(args)
+        if args.json_file:
+            with open(args.json_file, "w") as file:
+                json.dump(results, file, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,15 +13,39 @@
 
 """Perform assembly based on debruijn graph."""
 # Modul importation
+import heapq
 import random
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextlib import redirect_stdout
+from itertools import chain
+from itertools import islice
 from random import randrange
 from random import randint
 import statistics
 import argparse
+import cProfile
+import gzip
+import hashlib
+import json
+import mmap
 import os
+import re
+import shutil
+import struct
 import sys
-import matplotlib.pyplot as plt
+import tempfile
+import time
+import tracemalloc
+from types import MappingProxyType
 import networkx as nx
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
 
 # Set random seed
 random.seed(9001)
@@ -35,6 +59,35 @@ __maintainer__ = "Lynda"
 __email__ = "lyndamessad96@gmail.com"
 __status__ = "Developpement"
 
+# 2-bit code of each nucleotide used by the packed k-mer representation
+NUCLEOTIDES = "ACGT"
+NUCLEOTIDE_CODE = {base: code for code, base in enumerate(NUCLEOTIDES)}
+# Packed k-mers are stored as unsigned 64 bits integers
+MAX_PACKED_KMER_SIZE = 32
+# Size of the blocks read from fastq files
+FASTQ_BLOCK_SIZE = 1 << 22
+# Hashes of the count-min sketch are computed on 64 bits
+HASH_MASK = (1 << 64) - 1
+# Smallest width of the count-min sketch rows, and largest count of their
+# one byte counters
+MIN_SKETCH_WIDTH = 1 << 10
+MAX_SKETCH_COUNT = 255
+# Multiplier of the hashes of the minimizers (odd, 64 bits)
+MINIMIZER_HASH = 0x9E3779B97F4A7C15
+# Bytes of a distinct kmer while a partition is counted, and most partitions
+EXTERNAL_KMER_BYTES = 16
+MAX_PARTITIONS = 512
+NON_NUCLEOTIDES = re.compile("[^ACGT]+")
+NUCLEOTIDE_RUNS = re.compile(b"[ACGT]+")
+# Phred+64 qualities are never lower than ";" (Solexa -5), Phred+33 ones
+# higher than "K" (Q42) are unusual for Illumina reads
+PHRED_64_MIN = ord(";")
+PHRED_33_MAX = ord("K")
+# Header of a k-mer table file: magic, kmer size, version, number of kmers,
+# sha256 of the fastq file, padding to align the arrays on 64 bytes
+KMER_TABLE_MAGIC = b"DBGKMERS"
+KMER_TABLE_HEADER = struct.Struct("<8sIIQ32s8x")
+
 def isfile(path):
     """Check if path is an existing file.
         Parameters:
@@ -50,6 +103,21 @@ def isfile(path):
     return path
 
 
+def kmer_sizes(text):
+    """
+    Parse a kmer size or a comma separated list of kmer sizes, the sizes
+    repeated being kept once (in order).
+    """
+    try:
+        sizes = [int(value) for value in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a comma separated list of integers".format(text))
+    if min(sizes) < 2:
+        raise argparse.ArgumentTypeError("k-mer sizes must be at least 2")
+    return list(dict.fromkeys(sizes))
+
+
 def get_arguments():
     """Retrieves the arguments of the program.
       Returns: An object that contains the arguments
@@ -59,403 +127,3215 @@ def get_arguments():
                                      "{0} -h"
                                      .format(sys.argv[0]))
     parser.add_argument('-i', dest='fastq_file', type=isfile,
-                        required=True, help="Fastq file")
-    parser.add_argument('-k', dest='kmer_size', type=int,
-                        default=21, help="K-mer size (default 21)")
+                        help="Fastq file (required without --load-kmers)")
+    parser.add_argument('-k', dest='kmer_sizes', type=kmer_sizes,
+                        default=[21], help="K-mer size (default 21), or comma "
+                        "separated sizes to assemble with each of them and "
+                        "keep the best assembly")
     parser.add_argument('-o', dest='output_file', type=str,
                         default=os.curdir + os.sep + "contigs.fasta",
-                        help="Output contigs in fasta file")
-    return parser.parse_args()
+                        help="Output contigs in fasta file (gzip "
+                        "compressed if it ends with .gz)")
+    parser.add_argument('--packed', dest='packed', action='store_true',
+                        help="Store k-mers as 2-bit packed integers "
+                        "(k <= {0})".format(MAX_PACKED_KMER_SIZE))
+    parser.add_argument('--engine', dest='engine', type=str, default="python",
+                        choices=["python", "numpy"],
+                        help="K-mer counting engine (default python)")
+    parser.add_argument('--min-count', dest='min_count', type=int, default=1,
+                        help="Drop k-mers seen less than this number of "
+                        "times, with a count-min sketch pre-pass when they "
+                        "are counted (at most 255, default 1)")
+    parser.add_argument('--sketch-memory', dest='sketch_memory', type=float,
+                        default=64, help="Memory of the count-min sketch in "
+                        "MB (default 64)")
+    parser.add_argument('--graph-backend', dest='graph_backend', type=str,
+                        default="networkx",
+                        choices=["networkx", "tracked", "csr"],
+                        help="Graph data structure (default networkx)")
+    parser.add_argument('--compact', dest='compact', action='store_true',
+                        help="Merge non-branching paths of the graph in "
+                        "unitigs before simplification")
+    parser.add_argument('--threads', dest='threads', type=int, default=1,
+                        help="Number of processes counting k-mers (not "
+                        "with --load-kmers), simplifying the components "
+                        "(--components) and compressing the contigs "
+                        "(default 1)")
+    parser.add_argument('--max-bubble-length', dest='max_bubble_length',
+                        type=int, default=None,
+                        help="Find bubbles by a breadth-first search bounded "
+                        "to this length from each branching node (default: "
+                        "lowest common ancestor of each merging node)")
+    parser.add_argument('--max-tip-length', dest='max_tip_length', type=int,
+                        default=None,
+                        help="Remove all tips in one pass, up to this length "
+                        "(2 * k for instance)")
+    parser.add_argument('--tip-coverage-ratio', dest='tip_coverage_ratio',
+                        type=float, default=1.0,
+                        help="With --max-tip-length, keep the tips with a "
+                        "coverage above this ratio of the best branch "
+                        "(default 1.0)")
+    parser.add_argument('--metrics-json', dest='metrics_json', type=str,
+                        default=None, help="Write the time, memory and "
+                        "counters of each stage in this JSON file")
+    parser.add_argument('--tracemalloc', dest='tracemalloc',
+                        action='store_true', help="Trace the python "
+                        "allocations of each stage (slower)")
+    parser.add_argument('--profile-stage', dest='profile_stage', type=str,
+                        default=None, choices=Metrics.STAGES,
+                        help="Run this stage under cProfile")
+    parser.add_argument('--profile-output', dest='profile_output', type=str,
+                        default=None, help="cProfile statistics file "
+                        "(default: <stage>.prof)")
+    parser.add_argument('--save-kmers', dest='save_kmers', type=str,
+                        default=None, help="Write the k-mer counts in this "
+                        "binary table file")
+    parser.add_argument('--load-kmers', dest='load_kmers', type=isfile,
+                        default=None, help="Map the k-mer counts of a table "
+                        "written by --save-kmers instead of counting them "
+                        "(checked against -i if given)")
+    parser.add_argument('--manifest', dest='manifest', type=isfile,
+                        default=None, help="Assemble each sample of this "
+                        "file (lines: fastq, k-mer size, contigs file, "
+                        "separated by tabs) in --threads worker processes, "
+                        "with the other options of the command line")
+    parser.add_argument('--job-timeout', dest='job_timeout', type=float,
+                        default=None, help="With --manifest, stop a sample "
+                        "after this number of seconds")
+    parser.add_argument('--summary', dest='summary', type=str, default=None,
+                        help="With --manifest, also write the summary table "
+                        "in this file")
+    parser.add_argument('--plot', dest='plot', type=str, default=None,
+                        help="Draw the simplified graph around --plot-node "
+                        "in this image file (needs matplotlib)")
+    parser.add_argument('--plot-node', dest='plot_node', type=str,
+                        default=None, help="Sequence of the node to draw "
+                        "around (default: the node with most neighbors)")
+    parser.add_argument('--plot-max-nodes', dest='plot_max_nodes', type=int,
+                        default=200, help="Number of nodes drawn around "
+                        "--plot-node (default 200)")
+    parser.add_argument('--gfa', dest='gfa', type=str, default=None,
+                        help="Write the simplified graph in this GFA1 file")
+    parser.add_argument('--gfa-stages', dest='gfa_stages',
+                        action='store_true', help="With --gfa, also write "
+                        "the graph after each stage in <gfa>.<stage>.gfa "
+                        "(build_graph is the graph before simplification)")
+    parser.add_argument('--max-memory', dest='max_memory', type=float,
+                        default=None, help="Count the packed k-mers on disk, "
+                        "by partitions counted within this memory in MB")
+    parser.add_argument('--partitions', dest='partitions', type=int,
+                        default=None, help="With --max-memory, number of "
+                        "partitions (default: from the fastq size)")
+    parser.add_argument('--temp-dir', dest='temp_dir', type=str,
+                        default=None, help="With --max-memory, directory of "
+                        "the temporary files (default: system's)")
+    parser.add_argument('--components', dest='components',
+                        action='store_true', help="Simplify each weakly "
+                        "connected component of the graph and find its "
+                        "contigs apart, in --threads processes")
+    parser.add_argument('--node-ids', dest='node_ids', action='store_true',
+                        help="Number the (k-1)-mers nodes, their sequences "
+                        "being stored once")
+    parser.add_argument('--min-qual', dest='min_qual', type=int,
+                        default=None, help="Split the reads at their bases "
+                        "of lower quality and at their N before cutting "
+                        "the k-mers (default: no trimming)")
+    parser.add_argument('--phred-offset', dest='phred_offset', type=int,
+                        choices=[33, 64], default=None, help="With "
+                        "--min-qual, offset of the qualities (default: "
+                        "detected from the first reads)")
+    parser.add_argument('--min-fragment-length', dest='min_fragment_length',
+                        type=int, default=0, help="With --min-qual, drop the "
+                        "fragments of reads shorter than this (default 0, "
+                        "those shorter than k have no k-mer anyway)")
+    parser.add_argument('--kmers-saved', dest='kmers_saved',
+                        action='store_true', help="With --min-qual, report "
+                        "the distinct k-mers of the reads missing from the "
+                        "counts of the fragments (they are all kept in "
+                        "memory)")
+    parser.add_argument('--correct', dest='correct', action='store_true',
+                        help="Correct the substitutions of the reads with "
+                        "the solid k-mers of a first count before counting "
+                        "them again")
+    parser.add_argument('--solid-count', dest='solid_count', type=int,
+                        default=3, help="With --correct, minimum occurence "
+                        "of the solid k-mers (default 3)")
+    args = parser.parse_args()
+    if args.fastq_file is None and args.load_kmers is None and \
+        args.manifest is None:
+        parser.error("the following arguments are required: -i")
+    if len(args.kmer_sizes) > 1 and (args.load_kmers or args.save_kmers):
+        parser.error("--load-kmers and --save-kmers need a single -k")
+    if len(args.kmer_sizes) > 1 and args.max_memory:
+        parser.error("--max-memory needs a single -k")
+    if len(args.kmer_sizes) > 1 and args.plot:
+        parser.error("--plot needs a single -k")
+    # Options of a single assembly, assemble_sample() has no use of them
+    single = [option for option, value in (
+        ("-i", args.fastq_file), ("--gfa", args.gfa), ("--plot", args.plot),
+        ("--metrics-json", args.metrics_json),
+        ("--tracemalloc", args.tracemalloc),
+        ("--profile-stage", args.profile_stage)) if value]
+    if args.manifest and single:
+        parser.error("{0} {1} not available with --manifest".format(
+            ", ".join(single), "is" if len(single) == 1 else "are"))
+    if args.manifest and (len(args.kmer_sizes) > 1 or args.load_kmers or
+                          args.save_kmers):
+        parser.error("--manifest needs a single -k, without --load-kmers "
+                     "and --save-kmers")
+    if (args.packed or args.max_memory) and \
+            max(args.kmer_sizes) > MAX_PACKED_KMER_SIZE:
+        parser.error("--packed and --max-memory need k <= {0}".format(
+            MAX_PACKED_KMER_SIZE))
+    if args.min_count > MAX_SKETCH_COUNT:
+        parser.error("--min-count must be at most {0}".format(
+            MAX_SKETCH_COUNT))
+    if args.min_qual is not None and not 0 <= args.min_qual <= 93:
+        parser.error("--min-qual must be between 0 and 93")
+    if args.min_qual is not None and args.load_kmers:
+        parser.error("--min-qual is not available with --load-kmers")
+    if args.engine != "python" and args.load_kmers:
+        parser.error("--engine is not available with --load-kmers")
+    if args.kmers_saved and (args.min_qual is None or
+                             len(args.kmer_sizes) > 1 or args.manifest or
+                             args.min_count > 1 or args.correct):
+        parser.error("--kmers-saved needs --min-qual and a single -k, "
+                     "without --manifest, --min-count and --correct")
+    if args.correct and (len(args.kmer_sizes) > 1 or args.max_memory or
+                         args.load_kmers):
+        parser.error("--correct needs a single -k, without --max-memory "
+                     "and --load-kmers")
+    args.kmer_size = args.kmer_sizes[0]
+    return args
 
 
-def read_fastq(fastq_file : str):
-    """ This function is used to generate a sequence's generator from
-    the fastq file.
+def is_gzip(fastq_file : str):
+    """Check if a file is gzip (or bgzip) compressed from its magic number"""
+    with open(fastq_file, "rb") as file:
+        return file.read(2) == b"\x1f\x8b"
+
+
+def open_fastq(fastq_file : str):
+    """
+    This function opens a fastq file in binary mode, gzip and bgzip (a
+    series of gzip members) files are decompressed on the fly.
+
     Parameter:
     ---------
-    fastq_file: str// fastq file with all sequences
+    fastq_file: str// plain or gzip compressed fastq file
 
     Return:
     ------
-    sequences generator
+    binary file object
     """
-    with open(fastq_file) as file:
-        for _ in enumerate(file): #parcourir les lines du fichier fastq
-            yield next(file)[:-1]  # prend pas la derniere ligne du fichier
-            next(file)
-            next(file)
+    if is_gzip(fastq_file):
+        return gzip.open(fastq_file, "rb")
+    return open(fastq_file, "rb")
 
 
-def cut_kmer(sequence : str, k_size : int):
+def _decode_sequences(lines : list):
+    """Decode the sequence lines of a block at once"""
+    text = b"\n".join(lines).decode()
+    if "\r" in text:
+        text = text.replace("\r", "")
+    return text.split("\n")
+
+
+def detect_phred_offset(fastq_file : str, n_reads=10000):
     """
-    This fiunction is used to genearte kmers from the sequences contained
-    in the fastq file.
+    This function guesses the offset of the qualities of a fastq file from
+    its first records: 33 if a quality is lower than ";", 64 if one is
+    higher than "K", 33 (the current standard) when both are possible.
 
     Parameter:
     ---------
-    sequence: str
-    k_size: int // size of the kmer we want to split with
+    fastq_file: str// fastq file, may be gzip compressed
+    n_reads: int // number of records read
 
     Return:
     ------
-    kmers's generator
+    int // 33 or 64
     """
-    for i in range(len(sequence)-k_size+1):
-        yield sequence[i:i+k_size]
+    lowest, highest = 255, 0
+    with open_fastq(fastq_file) as file:
+        for quality in islice(file, 3, 4 * n_reads, 4):
+            quality = quality.rstrip(b"\r\n")
+            if quality:
+                lowest = min(lowest, min(quality))
+                highest = max(highest, max(quality))
+    if lowest >= PHRED_64_MIN and highest > PHRED_33_MAX:
+        return 64
+    return 33
 
 
-def build_kmer_dict(fastq_file : str, k_size : int):
+class ReadTrimmer:
+    """
+    Quality trimming of the reads before their kmers are cut: each read is
+    split at its bases of quality lower than min_qual and at its bases
+    other than A, C, G and T (N), the fragments shorter than min_length are
+    dropped. The reads and bases seen and kept are counted and, with
+    k_size (--kmers-saved), the distinct kmers of the reads which are not in
+    the fragments are kept (lost_kmers, one string each). Without min_qual,
+    the reads are only counted.
     """
-    This function is used to calculate  the number of occurence of
-    kmers in a fq file.
-    We use the functions cut_kmer() and read_fastq()
 
-    Parameter:
-    ---------
-    fastq_file: str// fastq file with sequence
-    k_size: int // size of the kmer we want to split with
+    def __init__(self, min_qual : int, offset=33, min_length=1, k_size=None):
+        if min_qual is not None and not 0 <= min_qual <= 126 - offset:
+            raise ValueError("quality {0} out of the range of Phred+{1}"
+                             .format(min_qual, offset))
+        self.min_qual = min_qual
+        self.offset = offset
+        self.min_length = max(1, min_length)
+        # Runs of qualities from min_qual to "~"
+        self._good = None if min_qual is None else re.compile(
+            b"[" + re.escape(bytes([offset + min_qual])) + b"-~]+")
+        self.k_size = k_size
+        self.lost_kmers = set() if k_size else None
+        self.reads = 0
+        self.bases = 0
+        self.fragments = 0
+        self.kept_bases = 0
 
-    Return:
-    ------
-    kmer_dico: dictionary
-        keys: kmer, values: nombre d'occurence of the kmer in the fastq file
-    """
-    dict_kmear = {}
+    def copy(self):
+        """Trimmer of the same parameters, nothing counted"""
+        return ReadTrimmer(self.min_qual, self.offset, self.min_length,
+                           self.k_size)
 
-    for seq in read_fastq(fastq_file):
-        for k_mear in cut_kmer(seq, k_size):
-            if k_mear not in dict_kmear.keys():
-                dict_kmear[k_mear] = 1
-            else:
-                dict_kmear[k_mear] += 1
+    def merge(self, other):
+        """Add the counts and lost kmers of another trimmer (a copy)"""
+        self.reads += other.reads
+        self.bases += other.bases
+        self.fragments += other.fragments
+        self.kept_bases += other.kept_bases
+        if self.lost_kmers is not None:
+            self.lost_kmers.update(other.lost_kmers)
 
-    return dict_kmear
+    def __call__(self, sequences : list, qualities : list):
+        """
+        Trim the sequence lines of a block with their quality lines (bytes)
+        and return the fragments kept (str).
+        """
+        if self._good is None:
+            sequences = _decode_sequences(sequences)
+            bases = sum(len(sequence) for sequence in sequences)
+            self.reads += len(sequences)
+            self.bases += bases
+            self.fragments += len(sequences)
+            self.kept_bases += bases
+            return sequences
+        fragments = []
+        for sequence, quality in zip(sequences, qualities):
+            sequence = sequence.rstrip(b"\r")
+            self.bases += len(sequence)
+            spans = [fragment.span() for run in self._good.finditer(quality)
+                     for fragment in NUCLEOTIDE_RUNS.finditer(
+                         sequence, run.start(), run.end())
+                     if fragment.end() - fragment.start() >= self.min_length]
+            fragments.extend(sequence[start:end] for start, end in spans)
+            if self.lost_kmers is not None and \
+                    spans != [(0, len(sequence))]:
+                self._lose_kmers(sequence.decode(), spans)
+        self.reads += len(sequences)
+        self.fragments += len(fragments)
+        self.kept_bases += sum(len(fragment) for fragment in fragments)
+        return b"\n".join(fragments).decode().split("\n") if fragments \
+            else []
 
+    def _lose_kmers(self, sequence : str, spans : list):
+        """Keep the kmers of a read which are in none of its fragments"""
+        kept = set()
+        for start, end in spans:
+            kept.update(range(start, end - self.k_size + 1))
+        self.lost_kmers.update(
+            sequence[i:i + self.k_size]
+            for i in range(len(sequence) - self.k_size + 1) if i not in kept)
 
-def build_graph(k_mer_dict : dict):
-    """
-    This function creats the kmer's graph.
-    It deppends of the kmer preffix,suffix and the weight.
-    Weight: occurence of the kmer
+    def kmers_saved(self, kmer_dict):
+        """
+        Number of distinct kmers which the reads would add to the kmers
+        counted from the fragments (kmer_dict) without trimming. Packed
+        kmers are compared with the kmers of A, C, G and T only.
+        """
+        encoded = isinstance(kmer_dict, KmerTable)
+        return sum(1 for kmer in self.lost_kmers if kmer not in kmer_dict and
+                   not (encoded and NON_NUCLEOTIDES.search(kmer)))
 
-    Parameter:
-    ---------
-    km_mear_dict: dictionary //
-        dictionary of kmer gets from build_kmer_dict() function
+    def report(self):
+        """Counts of the reads and bases seen and kept (dictionary)"""
+        return {"reads": self.reads, "bases": self.bases,
+                "fragments": self.fragments, "kept_bases": self.kept_bases,
+                "trimmed_bases": self.bases - self.kept_bases}
 
-    Return:
-    ------
-    g: nx DiGraph : name = kmers_graph_kmer_size.png
+
+def read_trimmer(args, fastq_file : str, k_size=None):
     """
-    graph = nx.DiGraph()
+    ReadTrimmer of the options --min-qual, --phred-offset and
+    --min-fragment-length for a fastq file, None without --min-qual. With
+    k_size, it keeps the kmers lost by the trimming.
+    """
+    if args.min_qual is None:
+        return None
+    offset = args.phred_offset or detect_phred_offset(fastq_file)
+    return ReadTrimmer(args.min_qual, offset, args.min_fragment_length,
+                       k_size)
 
-    for key in k_mer_dict:
-        graph.add_edge(key[:-1], key[1:], weight = k_mer_dict[key])
 
-    return graph
+def report_trimming(trim, metrics, kmer_dict=None):
+    """
+    Print the counts of a ReadTrimmer after the counting of the kmers
+    (kmer_dict, unfiltered, to which the lost kmers are compared) and add
+    them to the counters of the metrics. Only the reads and bases of a
+    trimmer without min_qual are counted.
+    """
+    report = trim.report()
+    if trim.min_qual is None:
+        metrics.count("reads", report["reads"])
+        metrics.count("bases", report["bases"])
+        return
+    message = "Quality trimming (Q{0}, Phred+{1}): {2} bases of {3} kept in " \
+        "{4} fragments of {5} reads, {6} bases removed".format(
+            trim.min_qual, trim.offset, report["kept_bases"], report["bases"],
+            report["fragments"], report["reads"], report["trimmed_bases"])
+    if kmer_dict is not None and trim.lost_kmers is not None:
+        report["distinct_kmers_saved"] = trim.kmers_saved(kmer_dict)
+        message += ", {0} distinct k-mers saved".format(
+            report["distinct_kmers_saved"])
+    for name, value in report.items():
+        metrics.count(name, value)
+    print(message + "\n")
 
 
-def get_starting_nodes(graph):
+def read_fastq_blocks(fastq_file : str, block_size=FASTQ_BLOCK_SIZE,
+                      start=0, end=None, trim=None):
     """
-    This function generats the starting nodes.
+    This function generates the sequences of a fastq file by blocks: the
+    file is read block_size bytes at a time and the records are split with
+    one bytes.split() per block instead of one python step per line.
 
     Parameter:
     ---------
-    graph: nx DiGraph// generated by the build_graph() function.
+    fastq_file: str// fastq file with all sequences, may be gzip compressed
+    block_size: int // number of bytes read at once
+    start: int // offset of the first record (plain files only)
+    end: int // offset after the last record, None for the end of file
+    trim: ReadTrimmer // if given, the fragments of the reads it keeps are
+                         generated instead of the reads
 
     Return:
     ------
-    start_nodes: list // list of starting nodes found in the graph
+    generator of lists of sequences, one list per block
     """
-    start_nodes = []
-
-    for node in graph.nodes:
-        if len(graph.pred[node]) == 0:
-        #Returns an iterator over predecessor nodes of n.
-            start_nodes.append(node)
-
-    return start_nodes
+    with open_fastq(fastq_file) as file:
+        if start:
+            file.seek(start)
+        remaining = -1 if end is None else end - start
+        rest = b""
+        while remaining != 0:
+            block = file.read(block_size if remaining < 0
+                              else min(block_size, remaining))
+            if not block:
+                break
+            if remaining > 0:
+                remaining -= len(block)
+            lines = (rest + block).split(b"\n")
+            # Keep the incomplete record for the next block
+            n_lines = (len(lines) - 1) // 4 * 4
+            rest = b"\n".join(lines[n_lines:])
+            if n_lines and trim is not None:
+                yield trim(lines[1:n_lines:4], lines[3:n_lines:4])
+            elif n_lines:
+                yield _decode_sequences(lines[1:n_lines:4])
+        # Last record without final line return
+        lines = rest.rstrip(b"\r\n").split(b"\n")
+        if len(lines) > 1 and trim is not None:
+            yield trim(lines[1::4], lines[3::4])
+        elif len(lines) > 1:
+            yield _decode_sequences(lines[1::4])
 
 
-def get_sink_nodes(graph):
+def read_fastq_batches(fastq_file : str, batch_size=None, trim=None):
     """
-    This function generats the sink nodes.
+    This function generates the sequences of a fastq file by lists.
 
     Parameter:
     ---------
-    graph: nx DiGraph// generated by the build_graph() function.
+    fastq_file: str// fastq file with all sequences, may be gzip compressed
+    batch_size: int // number of sequences per list, None for the lists of
+                       read_fastq_blocks()
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
 
     Return:
     ------
-    sink_nodes: list // list of sink nodes found in the graph
+    generator of lists of sequences
     """
+    if batch_size is None:
+        return read_fastq_blocks(fastq_file, trim=trim)
+    return batch_sequences(read_fastq(fastq_file, trim), batch_size)
 
-    sink_nodes = []
-    for node in graph.nodes:
-        if len(graph.succ[node]) == 0:
-            sink_nodes.append(node)
 
-    return sink_nodes
+def read_fastq(fastq_file : str, trim=None):
+    """ This function is used to generate a sequence's generator from
+    the fastq file (see read_fastq_blocks()).
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with all sequences, may be gzip compressed
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    sequences generator
+    """
+    for sequences in read_fastq_blocks(fastq_file, trim=trim):
+        yield from sequences
 
 
-def get_contigs(graph, start_nodes : list, sink_nodes : list):
+def encode_kmer(kmer : str):
     """
-    This function generats a list of tuples that contains the
-    contig and it's length.
+    This function packs a kmer in an integer, 2 bits per nucleotide.
 
     Parameter:
     ---------
-    graph: nx DiGraph// generated by the build_graph() function.
-    start_nodes : list// list of starting nodes found in the graph.
-                        Generated by the function get_starting_nodes()
-
-    sink_nodes: list// list of sink nodes found in the graph.
-                    Generated by the function get_sink_nodes()
+    kmer: str // kmer made of A, C, G and T only
 
     Return:
     ------
-    contigs_list: list of tuple// liste of tuple [(contig,len(contig))]
+    int // packed kmer, the first nucleotide in the most significant bits
     """
-    contigs_list = []
-    for start in start_nodes: #start : source
-        for sink in sink_nodes: #sink : target
-            #Generate all simple paths in the graph G from
-                # source(start) to target (skin)
-            paths = list(nx.all_simple_paths(graph, start, sink))
-            if paths:  #!= None ! -> returns True
-                contig = paths[0][0]
-                for i in range(1, len(paths[0])):
-                    contig += paths[0][i][-1]
-                contigs_list.append((contig, len(contig)))
-
-    return contigs_list
+    code = 0
+    for base in kmer:
+        code = (code << 2) | NUCLEOTIDE_CODE[base]
+    return code
 
 
-def save_contigs(contigs : list, output_file : str):
+def decode_kmer(code : int, k_size : int):
     """
-    This function creats the kmer's graph.
-    It deppends of the kmer preffix,suffix and the weight.
-    Weight: occurence of the kmer
+    This function unpacks a kmer encoded by encode_kmer().
 
     Parameter:
     ---------
-    contig: list of tuple// liste of tuple [(contig,len(contig))]
-    output_file : str // name of the output file
+    code: int // packed kmer
+    k_size: int // size of the kmer
 
     Return:
     ------
-    file : str // output file in fasta format generated by the functon fill()
+    str // the kmer sequence
     """
-    with open(output_file, "w") as file:
-        for contig, length in enumerate(contigs):
-            line = ">contig_" + str(contig) + " len=" + str(length[1]) + "\n"
-            file.write(line)
-            file.write(fill(length[0]))
-            file.write("\n")
+    bases = []
+    for _ in range(k_size):
+        bases.append(NUCLEOTIDES[code & 3])
+        code >>= 2
+    return "".join(reversed(bases))
 
 
-def fill(text, width=80):
-    """Split text with a line return to respect fasta format"""
-    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+def check_packed_kmer_size(k_size : int):
+    """Raise a ValueError if k_size does not fit in a packed kmer"""
+    if not 0 < k_size <= MAX_PACKED_KMER_SIZE:
+        raise ValueError("Packed kmers need 0 < k <= {0}, got {1}"
+                         .format(MAX_PACKED_KMER_SIZE, k_size))
 
 
-def std(liste : list):
+def cut_kmer(sequence : str, k_size : int, encoded=False):
     """
-    This function calculats the standart deviation.
-    If std > 0 so there is no variation between lenght and weight of paths.
+    This fiunction is used to genearte kmers from the sequences contained
+    in the fastq file.
+    With encoded=True, the kmers are 2-bit packed integers rolled along the
+    sequence, windows with a base other than A, C, G or T are skipped.
 
     Parameter:
     ---------
-    liste: list of values
+    sequence: str
+    k_size: int // size of the kmer we want to split with
+    encoded: boolean // if True, generate packed kmers (see encode_kmer())
 
     Return:
     ------
-    float // the standart deviation of the liste
+    kmers's generator
     """
+    if not encoded:
+        for i in range(len(sequence)-k_size+1):
+            yield sequence[i:i+k_size]
+        return
 
-    return statistics.stdev(liste)
+    check_packed_kmer_size(k_size)
+    mask = (1 << (2 * k_size)) - 1
+    code = 0
+    valid = 0 # number of valid bases at the end of the current window
+    for base in sequence:
+        base_code = NUCLEOTIDE_CODE.get(base)
+        if base_code is None:
+            valid = 0
+            continue
+        code = ((code << 2) | base_code) & mask
+        valid += 1
+        if valid >= k_size:
+            yield code
 
 
-def path_average_weight(graph, path : list):
+class NodeDictionary:
+    """
+    (k-1)-mers of a graph interned as dense integer ids 0, 1, 2...: the
+    sequences are stored once, end to end, in a bytearray and read back by
+    id. The index from sequence to id is only kept while the graph is built
+    (see freeze()).
     """
-    This function calculats the average weight of the path gived in parameter.
 
-    Parameter:
-    ---------
-    graph : object networkx DiGraph()
-    path: list // path of de graph.
+    def __init__(self):
+        self.size = 0
+        self.buffer = bytearray()
+        self._ids = {}
 
-    Return:
-    ------
-    path with average weight
-    """
-    weight = []
+    def add(self, sequence : str):
+        """Return the id of sequence, a new one for an unknown sequence"""
+        if self._ids is None:
+            raise ValueError("the node dictionary is frozen")
+        node = self._ids.get(sequence)
+        if node is None:
+            self.size = len(sequence)
+            node = self._ids[sequence] = len(self._ids)
+            self.buffer += sequence.encode("ascii")
+        return node
 
-    for i in range(len(path) - 1):
-        weight.append(graph.get_edge_data(path[i], path[i+1])["weight"])
+    def freeze(self):
+        """Drop the index: ids can still be read, not added"""
+        self._ids = None
 
-    return statistics.mean(weight)
+    def __getitem__(self, node : int):
+        start = node * self.size
+        return self.buffer[start:start + self.size].decode("ascii")
 
+    def last_base(self, node : int):
+        """Last nucleotide of the sequence of node"""
+        return chr(self.buffer[(node + 1) * self.size - 1])
 
-def remove_paths(graph, paths : list, delete_entry_node : bool,
-                 delete_sink_node : bool):
-    """
-    This function removes nodes (starting or sink) of path in graph.
-    Parameter:
-    ---------
-    graph: object networkx DiGraph()// generated by the build_graph() function.
-    path: list // path of de graph.
-    delete_entry_node : boolean //if True, delete starting node of the path.
-    delete_sink_node : boolean //if True, delete sink node of the path.
+    def __len__(self):
+        return len(self.buffer) // self.size if self.size else 0
 
-    Return:
-    ------
-    graph : object networkx DiGraph()// cleaned of unwanted paths.
+
+class KmerTable(Mapping):
+    """
+    Read-only mapping of packed kmers to their occurence.
+    Kmers and counts are kept in sorted flat arrays (8 + 4 bytes per kmer)
+    instead of one python object per kmer. The arrays are split in shards
+    on the first bits of the kmers, so that merging new counts only
+    rebuilds small arrays. Lookups accept the packed kmer or its sequence.
     """
-    for path in paths:
-        for i in range(len(path)):
 
-            if (i == 0 and not delete_entry_node) or \
-                (i == len(path) - 1 and not delete_sink_node):
-                continue
-            graph.remove_node(path[i])
+    def __init__(self, k_size : int, codes=None, counts=None, shard_bits=8):
+        check_packed_kmer_size(k_size)
+        self.k_size = k_size
+        if codes is not None:
+            # Already sorted arrays (or buffers): one shard
+            self.shard_shift = 2 * k_size
+            self.shards = [(codes, counts)]
+        else:
+            self.shard_shift = max(2 * k_size - shard_bits, 0)
+            self.shards = [(array("Q"), array("I")) for _ in
+                           range(1 << (2 * k_size - self.shard_shift))]
 
-    return graph
+    def _locate(self, kmer):
+        """Return the shard and the index of kmer in it (-1 if missing)"""
+        if isinstance(kmer, str):
+            if len(kmer) != self.k_size or set(kmer) - set(NUCLEOTIDES):
+                return None, -1
+            kmer = encode_kmer(kmer)
+        if not isinstance(kmer, int) or not 0 <= kmer < 1 << (2 * self.k_size):
+            return None, -1
+        codes, counts = self.shards[kmer >> self.shard_shift]
+        i = bisect_left(codes, kmer)
+        if i < len(codes) and codes[i] == kmer:
+            return counts, i
+        return None, -1
 
+    def __getitem__(self, kmer):
+        counts, i = self._locate(kmer)
+        if i < 0:
+            raise KeyError(kmer)
+        return counts[i]
 
-def select_best_path(graph, paths : list, path_length : list, path_weight : list,
-                     delete_entry_node=False, delete_sink_node=False):
+    def __contains__(self, kmer):
+        return self._locate(kmer)[1] >= 0
+
+    def __iter__(self):
+        for codes, _ in self.shards:
+            yield from codes
+
+    def __len__(self):
+        return sum(len(codes) for codes, _ in self.shards)
+
+    def items(self):
+        for codes, counts in self.shards:
+            yield from zip(codes, counts)
+
+    def merge(self, partial_counts : dict):
+        """
+        Add the counts of a {packed kmer: occurence} dictionary to the table.
+
+        Parameter:
+        ---------
+        partial_counts: dictionary // counts to add
+        """
+        by_shard = {}
+        for code in sorted(partial_counts):
+            by_shard.setdefault(code >> self.shard_shift, []).append(code)
+        for shard, new_codes in by_shard.items():
+            self.shards[shard] = self._merge_shard(self.shards[shard],
+                                                   new_codes, partial_counts)
+
+    def drop_below(self, min_count : int):
+        """
+        Remove the kmers seen less than min_count times.
+
+        Parameter:
+        ---------
+        min_count: int // minimum occurence of the kmers kept
+        """
+        for i, (codes, counts) in enumerate(self.shards):
+            kept = [j for j, count in enumerate(counts) if count >= min_count]
+            if len(kept) < len(codes):
+                self.shards[i] = (array("Q", (codes[j] for j in kept)),
+                                  array("I", (counts[j] for j in kept)))
+
+    @staticmethod
+    def _merge_shard(shard, new_codes, partial_counts):
+        """
+        Merge the sorted new_codes in one shard. Known kmers are incremented
+        in place, the arrays are rebuilt only to insert unknown ones: runs
+        of old kmers between two insertions are copied as raw bytes.
+        """
+        old_codes, old_counts = shard
+        inserted = []
+        start = 0
+        for code in new_codes:
+            i = bisect_left(old_codes, code, start)
+            if i < len(old_codes) and old_codes[i] == code:
+                old_counts[i] += partial_counts[code]
+            else:
+                inserted.append((i, code))
+            start = i
+        if not inserted:
+            return shard
+
+        old_code_bytes = memoryview(old_codes).cast("B")
+        old_count_bytes = memoryview(old_counts).cast("B")
+        code_size, count_size = old_codes.itemsize, old_counts.itemsize
+        codes, counts = array("Q"), array("I")
+        start = 0
+        for i, code in inserted:
+            codes.frombytes(old_code_bytes[start * code_size:i * code_size])
+            counts.frombytes(old_count_bytes[start * count_size:
+                                             i * count_size])
+            codes.append(code)
+            counts.append(partial_counts[code])
+            start = i
+        codes.frombytes(old_code_bytes[start * code_size:])
+        counts.frombytes(old_count_bytes[start * count_size:])
+        old_code_bytes.release()
+        old_count_bytes.release()
+        return codes, counts
+
+
+def fastq_digest(fastq_file : str):
+    """sha256 digest of the content of a file, read by blocks"""
+    digest = hashlib.sha256()
+    with open(fastq_file, "rb") as file:
+        for block in iter(lambda: file.read(FASTQ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def save_kmer_table(kmer_dict, table_file : str, k_size=None,
+                    fastq_file=None):
     """
-    This function select the best path for the graph.
-    In this function the last 2 parametres are False (by default).
-    The best path is the path with the max weight. If we have more than one path,
-    # than we compare their length and we select the longest. If in this case we
-    #found more than one path, we choise with the random function.
+    This function writes a kmer dictionary in a binary file: a header with
+    the kmer size, the number of kmers and the sha256 of the fastq file,
+    then the sorted packed kmers (8 bytes each, little endian) and their
+    occurences (4 bytes each). Kmers of a str dictionary with a base other
+    than A, C, G or T are not written.
 
     Parameter:
     ---------
-    graph : object networkx DiGraph()// generated by the build_graph() function.
-    paths : list // path of de graph.
-    path_length : list // indicates length of each path.
-    path_weight : list // indicates average weight of each path.
-    delete_entry_node : boolean // indicates if entry nodes will be deleted or not.
-    delete_sink_node : boolean //  indicates if sink nodes will be deleted or not.
-
-    Return:
-    ------
-    graph : object networkx DiGraph() // graph cleaned of unwanted paths.
+    kmer_dict: dictionary or KmerTable // generated by build_kmer_dict()
+    table_file: str // output file
+    k_size: int // size of the kmer, needed for an empty str dictionary
+    fastq_file: str // fastq file counted, its sha256 is kept in the header
     """
-    best_path_len = 0
-    best_path_index = -1 #out of range.
-
-    for i in range(len(paths)):
-        # Verify the biggest weight
-        if  path_weight[i] == max(path_weight):
-            best_path_len = path_length[i]
-            best_path_index = i
-            # compare by lenght if we have more than one best weight path
-            if path_length[i] > best_path_len:
-                best_path_len = path_length[i]
-                best_path_index = i
-            #in case the new best path have the same length than the previous
-            # path than we do a random choice:
-        elif path_length[i] == best_path_len:
-            rand_path = randrange(0, 1, 1) #(start, stop, step)
-            if rand_path: # True ->1
-                best_path_len = path_length[i]
-                best_path_index = i
-
-    # Verify that we selected path, if not(just in case)we take a random choice
-    if best_path_index == -1: #doesn't change (if True): no path selected.
-        best_path_index = randint(0, len(paths))
+    if isinstance(kmer_dict, KmerTable):
+        k_size = kmer_dict.k_size
+        shards = kmer_dict.shards
+    else:
+        k_size = k_size or len(next(iter(kmer_dict)))
+        check_packed_kmer_size(k_size)
+        packed = sorted((encode_kmer(kmer), count) for kmer, count
+                        in kmer_dict.items() if not set(kmer) - set(NUCLEOTIDES))
+        shards = [(array("Q", (code for code, _ in packed)),
+                   array("I", (min(count, 0xFFFFFFFF) for _, count in packed)))]
+    digest = fastq_digest(fastq_file) if fastq_file else bytes(32)
+    with open(table_file, "wb") as file:
+        file.write(KMER_TABLE_HEADER.pack(
+            KMER_TABLE_MAGIC, k_size, 1, sum(len(codes) for codes, _ in shards),
+            digest))
+        for column, typecode in ((0, "Q"), (1, "I")):
+            for shard in shards:
+                write_little_endian(file, shard[column], typecode)
 
-    # Select the best path and delete the others
-    removed_paths = paths[:best_path_index] + paths[best_path_index +1:]
-    # remove from the graph
-    graph = remove_paths(graph, removed_paths,
-                          delete_entry_node,
-                          delete_sink_node)
 
-    return graph
+def write_little_endian(file, values, typecode : str):
+    """Write an array (or buffer) of integers in little endian"""
+    if sys.byteorder != "little":
+        values = array(typecode, values)
+        values.byteswap()
+    file.write(memoryview(values).cast("B"))
 
 
-def solve_bubble(graph, node_pred, node_succ):
+def load_kmer_table(table_file : str, fastq_file=None):
     """
-    This function is used to generate a graph cleaned of the bubble between
-    the predecessor node and the successor node. Keep in bubble the best
-    path selected.
-    It uses the functions previously developed.
+    This function maps a file written by save_kmer_table() in memory: the
+    KmerTable returned reads the kmers and occurences from the file pages,
+    nothing is deserialized.
 
     Parameter:
     ---------
-    graph: object networkx DiGraph()// generated by the build_graph() function.
-    path_length : list // indicates length of each path.
-    node_pred : predecessor node.
-    node_succ : successor node.
+    table_file: str // file written by save_kmer_table()
+    fastq_file: str // if given, check that the table was counted from it
 
     Return:
     ------
-    graph : DiGraph // graph cleaned of bubble between node_succ and node_pred.
+    KmerTable // kmers of the file, input_digest is the sha256 of the fastq
     """
-    bubble_path_list = []
-    path_length = [] #path length
-    path_weight = [] #path weight
+    with open(table_file, "rb") as file:
+        header = file.read(KMER_TABLE_HEADER.size)
+        if len(header) < KMER_TABLE_HEADER.size or \
+            not header.startswith(KMER_TABLE_MAGIC):
+            raise ValueError("{0} is not a k-mer table".format(table_file))
+        _, k_size, _, n_kmers, digest = KMER_TABLE_HEADER.unpack(header)
+        end = KMER_TABLE_HEADER.size + 12 * n_kmers
+        if os.fstat(file.fileno()).st_size != end:
+            raise ValueError("{0} is truncated".format(table_file))
+        if fastq_file and digest != fastq_digest(fastq_file):
+            raise ValueError("{0} was not counted from {1}".format(
+                table_file, fastq_file))
+        content = memoryview(mmap.mmap(file.fileno(), 0,
+                                       access=mmap.ACCESS_READ))
+    middle = KMER_TABLE_HEADER.size + 8 * n_kmers
+    codes = content[KMER_TABLE_HEADER.size:middle].cast("Q")
+    counts = content[middle:end].cast("I")
+    if sys.byteorder != "little":
+        codes, counts = array("Q", codes), array("I", counts)
+        codes.byteswap()
+        counts.byteswap()
+    table = KmerTable(k_size, codes, counts)
+    table.input_digest = digest.hex()
+    return table
 
-    for path in nx.all_simple_paths(graph, source=node_pred, target=node_succ):
-        bubble_path_list.append(path)
-        path_weight.append(path_average_weight(graph, path))
-        path_length.append(len(path))
-
-    # Keep the best path with select_best_path function
-    return select_best_path(graph, bubble_path_list, path_length, path_weight)
 
-def simplify_bubbles(graph):
+def count_kmers(sequences, k_size : int, encoded=False, flush_size=100000,
+                sketch=None, min_count=1):
     """
-    This function simply the graph by taking off the bubbles.
+    This function counts the kmers of an iterable of sequences.
+    With encoded=True, kmers are counted as packed integers by batches of
+    flush_size distinct kmers merged in a KmerTable, which bounds the
+    memory used by python objects.
+    With a sketch, kmers estimated less than min_count times are not
+    counted (see build_solid_kmer_dict()).
 
     Parameter:
     ---------
-    graph : object networkx DiGraph().
+    sequences: iterable of str
+    k_size: int // size of the kmer we want to split with
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in the table
+    sketch: CountMinSketch // estimated occurence of the kmers
+    min_count: int // minimum estimated occurence of the counted kmers
 
     Return:
     ------
-    graph : object networkx DiGraph().
+    kmer_dico: dictionary
+        keys: kmer, values: nombre d'occurence of the kmer in the sequences
     """
-    bubbles_nodes = []
-
-    # Found out all bubbles
-    for node in graph:
-        node_ancesstors = [x for x in graph.predecessors(node)]
-        if len(node_ancesstors) > 1: # Not empty
-            ancestors = nx.lowest_common_ancestor(graph, node_ancesstors[0],
-                        node_ancesstors[1])
-            bubbles_nodes.append([ancestors, node])
+    dict_kmear = {}
+    table = KmerTable(k_size) if encoded else None
 
-    # Save the best path for each couple of bubbles.
-    for nodes in bubbles_nodes:
-        # Solve bubbles with previous function.
-        graph = solve_bubble(graph, nodes[0], nodes[1])
+    for seq in sequences:
+        for k_mear in cut_kmer(seq, k_size, encoded):
+            if k_mear in dict_kmear:
+                dict_kmear[k_mear] += 1
+            elif sketch is None or sketch.estimate(k_mear) >= min_count:
+                dict_kmear[k_mear] = 1
+        if encoded and len(dict_kmear) >= flush_size:
+            table.merge(dict_kmear)
+            dict_kmear = {}
 
-    return graph
+    if encoded:
+        table.merge(dict_kmear)
+        return table
+    return dict_kmear
 
 
-def solve_entry_tips(graph, entry_nodes):
+def batch_sequences(sequences, batch_size : int):
     """
-    This function is used to generate graph without unwanted entry nodes.
-    This entry nodes must be gived as argument for the function.
+    This function groups an iterable of sequences in lists.
 
     Parameter:
     ---------
-    graph : object networkx DiGraph().
-    entry_nodes : list of unwanted entry nodes.
+    sequences: iterable of str
+    batch_size: int // number of sequences per list
 
     Return:
     ------
-    graph : object networkx DiGraph().
+    generator of lists of str
     """
-    paths_list, paths_length, paths_weight, descendants = [], [], [], []
+    batch = []
+    for seq in sequences:
+        batch.append(seq)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    # Choise nodes that have more than 1 predecessor.
+
+def _unique_kmer_counts(codes, counts=None, first=None):
+    """
+    Sort and reduce numpy arrays of kmer codes, their occurence (1 if None)
+    and their first position (not tracked if None) into unique codes with
+    summed occurence and the position of their first occurence.
+    """
+    import numpy as np
+    if len(codes) == 0:
+        return codes, np.zeros(0, dtype=np.int64), first
+    if counts is None and first is None:
+        codes = np.sort(codes)
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        return codes[starts], np.diff(np.r_[starts, len(codes)]), None
+    if counts is None:
+        counts = np.ones(len(codes), dtype=np.int64)
+    order = np.argsort(codes)
+    codes, counts = codes[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    if first is not None:
+        first = np.minimum.reduceat(first[order], starts)
+    return codes[starts], np.add.reduceat(counts, starts), first
+
+
+def _reduce_kmer_counts(parts):
+    """Merge a list of (codes, counts, first) from _unique_kmer_counts()"""
+    import numpy as np
+    if len(parts) == 1:
+        return parts[0]
+    return _unique_kmer_counts(*(None if arrays[0] is None else
+                                 np.concatenate(arrays)
+                                 for arrays in zip(*parts)))
+
+
+def _add_kmer_part(parts : list, part):
+    """
+    Add (codes, counts, first) from _unique_kmer_counts() to a list of
+    parts, merged in the first one when the others outgrow it
+    """
+    parts.append(part)
+    if len(parts) > 1 and sum(len(codes) for codes, _, _ in parts[1:]) \
+            >= 2 * len(parts[0][0]):
+        parts[:] = [_reduce_kmer_counts(parts)]
+
+
+def _non_nucleotide_kmers(sequences, k_size : int, kmers : dict, offset=0):
+    """
+    Generate the sequences and add their kmers with a base other than A, C,
+    G and T, skipped by numpy_kmer_batches(), to kmers: {kmer: [first
+    position, occurence]}, positions counted like numpy_kmer_batches()
+    """
+    for seq in sequences:
+        if NON_NUCLEOTIDES.search(seq):
+            for i in range(len(seq) - k_size + 1):
+                if NON_NUCLEOTIDES.search(seq, i, i + k_size):
+                    kmer = seq[i:i + k_size]
+                    if kmer in kmers:
+                        kmers[kmer][1] += 1
+                    else:
+                        kmers[kmer] = [offset + i, 1]
+        offset += len(seq) + 1
+        yield seq
+
+
+def _numpy_kmer_dict(parts : list, k_size : int, encoded=False, others=None):
+    """
+    Reduce the parts of _add_kmer_part() into a KmerTable (encoded) or a
+    dictionary in the order of first occurence (see count_kmers_numpy()),
+    with the other kmers of _non_nucleotide_kmers()
+    """
+    import numpy as np
+    if not parts:
+        parts = [(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64),
+                  np.zeros(0, dtype=np.int64))]
+    codes, counts, first = _reduce_kmer_counts(parts)
+
+    if encoded:
+        table = KmerTable(k_size)
+        bounds = np.r_[0, np.searchsorted(codes, np.array(
+            [i << table.shard_shift for i in range(1, len(table.shards))],
+            dtype=np.uint64)), len(codes)]
+        for i in range(len(table.shards)):
+            table.shards[i] = (
+                array("Q", codes[bounds[i]:bounds[i + 1]].tobytes()),
+                array("I", counts[bounds[i]:bounds[i + 1]]
+                      .astype(np.uint32).tobytes()))
+        return table
+
+    order = np.argsort(first)
+    codes = codes[order]
+    letters = np.frombuffer(NUCLEOTIDES.encode(), dtype=np.uint8)
+    shifts = np.arange(2 * (k_size - 1), -1, -2, dtype=np.uint64)
+    kmers = letters[(codes[:, None] >> shifts) & np.uint64(3)]
+    kmers = kmers.view("S{0}".format(k_size)).ravel().tolist()
+    if not others:
+        return dict(zip((kmer.decode() for kmer in kmers),
+                        counts[order].tolist()))
+    # Both are sorted by first position, merged in this order
+    return {kmer if isinstance(kmer, str) else kmer.decode(): count
+            for _, kmer, count in heapq.merge(
+                zip(first[order].tolist(), kmers, counts[order].tolist()),
+                sorted((first, kmer, count) for kmer, (first, count)
+                       in others.items()))}
+
+
+def _rolling_kmer_codes(bases, k_size : int):
+    """
+    Compute the 2-bit code of every kmer of an array of base codes by
+    doubling: codes of 2m-mers are made of two m-mers, so only about
+    log2(k) vectorized passes are needed.
+    """
+    import numpy as np
+    current, width = bases.astype(np.uint64) & np.uint64(3), 1
+    codes, codes_width = None, 0
+    remaining = k_size
+    while True:
+        if remaining & 1:
+            if codes is None:
+                codes, codes_width = current, width
+            else:
+                size = len(bases) - codes_width - width + 1
+                codes = (codes[:size] << np.uint64(2 * width)) | \
+                    current[codes_width:codes_width + size]
+                codes_width += width
+        remaining >>= 1
+        if not remaining:
+            return codes
+        size = len(current) - width
+        current = (current[:size] << np.uint64(2 * width)) | \
+            current[width:width + size]
+        width *= 2
+
+
+def numpy_kmer_batches(sequences, k_size : int, batch_size=10000, offset=0):
+    """
+    This function computes the packed kmers of an iterable of sequences by
+    batches, with numpy vectorized operations instead of one python step
+    per base. The reads of a batch are joined with a separator and every
+    rolling 2-bit kmer code is computed at once. Windows with a base other
+    than A, C, G or T are skipped.
+
+    Parameter:
+    ---------
+    sequences: iterable of str
+    k_size: int // size of the kmer (k <= 32)
+    batch_size: int // number of sequences per batch
+    offset: int // position of the first sequence
+
+    Return:
+    ------
+    generator of tuples // (codes, positions) numpy arrays of the kmers of
+                           a batch and of their position in the sequences
+                           (each sequence and a separator)
+    """
+    import numpy as np
+    check_packed_kmer_size(k_size)
+    lookup = np.full(256, 4, dtype=np.uint8)
+    for base, code in NUCLEOTIDE_CODE.items():
+        lookup[ord(base)] = code
+
+    for batch in batch_sequences(sequences, batch_size):
+        # The separator (code 4) invalidates the windows between two reads
+        bases = lookup[np.frombuffer(("N".join(batch) + "N").encode(),
+                                     dtype=np.uint8)]
+        n_kmers = len(bases) - k_size + 1
+        if n_kmers > 0:
+            invalid = np.r_[0, np.cumsum(bases == 4)]
+            positions = np.flatnonzero(invalid[k_size:] == invalid[:n_kmers])
+            yield (_rolling_kmer_codes(bases, k_size)[positions],
+                   positions + offset)
+        offset += len(bases)
+
+
+def count_kmers_numpy(sequences, k_size : int, encoded=False,
+                      batch_size=10000, sketch=None, min_count=1):
+    """
+    This function counts the kmers of an iterable of sequences by batches
+    of packed kmers (see numpy_kmer_batches()), counted by sort and
+    reduction. Without encoding, the kmers with a base other than A, C, G
+    or T, which are not packed, are counted one by one, so the dictionary
+    is the one of count_kmers().
+    With a sketch, kmers estimated less than min_count times are not
+    counted (see build_solid_kmer_dict()).
+
+    Parameter:
+    ---------
+    sequences: iterable of str
+    k_size: int // size of the kmer (k <= 32)
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    batch_size: int // number of sequences per batch
+    sketch: CountMinSketch // estimated occurence of the kmers
+    min_count: int // minimum estimated occurence of the counted kmers
+
+    Return:
+    ------
+    kmer_dico: dictionary (or KmerTable)
+        keys: kmer, values: nombre d'occurence of the kmer in the sequences.
+        The dictionary keeps the order of first occurence, like count_kmers()
+    """
+    parts = []
+    others = None
+    if not encoded:
+        # Kmers with N, which are not packed, are counted apart
+        others = {}
+        sequences = _non_nucleotide_kmers(sequences, k_size, others)
+    for codes, positions in numpy_kmer_batches(sequences, k_size,
+                                               batch_size):
+        if sketch is not None:
+            solid = sketch.estimate_codes(codes) >= min_count
+            codes, positions = codes[solid], positions[solid]
+        # First positions keep the order of the dictionary
+        _add_kmer_part(parts, _unique_kmer_counts(
+            codes, first=None if encoded else positions))
+    if sketch is not None and others:
+        others = {kmer: value for kmer, value in others.items()
+                  if sketch.estimate(kmer) >= min_count}
+    return _numpy_kmer_dict(parts, k_size, encoded, others)
+
+
+def build_kmer_dict(fastq_file : str, k_size : int, encoded=False,
+                    flush_size=100000, threads=1, engine="python", trim=None):
+    """
+    This function is used to calculate  the number of occurence of
+    kmers in a fq file.
+    We use the functions cut_kmer() and read_fastq()
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmer we want to split with
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in the table
+    threads: int // number of processes, see build_kmer_dict_parallel()
+    engine: str // "python" (count_kmers()) or "numpy" (count_kmers_numpy())
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    kmer_dico: dictionary
+        keys: kmer, values: nombre d'occurence of the kmer in the fastq file
+    """
+    if threads > 1:
+        return build_kmer_dict_parallel(fastq_file, k_size, threads,
+                                        encoded, flush_size, engine, trim)
+    if engine == "numpy":
+        return count_kmers_numpy(read_fastq(fastq_file, trim), k_size,
+                                 encoded)
+    return count_kmers(read_fastq(fastq_file, trim), k_size, encoded,
+                       flush_size)
+
+
+def count_kmers_multi(sequences, k_sizes : list, encoded=False,
+                      flush_size=100000):
+    """
+    This function counts the kmers of each size in a single pass over the
+    sequences, like count_kmers() for each size.
+
+    Parameter:
+    ---------
+    sequences: iterable of str
+    k_sizes: list of int // sizes of the kmers
+    encoded: boolean // if True, count KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in a table
+
+    Return:
+    ------
+    dictionary // {k_size: kmer dictionary (or KmerTable)}
+    """
+    counts = {k_size: {} for k_size in k_sizes}
+    tables = {k_size: KmerTable(k_size) for k_size in k_sizes} \
+        if encoded else None
+
+    for seq in sequences:
+        for k_size, dict_kmear in counts.items():
+            for k_mear in cut_kmer(seq, k_size, encoded):
+                if k_mear in dict_kmear:
+                    dict_kmear[k_mear] += 1
+                else:
+                    dict_kmear[k_mear] = 1
+            if encoded and len(dict_kmear) >= flush_size:
+                tables[k_size].merge(dict_kmear)
+                counts[k_size] = {}
+
+    if encoded:
+        for k_size, dict_kmear in counts.items():
+            tables[k_size].merge(dict_kmear)
+        return tables
+    return counts
+
+
+def build_kmer_dicts(fastq_file : str, k_sizes : list, encoded=False,
+                     flush_size=100000, engine="python", trim=None):
+    """
+    This function counts the kmers of each size of a fq file, reading it
+    once. With the numpy engine, the packed kmers of each batch of reads
+    are counted for each size (see count_kmers_numpy()) and the counts of
+    each size are reduced together at the end.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_sizes: list of int // sizes of the kmers
+    encoded: boolean // if True, return KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in a table
+    engine: str // "python" (count_kmers_multi()) or "numpy"
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    dictionary // {k_size: kmer dictionary (or KmerTable)}
+    """
+    if engine != "numpy":
+        return count_kmers_multi(read_fastq(fastq_file, trim), k_sizes,
+                                 encoded, flush_size)
+    parts = {k_size: [] for k_size in k_sizes}
+    others = {k_size: {} for k_size in k_sizes}
+    offset = 0
+    for batch in batch_sequences(read_fastq(fastq_file, trim), 10000):
+        for k_size in k_sizes:
+            sequences = batch if encoded else list(_non_nucleotide_kmers(
+                batch, k_size, others[k_size], offset))
+            for codes, positions in numpy_kmer_batches(sequences, k_size,
+                                                       len(batch), offset):
+                _add_kmer_part(parts[k_size], _unique_kmer_counts(
+                    codes, first=None if encoded else positions))
+        offset += sum(len(seq) for seq in batch) + len(batch)
+    return {k_size: _numpy_kmer_dict(parts[k_size], k_size, encoded,
+                                     others[k_size])
+            for k_size in k_sizes}
+
+
+class CountMinSketch:
+    """
+    Count-min sketch of kmer occurences: depth rows of width saturating
+    one byte counters, a kmer is estimated by the minimum of its counter in
+    each row. Estimates are never lower than the true occurence (up to 255).
+    Packed kmers are hashed the same way one by one (add(), estimate()) or
+    by numpy arrays (add_codes(), estimate_codes()).
+    """
+
+    def __init__(self, memory : int, depth=4):
+        # Width is a power of 2 for multiply-shift hashing
+        self.width = max(1 << max((memory // depth).bit_length() - 1, 0),
+                         MIN_SKETCH_WIDTH)
+        self.depth = depth
+        self.shift = 64 - (self.width.bit_length() - 1)
+        seeds = random.Random(self.width)
+        self.seeds = [seeds.getrandbits(64) | 1 for _ in range(depth)]
+        self.rows = [bytearray(self.width) for _ in range(depth)]
+
+    def _indexes(self, kmer):
+        key = kmer if isinstance(kmer, int) else hash(kmer) & HASH_MASK
+        return [((key * seed) & HASH_MASK) >> self.shift
+                for seed in self.seeds]
+
+    def add(self, kmer):
+        """Count one occurence of kmer"""
+        for row, i in zip(self.rows, self._indexes(kmer)):
+            if row[i] < MAX_SKETCH_COUNT:
+                row[i] += 1
+
+    def estimate(self, kmer):
+        """Return the estimated occurence of kmer"""
+        return min(row[i] for row, i in zip(self.rows, self._indexes(kmer)))
+
+    def _codes_indexes(self, codes):
+        import numpy as np
+        for row, seed in zip(self.rows, self.seeds):
+            yield (np.frombuffer(row, dtype=np.uint8),
+                   (codes * np.uint64(seed)) >> np.uint64(self.shift))
+
+    def add_codes(self, codes):
+        """Count one occurence of each packed kmer of a numpy array"""
+        import numpy as np
+        for row, indexes in self._codes_indexes(codes):
+            indexes, counts = np.unique(indexes, return_counts=True)
+            row[indexes] = np.minimum(row[indexes] + counts, MAX_SKETCH_COUNT)
+
+    def estimate_codes(self, codes):
+        """Return the estimated occurence of a numpy array of packed kmers"""
+        import numpy as np
+        return np.minimum.reduce([row[indexes] for row, indexes
+                                  in self._codes_indexes(codes)])
+
+    def false_positive_rate(self, min_count : int):
+        """
+        Estimate the probability that a kmer seen once is estimated at
+        least min_count times: the probability that its counter in every
+        row was already at min_count or above.
+        """
+        rate = 1.0
+        for row in self.rows:
+            low = sum(row.count(bytes([count])) for count in range(min_count))
+            rate *= (self.width - low) / self.width
+        return rate
+
+
+def build_solid_kmer_dict(fastq_file : str, k_size : int, min_count=2,
+                          sketch_memory=64000000, encoded=False,
+                          engine="python", trim=None):
+    """
+    This function counts the kmers of a fastq file seen at least min_count
+    times, in two passes: a count-min sketch of all the kmers is filled
+    first, then only the kmers estimated min_count times or more are
+    counted exactly. Most error kmers (seen once) never reach the exact
+    table. Sketch false positives are removed from it at the end.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmer we want to split with
+    min_count: int // minimum occurence of the kmers kept
+    sketch_memory: int // memory of the sketch in bytes
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    engine: str // "python" (count_kmers()) or "numpy" (count_kmers_numpy())
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks()),
+                         counting the reads of the first pass
+
+    Return:
+    ------
+    kmer_dico: dictionary (or KmerTable) of the solid kmers
+    report: dictionary // sketch size, number of kmers counted exactly and
+                          kept, estimated and measured false positive rate
+    """
+    sketch = CountMinSketch(int(sketch_memory))
+    if engine == "numpy":
+        others = {}
+        sequences = read_fastq(fastq_file, trim)
+        if not encoded:
+            # Kmers with N are counted like the python engine does
+            sequences = _non_nucleotide_kmers(sequences, k_size, others)
+        for codes, _ in numpy_kmer_batches(sequences, k_size):
+            sketch.add_codes(codes)
+        for kmer, (_, count) in others.items():
+            for _ in range(min(count, MAX_SKETCH_COUNT)):
+                sketch.add(kmer)
+        kmer_dict = count_kmers_numpy(read_fastq(fastq_file, trim.copy()
+                                                 if trim else None),
+                                      k_size, encoded, sketch=sketch,
+                                      min_count=min_count)
+    else:
+        for seq in read_fastq(fastq_file, trim):
+            for kmer in cut_kmer(seq, k_size, encoded):
+                sketch.add(kmer)
+        kmer_dict = count_kmers(read_fastq(fastq_file, trim.copy()
+                                           if trim else None),
+                                k_size, encoded, sketch=sketch,
+                                min_count=min_count)
+
+    counted = len(kmer_dict)
+    if encoded:
+        kmer_dict.drop_below(min_count)
+    else:
+        kmer_dict = {kmer: count for kmer, count in kmer_dict.items()
+                     if count >= min_count}
+    report = {"sketch_bytes": sketch.width * sketch.depth,
+              "sketch_width": sketch.width,
+              "sketch_depth": sketch.depth,
+              "counted_kmers": counted,
+              "solid_kmers": len(kmer_dict),
+              "estimated_false_positive_rate":
+                  sketch.false_positive_rate(min_count),
+              "measured_false_positive_rate":
+                  (counted - len(kmer_dict)) / counted if counted else 0.0}
+    return kmer_dict, report
+
+
+def fastq_chunks(fastq_file : str, n_chunks : int):
+    """
+    This function splits a fastq file in byte ranges made of whole records.
+    A record starts on a line beginning with "@" followed two lines later
+    by a line beginning with "+" (a quality line may start with "@").
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    n_chunks: int // number of ranges wanted
+
+    Return:
+    ------
+    list of tuple // [(start, end)] ranges, at most n_chunks, in file order
+    """
+    size = os.path.getsize(fastq_file)
+    offsets = [0]
+    with open(fastq_file, "rb") as file:
+        for i in range(1, n_chunks):
+            file.seek(max(size * i // n_chunks, offsets[-1]))
+            file.readline() # end of the current line
+            starts, lines = [], []
+            for _ in range(7):
+                starts.append(file.tell())
+                lines.append(file.readline())
+            offset = size
+            for j in range(4):
+                if lines[j].startswith(b"@") and lines[j + 2].startswith(b"+"):
+                    offset = starts[j]
+                    break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:])
+            if end > start]
+
+
+def read_fastq_range(fastq_file : str, start : int, end : int, trim=None):
+    """
+    This function generates the sequences of the records beginning in the
+    byte range [start, end[ of a fastq file (see fastq_chunks()).
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with all sequences
+    start: int // offset of the first record
+    end: int // offset after the last record
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    sequences generator
+    """
+    for sequences in read_fastq_blocks(fastq_file, start=start, end=end,
+                                       trim=trim):
+        yield from sequences
+
+
+def _kmer_count_sources(fastq_file : str, threads : int, batch_size=10000,
+                        trim=None):
+    """
+    Generate the inputs of the counting processes: byte ranges of plain
+    fastq files, lists of sequences of compressed ones (not seekable).
+    """
+    if is_gzip(fastq_file):
+        yield from read_fastq_batches(fastq_file, batch_size, trim)
+    else:
+        # More chunks than processes to balance the load
+        yield from fastq_chunks(fastq_file, threads * 4)
+
+
+def _count_kmer_source(job):
+    """
+    Count the kmers of one source (worker of build_kmer_dict_parallel),
+    return the counts and the trimmer of the source
+    """
+    source, fastq_file, k_size, encoded, flush_size, engine, trim = job
+    if isinstance(source, tuple):
+        source = read_fastq_range(fastq_file, *source, trim)
+    if engine == "numpy":
+        counts = count_kmers_numpy(source, k_size, encoded)
+    else:
+        counts = count_kmers(source, k_size, encoded, flush_size)
+    return (counts.shards if encoded else counts), trim
+
+
+def _merge_kmer_shard(parts):
+    """Merge the (codes, counts) arrays of one shard counted by each worker"""
+    parts = [part for part in parts if len(part[0]) > 0]
+    if len(parts) <= 1:
+        return parts[0] if parts else (array("Q"), array("I"))
+    merged = {}
+    for codes, counts in parts:
+        for code, count in zip(codes, counts):
+            merged[code] = merged.get(code, 0) + count
+    codes = array("Q", sorted(merged))
+    return codes, array("I", (merged[code] for code in codes))
+
+
+def super_kmers(sequence : str, k_size : int, minimizer_size : int,
+                partitions : int):
+    """
+    This function cuts a sequence in super-kmers: runs of consecutive kmers
+    which go to the same partition. The partition of a kmer comes from its
+    minimizer, the smallest hash of its minimizer_size-mers, so a kmer goes
+    to the same partition wherever it is found. Windows with a base other
+    than A, C, G or T are skipped, like cut_kmer(encoded=True).
+
+    Parameter:
+    ---------
+    sequence: str
+    k_size: int // size of the kmer
+    minimizer_size: int // size of the minimizers (at most k_size)
+    partitions: int // number of partitions
+
+    Return:
+    ------
+    generator of tuple // (partition, super-kmer)
+    """
+    mask = (1 << (2 * minimizer_size)) - 1
+    span = k_size - minimizer_size + 1 # minimizer_size-mers of a kmer
+    for fragment in NON_NUCLEOTIDES.split(sequence):
+        if len(fragment) < k_size:
+            continue
+        hashes = []
+        code = 0
+        for i, base in enumerate(fragment):
+            code = ((code << 2) | NUCLEOTIDE_CODE[base]) & mask
+            if i >= minimizer_size - 1:
+                hashes.append(((code * MINIMIZER_HASH) & HASH_MASK) >> 32)
+        # Indexes of increasing hashes in the window of the current kmer
+        window = deque()
+        current = start = None
+        for i, value in enumerate(hashes):
+            while window and hashes[window[-1]] >= value:
+                window.pop()
+            window.append(i)
+            if window[0] <= i - span:
+                window.popleft()
+            if i < span - 1:
+                continue
+            partition = hashes[window[0]] % partitions
+            if partition != current:
+                kmer_start = i - span + 1
+                if current is not None:
+                    yield current, fragment[start:kmer_start + k_size - 1]
+                current, start = partition, kmer_start
+        yield current, fragment[start:]
+
+
+def external_partitions(fastq_file : str, max_memory : float):
+    """
+    Number of partitions of count_kmers_external() so that counting one of
+    them fits in half of max_memory bytes, at most one distinct kmer per
+    base of the fastq file (estimated from its size).
+    """
+    bases = os.path.getsize(fastq_file) // 2
+    if is_gzip(fastq_file):
+        bases *= 4
+    partitions = -(-bases * EXTERNAL_KMER_BYTES //
+                   max(1, int(max_memory / 2)))
+    return max(1, min(partitions, MAX_PARTITIONS))
+
+
+def count_kmers_external(fastq_file : str, k_size : int, max_memory : float,
+                         partitions=None, minimizer_size=None, min_count=1,
+                         temp_dir=None, table_file=None, trim=None):
+    """
+    This function counts the packed kmers of a fastq file on disk, for
+    inputs whose kmers do not fit in memory:
+        1. reads are cut in super-kmers (see super_kmers()) written in a
+           temporary file per partition,
+        2. each partition is counted alone (see count_kmers()), its kmers
+           being in no other partition, and saved as a sorted table,
+        3. the sorted tables are merged in one table file (see
+           save_kmer_table()) which is mapped in memory (load_kmer_table()).
+    The counts are the ones of build_kmer_dict(encoded=True). Temporary
+    files are removed, even on error.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmer
+    max_memory: float // bytes for the counting of a partition
+    partitions: int // number of partitions (default: external_partitions())
+    minimizer_size: int // size of the minimizers (default min(k_size, 11))
+    min_count: int // drop the kmers seen less than this number of times
+    temp_dir: str // directory of the temporary files (default: system's)
+    table_file: str // if given, merged table file kept (with the digest
+                       of the fastq file)
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    KmerTable // kmers and their occurence, mapped from the table file
+    """
+    check_packed_kmer_size(k_size)
+    if partitions is None:
+        partitions = external_partitions(fastq_file, max_memory)
+    minimizer_size = min(minimizer_size or 11, k_size)
+    flush_size = max(1000, int(max_memory / 2) // 200)
+    directory = tempfile.mkdtemp(prefix="debruijn_kmers_", dir=temp_dir)
+    try:
+        paths = [os.path.join(directory, "partition_{0}".format(i))
+                 for i in range(partitions)]
+        files = [open(path + ".txt", "w") for path in paths]
+        try:
+            for seq in read_fastq(fastq_file, trim):
+                for partition, super_kmer in super_kmers(
+                        seq, k_size, minimizer_size, partitions):
+                    files[partition].write(super_kmer + "\n")
+        finally:
+            for file in files:
+                file.close()
+
+        runs = []
+        for path in paths:
+            with open(path + ".txt") as file:
+                table = count_kmers((line.rstrip("\n") for line in file),
+                                    k_size, True, flush_size)
+            os.remove(path + ".txt")
+            save_kmer_table(table, path + ".kmt", k_size)
+            runs.append(load_kmer_table(path + ".kmt"))
+        del table
+
+        digest = fastq_digest(fastq_file) if table_file else bytes(32)
+        table_file = table_file or os.path.join(directory, "kmers.kmt")
+        # One merge of the runs: the codes are written in the table file,
+        # the counts in a temporary file appended to it afterwards
+        with open(table_file, "wb") as file, \
+                open(os.path.join(directory, "counts"), "w+b") as counts_file:
+            file.write(bytes(KMER_TABLE_HEADER.size))
+            n_kmers = 0
+            codes, counts = array("Q"), array("I")
+            for code, count in heapq.merge(*(run.items() for run in runs)):
+                if count >= min_count:
+                    codes.append(code)
+                    counts.append(count)
+                    if len(codes) == FASTQ_BLOCK_SIZE >> 3:
+                        write_little_endian(file, codes, "Q")
+                        write_little_endian(counts_file, counts, "I")
+                        n_kmers += len(codes)
+                        codes, counts = array("Q"), array("I")
+            write_little_endian(file, codes, "Q")
+            write_little_endian(counts_file, counts, "I")
+            n_kmers += len(codes)
+            counts_file.seek(0)
+            shutil.copyfileobj(counts_file, file, FASTQ_BLOCK_SIZE)
+            file.seek(0)
+            file.write(KMER_TABLE_HEADER.pack(KMER_TABLE_MAGIC, k_size, 1,
+                                              n_kmers, digest))
+        del runs
+        # The mapping stays valid once the file is removed
+        return load_kmer_table(table_file)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def build_kmer_dict_parallel(fastq_file : str, k_size : int, threads : int,
+                             encoded=False, flush_size=100000,
+                             engine="python", trim=None):
+    """
+    This function counts the kmers of a fastq file with a pool of processes,
+    each one counting a range of records (see fastq_chunks()), or a list of
+    sequences for compressed files.
+    Packed tables are merged shard by shard (first bits of the kmers) in
+    the pool. Dictionaries are merged in file order, so the kmers keep the
+    order of their first occurence: the result is the same as the serial
+    build_kmer_dict(), order included.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmer we want to split with
+    threads: int // number of processes
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in the table
+    engine: str // counting engine of the workers ("python" or "numpy")
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks()),
+                         done by the processes for plain files, with copies
+                         whose counts are merged in trim
+
+    Return:
+    ------
+    kmer_dico: dictionary (or KmerTable)
+        keys: kmer, values: nombre d'occurence of the kmer in the fastq file
+    """
+    if encoded:
+        check_packed_kmer_size(k_size)
+    jobs = ((source, fastq_file, k_size, encoded, flush_size, engine,
+             trim.copy() if trim and isinstance(source, tuple) else None)
+            for source in _kmer_count_sources(fastq_file, threads,
+                                              trim=trim))
+    dict_kmear = {}
+    table = KmerTable(k_size) if encoded else None
+
+    import multiprocessing
+    with multiprocessing.Pool(threads) as pool:
+        # Waves of jobs: compressed inputs are not read ahead of the pool
+        wave = list(islice(jobs, threads * 2))
+        while wave:
+            partials = []
+            for partial, source_trim in pool.map(_count_kmer_source, wave):
+                partials.append(partial)
+                if source_trim is not None:
+                    trim.merge(source_trim)
+            if encoded:
+                table.shards = pool.map(_merge_kmer_shard,
+                                        zip(table.shards, *partials))
+            else:
+                for partial in partials:
+                    for k_mear, count in partial.items():
+                        dict_kmear[k_mear] = dict_kmear.get(k_mear, 0) + count
+            wave = list(islice(jobs, threads * 2))
+
+    return table if encoded else dict_kmear
+
+
+def correct_read(sequence : str, k_size : int, solid : set):
+    """
+    This function corrects the substitutions of a read with the solid kmers
+    (kmers frequent in the reads): at the first weak kmer, the base which
+    makes it weak is the last one if the previous kmer is solid, else the
+    one before the next solid kmer. It is replaced by the other base making
+    the most kmers covering it solid in a row from this solid kmer, if one
+    base does better than the others (another error may be close), and the
+    read is corrected further from the next weak kmer.
+
+    Parameter:
+    ---------
+    sequence: str // read
+    k_size: int // size of the kmers
+    solid: set // solid kmers
+
+    Return:
+    ------
+    sequence: str // corrected read
+    corrections: int // number of bases replaced
+    """
+    n_kmers = len(sequence) - k_size + 1
+    corrections = 0
+    index = 0
+    while index < n_kmers:
+        if sequence[index:index + k_size] in solid:
+            index += 1
+            continue
+        if index > 0:
+            position = index + k_size - 1
+        else:
+            position = next((i - 1 for i in range(1, n_kmers)
+                             if sequence[i:i + k_size] in solid), None)
+            if position is None:
+                break
+        # Kmers covering the position
+        first = max(0, position - k_size + 1)
+        last = min(position, n_kmers - 1)
+        # Solid kmers in a row from the solid kmer next to the position
+        runs = {}
+        for base in NUCLEOTIDES:
+            if base == sequence[position]:
+                continue
+            candidate = sequence[first:position] + base + \
+                sequence[position + 1:last + k_size]
+            starts = range(last - first + 1)
+            runs[base] = 0
+            for i in (starts if index > 0 else reversed(starts)):
+                if candidate[i:i + k_size] not in solid:
+                    break
+                runs[base] += 1
+        best = max(runs.values(), default=0)
+        fixes = [base for base, run in runs.items() if run == best]
+        if best > 0 and len(fixes) == 1:
+            sequence = sequence[:position] + fixes[0] + \
+                sequence[position + 1:]
+            corrections += 1
+            # Next weak kmer, or the beginning again for an error before
+            index = index + best if index > 0 else 0
+        else:
+            index = last + 1
+    return sequence, corrections
+
+
+_SOLID_KMERS = set()
+
+
+def _init_correction(solid : set):
+    """Give the solid kmers to the process (inherited on fork)"""
+    global _SOLID_KMERS
+    _SOLID_KMERS = solid
+
+
+def _correct_block(job):
+    """Correct a list of reads (worker of correct_reads())"""
+    sequences, k_size = job
+    corrected = []
+    reads = bases = 0
+    for sequence in sequences:
+        sequence, corrections = correct_read(sequence, k_size, _SOLID_KMERS)
+        corrected.append(sequence)
+        if corrections:
+            reads += 1
+            bases += corrections
+    return corrected, reads, bases
+
+
+def correct_reads(fastq_file : str, k_size : int, solid : set, threads=1,
+                  trim=None, report=None):
+    """
+    This function generates the reads of a fastq file corrected by
+    correct_read(), by blocks (see read_fastq_blocks()) corrected in
+    threads processes, in file order.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmers
+    solid: set // solid kmers
+    threads: int // number of processes
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+    report: dictionary // if given, "corrected_reads" and "corrected_bases"
+                          are counted in it
+
+    Return:
+    ------
+    generator of corrected sequences
+    """
+    report = {} if report is None else report
+    report.setdefault("corrected_reads", 0)
+    report.setdefault("corrected_bases", 0)
+    jobs = ((block, k_size) for block in read_fastq_blocks(fastq_file,
+                                                           trim=trim))
+    pool = None
+    try:
+        if threads > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(threads, _init_correction, (solid,))
+        else:
+            _init_correction(solid)
+        # Waves of blocks: the reads are not read ahead of the pool
+        wave = list(islice(jobs, max(1, threads * 2)))
+        while wave:
+            results = pool.map(_correct_block, wave) if pool \
+                else map(_correct_block, wave)
+            for corrected, reads, bases in results:
+                report["corrected_reads"] += reads
+                report["corrected_bases"] += bases
+                yield from corrected
+            wave = list(islice(jobs, max(1, threads * 2)))
+    finally:
+        _init_correction(set())
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def build_corrected_kmer_dict(fastq_file : str, k_size : int, solid_count=3,
+                              encoded=False, flush_size=100000, threads=1,
+                              engine="python", trim=None, min_count=1):
+    """
+    This function counts the kmers of a fastq file after correcting its
+    reads: the kmers seen at least solid_count times in a first count (see
+    build_kmer_dict()) are solid, the reads are corrected with them (see
+    correct_reads()) and their kmers counted again.
+
+    Parameter:
+    ---------
+    fastq_file: str// fastq file with sequence
+    k_size: int // size of the kmer we want to split with
+    solid_count: int // minimum occurence of the solid kmers
+    encoded: boolean // if True, return a KmerTable of packed kmers
+    flush_size: int // distinct kmers counted before merging in the table
+    threads: int // number of processes of the count and of the correction
+    engine: str // "python" (count_kmers()) or "numpy" (count_kmers_numpy())
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks()),
+                         counting the reads of the first count
+    min_count: int // drop the kmers of the corrected reads seen less than
+                      this number of times
+
+    Return:
+    ------
+    kmer_dico: dictionary (or KmerTable) of the kmers of the corrected reads
+    report: dictionary // distinct kmers before and after the correction,
+                          solid kmers, reads and bases corrected
+    """
+    kmer_dict = build_kmer_dict(fastq_file, k_size, threads=threads,
+                                engine=engine, trim=trim)
+    solid = {kmer for kmer, count in kmer_dict.items()
+             if count >= solid_count}
+    report = {"kmers_before": len(kmer_dict), "solid_kmers": len(solid)}
+    del kmer_dict
+    reads = correct_reads(fastq_file, k_size, solid, threads,
+                          trim.copy() if trim else None, report)
+    if engine == "numpy":
+        kmer_dict = count_kmers_numpy(reads, k_size, encoded)
+    else:
+        kmer_dict = count_kmers(reads, k_size, encoded, flush_size)
+    if min_count > 1 and encoded:
+        kmer_dict.drop_below(min_count)
+    elif min_count > 1:
+        kmer_dict = {kmer: count for kmer, count in kmer_dict.items()
+                     if count >= min_count}
+    report["kmers_after"] = len(kmer_dict)
+    return kmer_dict, report
+
+
+def kmer_edges(k_mer_dict : dict):
+    """
+    This function generates the edges of the kmer's graph: (prefix, suffix,
+    occurence) of each kmer, packed (k-1)-mers for a KmerTable.
+
+    Parameter:
+    ---------
+    km_mear_dict: dictionary //
+        dictionary of kmer gets from build_kmer_dict() function, or the
+        path of a file written by save_kmer_table()
+
+    Return:
+    ------
+    generator of tuples // (prefix, suffix, weight)
+    """
+    k_size = getattr(k_mer_dict, "k_size", None)
+    if k_size is None:
+        for key, weight in k_mer_dict.items():
+            yield key[:-1], key[1:], weight
+        return
+    suffix_mask = (1 << (2 * (k_size - 1))) - 1
+    for key, weight in k_mer_dict.items():
+        yield key >> 2, key & suffix_mask, weight
+
+
+def build_graph(k_mer_dict : dict, backend="networkx", node_ids=False):
+    """
+    This function creats the kmer's graph.
+    It deppends of the kmer preffix,suffix and the weight.
+    Weight: occurence of the kmer
+    Packed kmers (KmerTable) give packed (k-1)-mers nodes, the kmer size is
+    then kept in graph.graph["kmer_size"] to decode them.
+    With node_ids, the (k-1)-mers of a str dictionary are integer ids of a
+    NodeDictionary kept in graph.graph["node_dictionary"], in the order the
+    (k-1)-mers nodes would be added (packed kmers are already integers).
+
+    Parameter:
+    ---------
+    km_mear_dict: dictionary //
+        dictionary of kmer gets from build_kmer_dict() function, or the
+        path of a file written by save_kmer_table()
+    backend: str // "networkx" (nx.DiGraph), "tracked" (TrackedGraph) or
+                    "csr" (CSRGraph)
+    node_ids: boolean // if True, integer nodes (see NodeDictionary)
+
+    Return:
+    ------
+    g: nx DiGraph : name = kmers_graph_kmer_size.png
+    """
+    if isinstance(k_mer_dict, str):
+        k_mer_dict = load_kmer_table(k_mer_dict)
+    edges = kmer_edges(k_mer_dict)
+    nodes = None
+    if node_ids and not isinstance(k_mer_dict, KmerTable):
+        nodes = NodeDictionary()
+        edges = ((nodes.add(prefix), nodes.add(suffix), weight)
+                 for prefix, suffix, weight in edges)
+    if backend == "csr":
+        graph = CSRGraph.from_edges(edges)
+    else:
+        graph = TrackedGraph() if backend == "tracked" else nx.DiGraph()
+        for prefix, suffix, weight in edges:
+            graph.add_edge(prefix, suffix, weight=weight)
+    if nodes is not None:
+        nodes.freeze()
+        graph.graph["node_dictionary"] = nodes
+
+    k_size = getattr(k_mer_dict, "k_size", None)
+    if k_size is not None:
+        graph.graph["kmer_size"] = k_size
+    return graph
+
+
+class TrackedGraph(nx.DiGraph):
+    """
+    nx.DiGraph which keeps the set of its starting nodes (no predecessor)
+    and of its sink nodes (no successor) up to date on each mutation, so
+    get_starting_nodes() and get_sink_nodes() do not scan the whole graph.
+    The degrees are the lengths of the adjacency dicts of nx.DiGraph, they
+    are already O(1). Each node gets a rank when it is added, the nodes are
+    returned in the order of graph.nodes like nx.DiGraph.
+    """
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        self._sources = set()
+        self._sinks = set()
+        self._rank = {}
+        self._next_rank = 0
+        super().__init__(incoming_graph_data, **attr)
+
+    def _update(self, nodes):
+        """Update the starting and sink sets for the given nodes"""
+        for node in nodes:
+            if node not in self._node:
+                self._sources.discard(node)
+                self._sinks.discard(node)
+                self._rank.pop(node, None)
+                continue
+            if node not in self._rank:
+                self._rank[node] = self._next_rank
+                self._next_rank += 1
+            if self._pred[node]:
+                self._sources.discard(node)
+            else:
+                self._sources.add(node)
+            if self._succ[node]:
+                self._sinks.discard(node)
+            else:
+                self._sinks.add(node)
+
+    def _neighborhood(self, nodes):
+        """List the nodes and their neighbors, before a removal"""
+        neighborhood = []
+        for node in nodes:
+            if node in self._node:
+                neighborhood.append(node)
+                neighborhood.extend(self._pred[node])
+                neighborhood.extend(self._succ[node])
+        return neighborhood
+
+    def starting_nodes(self):
+        """Starting nodes, in the order of graph.nodes"""
+        return sorted(self._sources, key=self._rank.__getitem__)
+
+    def sink_nodes(self):
+        """Sink nodes, in the order of graph.nodes"""
+        return sorted(self._sinks, key=self._rank.__getitem__)
+
+    def add_node(self, node_for_adding, **attr):
+        super().add_node(node_for_adding, **attr)
+        self._update([node_for_adding])
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        n_nodes = len(self._node)
+        super().add_nodes_from(nodes_for_adding, **attr)
+        # Only the new nodes, at the end of the node dict, change
+        new_nodes = list(islice(reversed(self._node),
+                                len(self._node) - n_nodes))
+        self._update(new_nodes[::-1])
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+        self._update((u_of_edge, v_of_edge))
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        edges = list(ebunch_to_add)
+        super().add_edges_from(edges, **attr)
+        self._update(node for edge in edges for node in edge[:2])
+
+    def remove_node(self, n):
+        neighborhood = self._neighborhood([n])
+        super().remove_node(n)
+        self._update(neighborhood)
+
+    def remove_nodes_from(self, nodes):
+        nodes = list(nodes)
+        neighborhood = self._neighborhood(nodes)
+        super().remove_nodes_from(nodes)
+        self._update(neighborhood)
+
+    def remove_edge(self, u, v):
+        super().remove_edge(u, v)
+        self._update((u, v))
+
+    def remove_edges_from(self, ebunch):
+        edges = list(ebunch)
+        super().remove_edges_from(edges)
+        self._update(node for edge in edges for node in edge[:2])
+
+    def clear(self):
+        super().clear()
+        self._sources.clear()
+        self._sinks.clear()
+        self._rank.clear()
+
+    def clear_edges(self):
+        super().clear_edges()
+        self._update(list(self._node))
+
+
+class _CSRNeighbors:
+    """Live neighbors of a CSRGraph node, like graph.succ[node]"""
+
+    def __init__(self, graph, node_id, successors):
+        self._graph = graph
+        self._node_id = node_id
+        self._successors = successors
+
+    def _edges(self):
+        """Generate the (neighbor id, edge index) of the live neighbors"""
+        graph = self._graph
+        if self._successors:
+            offsets, neighbors = graph._succ_offsets, graph._succ_targets
+        else:
+            offsets, neighbors = graph._pred_offsets, graph._pred_sources
+        for i in range(offsets[self._node_id], offsets[self._node_id + 1]):
+            if not graph._deleted[neighbors[i]]:
+                yield neighbors[i], (i if self._successors
+                                     else graph._pred_edges[i])
+
+    def __iter__(self):
+        labels = self._graph._labels
+        return (labels[neighbor] for neighbor, _ in self._edges())
+
+    def __len__(self):
+        degrees = self._graph._out_degree if self._successors \
+            else self._graph._in_degree
+        return degrees[self._node_id]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __contains__(self, node):
+        node_id = self._graph._ids.get(node)
+        if node_id is None:
+            return False
+        return self._graph._edge_index(
+            *((self._node_id, node_id) if self._successors
+              else (node_id, self._node_id)), ids=True) >= 0
+
+    def __getitem__(self, node):
+        data = self._graph.get_edge_data(
+            *((self._graph._labels[self._node_id], node) if self._successors
+              else (node, self._graph._labels[self._node_id])))
+        if data is None:
+            raise KeyError(node)
+        return data
+
+
+class _CSRAdjacency:
+    """graph.succ / graph.pred of a CSRGraph"""
+
+    def __init__(self, graph, successors):
+        self._graph = graph
+        self._successors = successors
+
+    def __getitem__(self, node):
+        return _CSRNeighbors(self._graph, self._graph._id(node),
+                             self._successors)
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+
+class _CSRNodeView:
+    """
+    graph.nodes of a CSRGraph: iteration, membership and attributes. The
+    nodes without attributes share one empty read-only mapping.
+    """
+    NO_ATTRIBUTES = MappingProxyType({})
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __call__(self, data=False):
+        if data:
+            return ((node, self[node]) for node in self._graph)
+        return self
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+    def __contains__(self, node):
+        return node in self._graph
+
+    def __getitem__(self, node):
+        return self._graph._node_attributes.get(self._graph._id(node),
+                                                self.NO_ATTRIBUTES)
+
+
+class _CSREdgeView:
+    """graph.edges of a CSRGraph: iteration, membership and attributes"""
+
+    def __init__(self, graph, nbunch=None, data=False):
+        self._graph = graph
+        self._nbunch = nbunch
+        self._data = data
+
+    def __call__(self, nbunch=None, data=False):
+        return _CSREdgeView(self._graph, nbunch, data)
+
+    def __iter__(self):
+        graph = self._graph
+        if self._nbunch is None:
+            nodes = graph
+        elif self._nbunch in graph:
+            nodes = [self._nbunch]
+        else:
+            nodes = [node for node in self._nbunch if node in graph]
+        for node in nodes:
+            for succ, i in _CSRNeighbors(graph, graph._ids[node],
+                                         True)._edges():
+                if self._data:
+                    yield node, graph._labels[succ], graph._edge_data(i)
+                else:
+                    yield node, graph._labels[succ]
+
+    def __len__(self):
+        return self._graph.number_of_edges()
+
+    def __contains__(self, edge):
+        return self._graph.has_edge(*edge)
+
+    def __getitem__(self, edge):
+        data = self._graph.get_edge_data(*edge)
+        if data is None:
+            raise KeyError(edge)
+        return data
+
+
+class _DenseIds:
+    """
+    Ids of the nodes of a CSRGraph whose nodes are the integers 0 .. n-1
+    added in order (NodeDictionary ids): each node is its own id, there is
+    no dictionary.
+    """
+
+    def __init__(self):
+        self.n_nodes = 0
+
+    def get(self, node, default=None):
+        if type(node) is int and 0 <= node < self.n_nodes:
+            return node
+        return default
+
+    def __getitem__(self, node):
+        node_id = self.get(node)
+        if node_id is None:
+            raise KeyError(node)
+        return node_id
+
+    def __contains__(self, node):
+        return self.get(node) is not None
+
+    def __len__(self):
+        return self.n_nodes
+
+
+class CSRGraph:
+    """
+    Static directed graph stored in compressed sparse row arrays: integer
+    node ids, successor and predecessor offsets and ids, one weight per
+    edge and a deleted node mask. Only the node labels (kmers) and the
+    attributes of the nodes which have some (unitigs) are python objects.
+    Nodes which are their own ids (0, 1, 2... added in this order) have no
+    label at all.
+    It implements the part of the nx.DiGraph API used by this module,
+    nodes can only be removed (remove_node()), not added.
+    """
+    # Weight of the edges without one
+    NO_WEIGHT = -1
+
+    def __init__(self, incoming_graph=None):
+        self.graph = {}
+        self._ids = _DenseIds()
+        self._labels = range(0)
+        self._node_attributes = {}
+        self._succ_offsets = array("Q", [0])
+        self._succ_targets = array("Q")
+        self._weights = array("q")
+        self._pred_offsets = array("Q", [0])
+        self._pred_sources = array("Q")
+        self._pred_edges = array("Q")
+        self._in_degree = array("Q")
+        self._out_degree = array("Q")
+        self._deleted = bytearray()
+        self._n_nodes = self._n_edges = 0
+        if incoming_graph is not None:
+            self._build(incoming_graph.nodes(data=True),
+                        ((pred, succ, data.get("weight", self.NO_WEIGHT))
+                         for pred, succ, data in
+                         incoming_graph.edges(data=True)))
+            self.graph.update(incoming_graph.graph)
+
+    @classmethod
+    def from_edges(cls, edges, nodes=()):
+        """
+        Build a graph from (pred, succ, weight) edges, nodes are numbered
+        in order of appearance.
+
+        Parameter:
+        ---------
+        edges: iterable of tuples // (pred, succ, weight)
+        nodes: iterable of tuples // (node, attributes) added first
+
+        Return:
+        ------
+        CSRGraph
+        """
+        graph = cls()
+        graph._build(nodes, edges)
+        return graph
+
+    def _add_label(self, node):
+        """Give an id to a new node, return the id of the node"""
+        ids = self._ids
+        if isinstance(ids, _DenseIds):
+            if type(node) is int and node == ids.n_nodes:
+                ids.n_nodes += 1
+                return node
+            if node in ids:
+                return node
+            # Not dense any more: a dictionary of the labels
+            self._labels = list(range(ids.n_nodes))
+            self._ids = ids = {label: label for label in self._labels}
+        node_id = ids.get(node)
+        if node_id is None:
+            node_id = ids[node] = len(self._labels)
+            self._labels.append(node)
+        return node_id
+
+    def _build(self, nodes, edges):
+        add_label = self._add_label
+        for node, attributes in nodes:
+            node_id = add_label(node)
+            if attributes:
+                self._node_attributes[node_id] = dict(attributes)
+        sources, targets, weights = array("Q"), array("Q"), array("q")
+        for pred, succ, weight in edges:
+            sources.append(add_label(pred))
+            targets.append(add_label(succ))
+            weights.append(weight)
+        if isinstance(self._ids, _DenseIds):
+            self._labels = range(self._ids.n_nodes)
+
+        # Counting sort of the edges by source then by target, stable to
+        # keep the order of the neighbors
+        n_nodes = len(self._ids)
+        self._out_degree = array("Q", bytes(8 * n_nodes))
+        self._in_degree = array("Q", bytes(8 * n_nodes))
+        for source, target in zip(sources, targets):
+            self._out_degree[source] += 1
+            self._in_degree[target] += 1
+        self._succ_offsets = self._offsets(self._out_degree)
+        self._pred_offsets = self._offsets(self._in_degree)
+        succ_next = array("Q", self._succ_offsets)
+        pred_next = array("Q", self._pred_offsets)
+        self._succ_targets = array("Q", bytes(8 * len(sources)))
+        self._weights = array("q", bytes(8 * len(sources)))
+        self._pred_sources = array("Q", bytes(8 * len(sources)))
+        self._pred_edges = array("Q", bytes(8 * len(sources)))
+        for source, target, weight in zip(sources, targets, weights):
+            i = succ_next[source]
+            succ_next[source] += 1
+            self._succ_targets[i] = target
+            self._weights[i] = weight
+            j = pred_next[target]
+            pred_next[target] += 1
+            self._pred_sources[j] = source
+            self._pred_edges[j] = i
+        self._deleted = bytearray(n_nodes)
+        self._n_nodes, self._n_edges = n_nodes, len(sources)
+
+    @staticmethod
+    def _offsets(degrees):
+        offsets = array("Q", [0])
+        for degree in degrees:
+            offsets.append(offsets[-1] + degree)
+        return offsets
+
+    def _id(self, node):
+        node_id = self._ids.get(node)
+        if node_id is None or self._deleted[node_id]:
+            raise KeyError(node)
+        return node_id
+
+    def _edge_index(self, pred, succ, ids=False):
+        """
+        Index of the edge pred -> succ in the successor arrays, or -1. With
+        ids, pred and succ are node ids instead of nodes.
+        """
+        if ids:
+            pred_id, succ_id = pred, succ
+        else:
+            pred_id, succ_id = self._ids.get(pred), self._ids.get(succ)
+        if pred_id is None or succ_id is None or self._deleted[pred_id] \
+                or self._deleted[succ_id]:
+            return -1
+        for i in range(self._succ_offsets[pred_id],
+                       self._succ_offsets[pred_id + 1]):
+            if self._succ_targets[i] == succ_id:
+                return i
+        return -1
+
+    def _edge_data(self, i):
+        weight = self._weights[i]
+        return {} if weight == self.NO_WEIGHT else {"weight": weight}
+
+    # Part of the nx.DiGraph API
+    def __iter__(self):
+        return (label for node_id, label in enumerate(self._labels)
+                if not self._deleted[node_id])
+
+    def __len__(self):
+        return self._n_nodes
+
+    def __contains__(self, node):
+        node_id = self._ids.get(node)
+        return node_id is not None and not self._deleted[node_id]
+
+    @property
+    def nodes(self):
+        """Node view: graph.nodes, graph.nodes(), graph.nodes[node]"""
+        return _CSRNodeView(self)
+
+    @property
+    def edges(self):
+        """Edge view: graph.edges(), graph.edges[pred, succ], (u, v) in"""
+        return _CSREdgeView(self)
+
+    @property
+    def succ(self):
+        """Successors: graph.succ[node]"""
+        return _CSRAdjacency(self, True)
+
+    adj = succ
+
+    @property
+    def pred(self):
+        """Predecessors: graph.pred[node]"""
+        return _CSRAdjacency(self, False)
+
+    def successors(self, node):
+        """Iterate over the successors of node"""
+        return iter(self.succ[node])
+
+    neighbors = successors
+
+    def predecessors(self, node):
+        """Iterate over the predecessors of node"""
+        return iter(self.pred[node])
+
+    def in_degree(self, node=None):
+        """Number of predecessors of node, (node, degree) of all nodes"""
+        if node is None:
+            return ((label, self._in_degree[node_id]) for node_id, label
+                    in enumerate(self._labels) if not self._deleted[node_id])
+        return self._in_degree[self._id(node)]
+
+    def out_degree(self, node=None):
+        """Number of successors of node, (node, degree) of all nodes"""
+        if node is None:
+            return ((label, self._out_degree[node_id]) for node_id, label
+                    in enumerate(self._labels) if not self._deleted[node_id])
+        return self._out_degree[self._id(node)]
+
+    def has_node(self, node):
+        """Check if node is in the graph"""
+        return node in self
+
+    def has_edge(self, pred, succ):
+        """Check if the edge pred -> succ is in the graph"""
+        return self._edge_index(pred, succ) >= 0
+
+    def get_edge_data(self, pred, succ, default=None):
+        """Return the attributes ({"weight": w}) of pred -> succ"""
+        i = self._edge_index(pred, succ)
+        return default if i < 0 else self._edge_data(i)
+
+    def number_of_nodes(self):
+        """Number of live nodes"""
+        return self._n_nodes
+
+    def number_of_edges(self):
+        """Number of edges between live nodes"""
+        return self._n_edges
+
+    def remove_node(self, node):
+        """Remove node and its edges (the node is marked deleted)"""
+        node_id = self._ids.get(node)
+        if node_id is None or self._deleted[node_id]:
+            raise nx.NetworkXError("The node {0} is not in the graph."
+                                   .format(node))
+        for succ, _ in _CSRNeighbors(self, node_id, True)._edges():
+            if succ != node_id:
+                self._in_degree[succ] -= 1
+        for pred, _ in _CSRNeighbors(self, node_id, False)._edges():
+            if pred != node_id:
+                self._out_degree[pred] -= 1
+        self._n_edges -= self._out_degree[node_id] + self._in_degree[node_id]
+        if self._edge_index(node_id, node_id, ids=True) >= 0:
+            self._n_edges += 1 # self loop counted twice
+        self._deleted[node_id] = 1
+        self._n_nodes -= 1
+
+    def remove_nodes_from(self, nodes):
+        """Remove the nodes of an iterable which are in the graph"""
+        for node in list(nodes):
+            if node in self:
+                self.remove_node(node)
+
+    def is_directed(self):
+        """A CSRGraph is always directed"""
+        return True
+
+    def is_multigraph(self):
+        """A CSRGraph has no parallel edges"""
+        return False
+
+    def copy(self):
+        """Return a copy of the graph (without the deleted nodes)"""
+        return CSRGraph(self)
+
+
+def node_sequence(graph, node):
+    """
+    This function returns the sequence of a node: its "seq" attribute for a
+    unitig (see compact_graph()), its (k-1)-mer otherwise (decode_node()).
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph() or compact_graph()
+    node: node of the graph
+
+    Return:
+    ------
+    str // sequence of the node
+    """
+    seq = graph.nodes[node].get("seq")
+    if seq is not None:
+        return seq
+    return decode_node(graph, node)
+
+
+def decode_node(graph, node):
+    """
+    This function returns the (k-1)-mer of a node of build_graph(): read
+    from the NodeDictionary of integer nodes, decoded for a packed node or
+    the node itself.
+    """
+    nodes = graph.graph.get("node_dictionary")
+    if nodes is not None:
+        return nodes[node]
+    k_size = graph.graph.get("kmer_size")
+    if k_size is not None:
+        return decode_kmer(node, k_size - 1)
+    return node
+
+
+def compact_graph(graph):
+    """
+    This function merges the non-branching paths of the graph in unitigs:
+    a node with a single successor is merged with it when it is its only
+    predecessor. Each unitig is identified by its first node and carries:
+        seq: its sequence
+        length: its number of (k-1)-mers
+        coverage: the sum of the weights of its internal edges
+        n_edges: its number of internal edges
+        mean_coverage: coverage / n_edges (0 without internal edge)
+    The edges between unitigs keep their weight. The overlap between the
+    sequences of two successive nodes is kept in graph.graph["overlap"].
+    A compacted graph can be compacted again after simplification.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph() or compact_graph()
+
+    Return:
+    ------
+    compacted: nx DiGraph // graph of unitigs, graph.graph["compacted"] True
+    """
+    compacted = nx.DiGraph()
+    compacted.graph.update(graph.graph)
+    if not graph.graph.get("compacted"):
+        compacted.graph["compacted"] = True
+        if "kmer_size" in graph.graph:
+            compacted.graph["overlap"] = graph.graph["kmer_size"] - 2
+        elif len(graph):
+            compacted.graph["overlap"] = \
+                len(decode_node(graph, next(iter(graph)))) - 1
+    overlap = compacted.graph.get("overlap", 0)
+
+    def next_in_unitig(node):
+        """Return the successor merged with node, None if node ends a unitig"""
+        if len(graph.succ[node]) != 1:
+            return None
+        succ = next(iter(graph.succ[node]))
+        if succ == node or len(graph.pred[succ]) != 1:
+            return None
+        return succ
+
+    def is_head(node):
+        if len(graph.pred[node]) != 1:
+            return True
+        return next_in_unitig(next(iter(graph.pred[node]))) != node
+
+    unitig_of = {}
+    internal_edges = set()
+
+    def add_unitig(head):
+        chain = [head]
+        node = next_in_unitig(head)
+        while node is not None and node != head:
+            internal_edges.add((chain[-1], node))
+            chain.append(node)
+            node = next_in_unitig(node)
+        seq = [node_sequence(graph, head)]
+        length = coverage = n_edges = 0
+        for i, node in enumerate(chain):
+            unitig_of[node] = head
+            attributes = graph.nodes[node]
+            length += attributes.get("length", 1)
+            coverage += attributes.get("coverage", 0)
+            n_edges += attributes.get("n_edges", 0)
+            if i > 0:
+                seq.append(node_sequence(graph, node)[overlap:])
+                coverage += graph.edges[chain[i - 1], node]["weight"]
+                n_edges += 1
+        compacted.add_node(head, seq="".join(seq), length=length,
+                           coverage=coverage, n_edges=n_edges,
+                           mean_coverage=coverage / n_edges if n_edges else 0)
+
+    for node in graph:
+        if node not in unitig_of and is_head(node):
+            add_unitig(node)
+    # Cycles without branching have no head
+    for node in graph:
+        if node not in unitig_of:
+            add_unitig(node)
+
+    for pred, succ, data in graph.edges(data=True):
+        if (pred, succ) not in internal_edges:
+            compacted.add_edge(unitig_of[pred], unitig_of[succ], **data)
+    # Same backend as the input graph
+    if type(graph) is not nx.DiGraph:
+        compacted = type(graph)(compacted)
+    return compacted
+
+
+def get_starting_nodes(graph):
+    """
+    This function generats the starting nodes.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by the build_graph() function.
+
+    Return:
+    ------
+    start_nodes: list // list of starting nodes found in the graph
+    """
+    if isinstance(graph, TrackedGraph):
+        return graph.starting_nodes()
+    start_nodes = []
+
+    for node in graph.nodes:
+        if len(graph.pred[node]) == 0:
+        #Returns an iterator over predecessor nodes of n.
+            start_nodes.append(node)
+
+    return start_nodes
+
+
+def get_sink_nodes(graph):
+    """
+    This function generats the sink nodes.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by the build_graph() function.
+
+    Return:
+    ------
+    sink_nodes: list // list of sink nodes found in the graph
+    """
+    if isinstance(graph, TrackedGraph):
+        return graph.sink_nodes()
+    sink_nodes = []
+    for node in graph.nodes:
+        if len(graph.succ[node]) == 0:
+            sink_nodes.append(node)
+
+    return sink_nodes
+
+
+def iter_contigs(graph, start_nodes : list, sink_nodes : list):
+    """
+    This function generates the contigs from each starting node to each
+    sink node it reaches: one depth-first search per starting node records
+    the parent of each node when it is first reached, and the path to each
+    sink is read back from the parents. For S starting nodes, this takes
+    O(S * (V + E)) plus the length of the contigs, with O(V) memory. (A
+    single traversal shared by the starting nodes would keep the sinks
+    reached from each node, O(V * sinks) memory on unsimplified graphs.)
+    In an acyclic graph the path is the first one of
+    nx.all_simple_paths(graph, start, sink), it is a simple path otherwise.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by the build_graph() function.
+    start_nodes : list// list of starting nodes found in the graph.
+    sink_nodes: list// list of sink nodes found in the graph.
+
+    Return:
+    ------
+    generator of tuple// (contig, len(contig)) for each (start, sink) linked
+    """
+    for start in start_nodes:
+        parents = {start: None}
+        stack = [(start, iter(graph.succ[start]))]
+        while stack:
+            parent, successors = stack[-1]
+            node = next(successors, None)
+            if node is None:
+                stack.pop()
+            elif node not in parents:
+                parents[node] = parent
+                stack.append((node, iter(graph.succ[node])))
+        for sink in sink_nodes:
+            if sink not in parents:
+                continue
+            path = [sink]
+            while path[-1] != start:
+                path.append(parents[path[-1]])
+            contig = path_to_contig(graph, path[::-1])
+            yield contig, len(contig)
+
+
+def get_contigs(graph, start_nodes : list, sink_nodes : list):
+    """
+    This function generats a list of tuples that contains the
+    contig and it's length.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by the build_graph() function.
+    start_nodes : list// list of starting nodes found in the graph.
+                        Generated by the function get_starting_nodes()
+
+    sink_nodes: list// list of sink nodes found in the graph.
+                    Generated by the function get_sink_nodes()
+
+    Return:
+    ------
+    contigs_list: list of tuple// liste of tuple [(contig,len(contig))]
+    """
+    contigs_list = list(iter_contigs(graph, start_nodes, sink_nodes))
+    return contigs_list
+
+
+def path_to_contig(graph, path : list):
+    """
+    This function assembles the sequence spelled by a path of the graph.
+    Packed nodes are only decoded here, unitigs overlap of k-2 bases.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by the build_graph() function.
+    path: list // consecutive nodes of the graph
+
+    Return:
+    ------
+    contig: str
+    """
+    if graph.graph.get("compacted"):
+        overlap = graph.graph["overlap"]
+        return node_sequence(graph, path[0]) + "".join(
+            node_sequence(graph, node)[overlap:] for node in path[1:])
+    nodes = graph.graph.get("node_dictionary")
+    if nodes is not None:
+        return nodes[path[0]] + "".join(nodes.last_base(node)
+                                        for node in path[1:])
+    k_size = graph.graph.get("kmer_size")
+    if k_size is None:
+        return path[0] + "".join(node[-1] for node in path[1:])
+    return decode_kmer(path[0], k_size - 1) + \
+        "".join(NUCLEOTIDES[node & 3] for node in path[1:])
+
+
+def fasta_blocks(contigs, block_size=1 << 20):
+    """
+    This function formats the contigs in fasta (see save_contigs()) and
+    joins the records in blocks of about block_size characters.
+
+    Parameter:
+    ---------
+    contigs: list of tuple// liste (or generator) of tuple [(contig,len(contig))]
+    block_size: int // number of characters of a block (at least)
+
+    Return:
+    ------
+    generator of str // blocks of records, the last one may be shorter
+    """
+    records = []
+    size = 0
+    for number, (contig, length) in enumerate(contigs):
+        records.append(">contig_{0} len={1}\n{2}\n".format(number, length,
+                                                            fill(contig)))
+        size += len(records[-1])
+        if size >= block_size:
+            yield "".join(records)
+            records = []
+            size = 0
+    if records:
+        yield "".join(records)
+
+
+def save_contigs(contigs : list, output_file : str, threads=1,
+                 block_size=1 << 20, compresslevel=6):
+    """
+    This function writes the contigs in a fasta file, by blocks of records
+    (see fasta_blocks()): a generator of contigs is written as the contigs
+    come. A file ending with .gz is gzip compressed, each block is an
+    independent gzip member compressed by a pool of threads (zlib releases
+    the GIL), which gzip and zcat read as one stream.
+
+    Parameter:
+    ---------
+    contig: list of tuple// liste (or generator) of tuple [(contig,len(contig))]
+    output_file : str // name of the output file
+    threads: int // number of compression threads
+    block_size: int // number of characters written or compressed at once
+    compresslevel: int // gzip compression level
+
+    Return:
+    ------
+    file : str // output file in fasta format generated by the functon fill()
+    """
+    blocks = fasta_blocks(contigs, block_size)
+    if not output_file.endswith(".gz"):
+        with open(output_file, "w") as file:
+            for block in blocks:
+                file.write(block)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def compress(block):
+        return gzip.compress(block.encode(), compresslevel, mtime=0)
+
+    with open(output_file, "wb") as file, \
+        ThreadPoolExecutor(max(1, threads)) as executor:
+        # In order, with a bounded number of blocks in the pool
+        pending = deque()
+        for block in blocks:
+            pending.append(executor.submit(compress, block))
+            if len(pending) > 2 * threads:
+                file.write(pending.popleft().result())
+        while pending:
+            file.write(pending.popleft().result())
+
+
+def gfa_lines(graph):
+    """
+    This function generates the GFA1 lines of the graph, one at a time:
+    the header, a segment (S) per node then a link (L) per edge. Segments
+    are named after their node and carry the kmer count of the node (KC),
+    its length (LN) and for unitigs their mean coverage (DP): the sum of
+    the weights of their internal edges, or of the in or out edges (the
+    highest) of a (k-1)-mer. Links overlap of k-2 bases and carry the
+    weight of the edge (KC).
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph() or compact_graph()
+
+    Return:
+    ------
+    generator of str // lines of the GFA file
+    """
+    compacted = graph.graph.get("compacted", False)
+    overlap = graph.graph["overlap"] if compacted else None
+    yield "H\tVN:Z:1.0\n"
+
+    for node in graph:
+        if compacted:
+            attributes = graph.nodes[node]
+            seq = attributes["seq"]
+            tags = "\tDP:f:{0:.2f}".format(attributes["mean_coverage"])
+            count = attributes["coverage"]
+        else:
+            seq = decode_node(graph, node)
+            tags = ""
+            count = max(sum(graph.get_edge_data(pred, node)["weight"]
+                            for pred in graph.predecessors(node)),
+                        sum(data["weight"] for _, _, data in
+                            graph.edges(node, data=True)))
+        if overlap is None:
+            overlap = len(seq) - 1
+        yield "S\t{0}\t{1}\tLN:i:{2}\tKC:i:{3}{4}\n".format(
+            node, seq, len(seq), count, tags)
+
+    for node in graph:
+        for _, succ, data in graph.edges(node, data=True):
+            yield "L\t{0}\t+\t{1}\t+\t{2}M\tKC:i:{3}\n".format(
+                node, succ, overlap, data["weight"])
+
+
+def save_gfa(graph, gfa_file : str):
+    """
+    This function writes the graph in a GFA1 file (see gfa_lines()), line by
+    line: the memory used does not depend on the size of the graph.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph() or compact_graph()
+    gfa_file: str // name of the GFA file
+    """
+    with open(gfa_file, "w") as file:
+        file.writelines(gfa_lines(graph))
+
+
+def gfa_stage_file(gfa_file : str, stage : str):
+    """GFA file of the graph after a stage: graph.gfa -> graph.solve_tips.gfa"""
+    root, extension = os.path.splitext(gfa_file)
+    return "{0}.{1}{2}".format(root, stage, extension or ".gfa")
+
+
+def fill(text, width=80):
+    """Split text with a line return to respect fasta format"""
+    return os.linesep.join(text[i:i+width] for i in range(0, len(text), width))
+
+
+def std(liste : list):
+    """
+    This function calculats the standart deviation.
+    If std > 0 so there is no variation between lenght and weight of paths.
+
+    Parameter:
+    ---------
+    liste: list of values
+
+    Return:
+    ------
+    float // the standart deviation of the liste
+    """
+
+    return statistics.stdev(liste)
+
+
+def path_average_weight(graph, path : list):
+    """
+    This function calculats the average weight of the path gived in parameter.
+    In a compacted graph, the internal edges of the unitigs are included.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph()
+    path: list // path of de graph.
+
+    Return:
+    ------
+    path with average weight
+    """
+    weight = []
+
+    for i in range(len(path) - 1):
+        weight.append(graph.get_edge_data(path[i], path[i+1])["weight"])
+
+    if graph.graph.get("compacted"):
+        nodes = [graph.nodes[node] for node in path]
+        return (sum(weight) + sum(node["coverage"] for node in nodes)) / \
+            (len(weight) + sum(node["n_edges"] for node in nodes))
+    return statistics.mean(weight)
+
+
+def path_length(graph, path : list):
+    """
+    This function calculats the length of a path in (k-1)-mers: its number
+    of nodes, or the sum of the lengths of its unitigs in a compacted graph.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph()
+    path: list // path of de graph.
+
+    Return:
+    ------
+    int // length of the path
+    """
+    if graph.graph.get("compacted"):
+        return sum(graph.nodes[node]["length"] for node in path)
+    return len(path)
+
+
+def score_paths(graph, paths : list):
+    """
+    This function calculats the length (like path_length()) and the
+    average weight (like path_average_weight()) of many paths at once.
+    The cumulative weight, number of edges and length along the previous
+    path are kept, so the prefix a path shares with the previous one is not
+    weighed again: the paths of nx.all_simple_paths() come in depth-first
+    order and share long prefixes.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph()
+    paths: list // paths of de graph.
+
+    Return:
+    ------
+    tuple of 2 lists // (lengths, average weights) of the paths
+    """
+    compacted = graph.graph.get("compacted")
+    lengths, weights = [], []
+    previous = []
+    # prefix[i]: (weight, number of edges, length) of previous[:i]
+    prefix = [(0, 0, 0)]
+    for path in paths:
+        shared = 0
+        while shared < min(len(path), len(previous)) and \
+            path[shared] == previous[shared]:
+            shared += 1
+        del prefix[shared + 1:]
+        weight, n_edges, length = prefix[-1]
+        for i in range(shared, len(path)):
+            if i > 0:
+                weight += graph.get_edge_data(path[i-1], path[i])["weight"]
+                n_edges += 1
+            if compacted:
+                node = graph.nodes[path[i]]
+                weight += node["coverage"]
+                n_edges += node["n_edges"]
+                length += node["length"]
+            else:
+                length += 1
+            prefix.append((weight, n_edges, length))
+        lengths.append(length)
+        weights.append(weight / n_edges)
+        previous = path
+    return lengths, weights
+
+
+def remove_paths(graph, paths : list, delete_entry_node : bool,
+                 delete_sink_node : bool):
+    """
+    This function removes nodes (starting or sink) of path in graph.
+    Parameter:
+    ---------
+    graph: object networkx DiGraph()// generated by the build_graph() function.
+    path: list // path of de graph.
+    delete_entry_node : boolean //if True, delete starting node of the path.
+    delete_sink_node : boolean //if True, delete sink node of the path.
+
+    Return:
+    ------
+    graph : object networkx DiGraph()// cleaned of unwanted paths.
+    """
+    for path in paths:
+        for i in range(len(path)):
+
+            if (i == 0 and not delete_entry_node) or \
+                (i == len(path) - 1 and not delete_sink_node):
+                continue
+            graph.remove_node(path[i])
+
+    return graph
+
+
+def select_best_path(graph, paths : list, path_length : list, path_weight : list,
+                     delete_entry_node=False, delete_sink_node=False):
+    """
+    This function select the best path for the graph.
+    In this function the last 2 parametres are False (by default).
+    The best path is the path with the max weight. If we have more than one path,
+    # than we compare their length and we select the longest. If in this case we
+    #found more than one path, we choise with the random function.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph()// generated by the build_graph() function.
+    paths : list // path of de graph.
+    path_length : list // indicates length of each path.
+    path_weight : list // indicates average weight of each path.
+    delete_entry_node : boolean // indicates if entry nodes will be deleted or not.
+    delete_sink_node : boolean //  indicates if sink nodes will be deleted or not.
+
+    Return:
+    ------
+    graph : object networkx DiGraph() // graph cleaned of unwanted paths.
+    """
+    best_path_len = 0
+    best_path_index = -1 #out of range.
+    # Biggest weight, computed once
+    max_weight = max(path_weight, default=None)
+
+    for i in range(len(paths)):
+        # Verify the biggest weight
+        if  path_weight[i] == max_weight:
+            best_path_len = path_length[i]
+            best_path_index = i
+            # compare by lenght if we have more than one best weight path
+            if path_length[i] > best_path_len:
+                best_path_len = path_length[i]
+                best_path_index = i
+            #in case the new best path have the same length than the previous
+            # path than we do a random choice:
+        elif path_length[i] == best_path_len:
+            rand_path = randrange(0, 1, 1) #(start, stop, step)
+            if rand_path: # True ->1
+                best_path_len = path_length[i]
+                best_path_index = i
+
+    # Verify that we selected path, if not(just in case)we take a random choice
+    if best_path_index == -1: #doesn't change (if True): no path selected.
+        best_path_index = randint(0, len(paths))
+
+    # Select the best path and delete the others
+    removed_paths = paths[:best_path_index] + paths[best_path_index +1:]
+    # Number of paths removed, for the telemetry of main()
+    graph.graph["removed_paths"] = graph.graph.get("removed_paths", 0) + \
+        len(removed_paths)
+    # remove from the graph
+    graph = remove_paths(graph, removed_paths,
+                          delete_entry_node,
+                          delete_sink_node)
+
+    return graph
+
+
+def solve_bubble(graph, node_pred, node_succ):
+    """
+    This function is used to generate a graph cleaned of the bubble between
+    the predecessor node and the successor node. Keep in bubble the best
+    path selected.
+    It uses the functions previously developed.
+
+    Parameter:
+    ---------
+    graph: object networkx DiGraph()// generated by the build_graph() function.
+    path_length : list // indicates length of each path.
+    node_pred : predecessor node.
+    node_succ : successor node.
+
+    Return:
+    ------
+    graph : DiGraph // graph cleaned of bubble between node_succ and node_pred.
+    """
+    bubble_path_list = list(nx.all_simple_paths(graph, source=node_pred,
+                                                target=node_succ))
+    # Length and weight of each path
+    path_lengths, path_weight = score_paths(graph, bubble_path_list)
+
+    # Keep the best path with select_best_path function
+    return select_best_path(graph, bubble_path_list, path_lengths, path_weight)
+
+def simplify_bubbles(graph):
+    """
+    This function simply the graph by taking off the bubbles.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+
+    Return:
+    ------
+    graph : object networkx DiGraph().
+    """
+    bubbles_nodes = []
+
+    # Found out all bubbles
+    for node in graph:
+        node_ancesstors = [x for x in graph.predecessors(node)]
+        if len(node_ancesstors) > 1: # Not empty
+            ancestors = nx.lowest_common_ancestor(graph, node_ancesstors[0],
+                        node_ancesstors[1])
+            bubbles_nodes.append([ancestors, node])
+
+    # Save the best path for each couple of bubbles.
+    for nodes in bubbles_nodes:
+        # Solve bubbles with previous function.
+        graph = solve_bubble(graph, nodes[0], nodes[1])
+
+    return graph
+
+
+def tree_path(parents : dict, node):
+    """Path from the root of a search tree to the node, using the parents"""
+    path = [node]
+    while parents[path[-1]] is not None:
+        path.append(parents[path[-1]])
+    return path[::-1]
+
+
+def find_bubble(graph, source, max_bubble_length : int):
+    """
+    This function looks for a bubble by a breadth-first search from the
+    source node (tour bus of Velvet): the search stops at paths longer than
+    max_bubble_length and the first node reached a second time closes a
+    bubble. Only the nodes inside the paths are bounded: a long unitig of a
+    compacted graph can still close a bubble, it is not searched further.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+    source : branching node, where the search starts.
+    max_bubble_length : int // maximum length of a path of the bubble,
+                               measured like path_length() without the
+                               nodes where the paths split and merge.
+
+    Return:
+    ------
+    list of 2 paths // the 2 paths of the bubble, from the node where they
+                       split to the node where they merge, or None
+    """
+    parents = {source: None}
+    lengths = {source: 0}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        for succ in graph.successors(node):
+            if succ not in parents:
+                parents[succ] = node
+                lengths[succ] = lengths[node] + path_length(graph, [succ])
+                if lengths[succ] <= max_bubble_length:
+                    queue.append(succ)
+                continue
+            first_path = tree_path(parents, succ)
+            second_path = tree_path(parents, node)
+            if succ in second_path: # cycle, not a bubble
+                continue
+            second_path.append(succ)
+            split = 0
+            while first_path[split + 1] == second_path[split + 1]:
+                split += 1
+            bubble = [first_path[split:], second_path[split:]]
+            # A single edge has no node to remove
+            if min(len(path) for path in bubble) > 2:
+                return bubble
+    return None
+
+
+def simplify_bubbles_bounded(graph, max_bubble_length=100):
+    """
+    This function simply the graph by taking off the bubbles found by
+    find_bubble() from each branching node. Each bubble is solved as soon
+    as it is found, keeping its best path like solve_bubble().
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+    max_bubble_length : int // maximum length of a path of a bubble,
+                               without its split and merge nodes.
+
+    Return:
+    ------
+    graph : object networkx DiGraph().
+    """
+    for source in list(graph):
+        while source in graph and graph.out_degree(source) > 1:
+            bubble = find_bubble(graph, source, max_bubble_length)
+            if bubble is None:
+                break
+            graph = select_best_path(graph, bubble,
+                                     *score_paths(graph, bubble))
+    return graph
+
+
+def solve_entry_tips(graph, entry_nodes):
+    """
+    This function is used to generate graph without unwanted entry nodes.
+    This entry nodes must be gived as argument for the function.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+    entry_nodes : list of unwanted entry nodes.
+
+    Return:
+    ------
+    graph : object networkx DiGraph().
+    """
+    paths_list, paths_length, paths_weight, descendants = [], [], [], []
+
+    # Choise nodes that have more than 1 predecessor.
     for node in graph.nodes():
         pred = list(graph.predecessors(node))
         if len(pred) > 1:
@@ -471,11 +3351,16 @@ def solve_entry_tips(graph, entry_nodes):
     # Case 2: the descendants list is not empty, there is several descendants.
     # Use previous function to generate new graph without unwanted entry tips.
 
-    for i in range(len(entry_nodes)):
-        paths_list.append(list(nx.all_simple_paths(graph, entry_nodes[i], descendants[0])))
-        paths_list[i] = paths_list[i][0]
-        paths_weight.append(path_average_weight(graph, paths_list[i]))
-        paths_length.append(len(paths_list[i]))
+    for entry in entry_nodes:
+        # Entry nodes removed or not linked to the descendant are skipped
+        if entry not in graph:
+            continue
+        path = next(nx.all_simple_paths(graph, entry, descendants[0]), None)
+        if path is None:
+            continue
+        paths_list.append(path)
+        paths_weight.append(path_average_weight(graph, path))
+        paths_length.append(path_length(graph, path))
 
     # Return the optimal path with select_best_path fucntion.
         # delete_entry_node muste be True and delete_sink_node False.
@@ -499,10 +3384,13 @@ def solve_out_tips(graph, sink_nodes):
     ------
     graph : object networkx DiGraph().
     """
-    paths_list, paths_length, paths_weight = [], [], []
+    paths_list = []
 
     # Collet all tips in the graph
     for node in sink_nodes:
+        # Sink nodes removed or without predecessor are not tips
+        if node not in graph or not graph.pred[node]:
+            continue
         node1 = [x for x in graph.predecessors(node)][0]
         node2 = [x for x in graph.successors(node1)]
 
@@ -511,63 +3399,1068 @@ def solve_out_tips(graph, sink_nodes):
             node2 = [x for x in graph.successors(node1)]
 
         if len(node2) > 1:
-            for path in nx.all_simple_paths(graph, node1, node):
-                paths_list.append(path)
-                paths_length.append(len(path))
-                paths_weight.append(path_average_weight(graph, path))
+            paths_list.extend(nx.all_simple_paths(graph, node1, node))
 
+    paths_length, paths_weight = score_paths(graph, paths_list)
     # Return the optimal path with select_best_path fucntion.
         # delete_entry_node muste be False and delete_sink_node True.
     return select_best_path(graph, paths_list, paths_length, paths_weight,
                              delete_entry_node=False,
                              delete_sink_node=True)
 
-#==============================================================
-# Main program
-#==============================================================
-def main():
+def trace_tip(graph, end, forward : bool, max_tip_length=None):
     """
-    Main program function
+    This function follows a dead-end chain from an entry node (forward) or
+    a sink node (backward) up to its branching node: the first node with
+    several predecessors (forward) or successors (backward).
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+    end : entry or sink node, end of the tip.
+    forward : boolean // True for an entry node, False for a sink node.
+    max_tip_length : int // maximum length of a tip, measured like
+                            path_length() without the branching node.
+
+    Return:
+    ------
+    list // tip from the end to the branching node (included), or None if
+            the chain is not a tip or is too long
     """
-    # Get arguments
-    args = get_arguments()
+    step, back = (graph.succ, graph.pred) if forward else (graph.pred,
+                                                          graph.succ)
+    tip = [end]
+    length = path_length(graph, tip)
+    while len(step[tip[-1]]) == 1:
+        node = next(iter(step[tip[-1]]))
+        if len(back[node]) > 1:
+            tip.append(node)
+            return tip
+        if len(step[node]) > 1:
+            return None
+        length += path_length(graph, [node])
+        if max_tip_length is not None and length > max_tip_length:
+            return None
+        tip.append(node)
+    return None
 
-    # 1. Bruijn's graph conception
-        # 1.a kmer occuracy disctionary
-    print("STEP 1")
-    print("{} file lecture and Debuijn graph conception :\n".format(args.fastq_file))
 
-    dict_kmer_occur = build_kmer_dict(args.fastq_file,args.kmer_size)
+def clip_tips(graph, max_tip_length=None, coverage_ratio=1.0):
+    """
+    This function removes the entry and out tips in one pass: each
+    dead-end chain is traced to its branching node by trace_tip(), then
+    the branches of each branching node are compared by average weight,
+    then by length (a branch that is not a tip is longer than any tip).
+    A tip is removed unless it is the best branch or its weight is above
+    coverage_ratio times the weight of the best branch. The removal is
+    done in batch at the end.
+
+    Parameter:
+    ---------
+    graph : object networkx DiGraph().
+    max_tip_length : int // maximum length of a tip, 2 * k for instance
+                            (default: no limit).
+    coverage_ratio : float // tips with a weight above this ratio of the
+                              best branch are kept (default 1.0: only the
+                              best branch is kept).
+
+    Return:
+    ------
+    graph : object networkx DiGraph().
+    """
+    removed = []
+    for forward in (True, False):
+        ends = get_starting_nodes(graph) if forward else get_sink_nodes(graph)
+        tips = {}
+        for end in ends:
+            tip = trace_tip(graph, end, forward, max_tip_length)
+            if tip is not None:
+                tips.setdefault(tip[-1], []).append(tip)
+
+        for branching_node, branch_tips in tips.items():
+            # Branches: (weight, length, tip) from the branching node
+            branches = []
+            for tip in branch_tips:
+                path = tip if forward else tip[::-1]
+                branches.append((path_average_weight(graph, path),
+                                 path_length(graph, path), tip))
+            neighbors = graph.pred if forward else graph.succ
+            tip_nodes = {tip[-2] for tip in branch_tips}
+            for node in neighbors[branching_node]:
+                if node not in tip_nodes:
+                    edge = (node, branching_node) if forward else \
+                        (branching_node, node)
+                    branches.append((graph.get_edge_data(*edge)["weight"],
+                                     float("inf"), None))
+            best = max(branches, key=lambda branch: branch[:2])
+            for weight, _, tip in branches:
+                if tip is not None and tip is not best[2] and \
+                    weight <= coverage_ratio * best[0]:
+                    removed.extend(tip[:-1])
+                    graph.graph["removed_paths"] = \
+                        graph.graph.get("removed_paths", 0) + 1
+
+    graph.remove_nodes_from(removed)
+    return graph
+
+
+def peak_rss(who=None):
+    """
+    Peak resident set size of this process (or of its terminated children,
+    with resource.RUSAGE_CHILDREN) in bytes, None without resource module.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF if who is None
+                             else who).ru_maxrss
+    # Kilobytes, but bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Metrics:
+    """
+    Telemetry of main(): the time, the peak RSS, the nodes and edges of the
+    graph before and after each stage, optionally the python allocations
+    (tracemalloc) and the cProfile statistics of one stage, and counters.
+    The labels (the kmer size for instance) are added to each stage.
+    The JSON file is written again at the end of each stage, so it shows
+    how far a slow run went. Without measure, only the counters are kept.
+    """
+    STAGES = ["build_kmer_dict", "build_graph", "compact_graph",
+              "simplify_bubbles", "solve_tips", "compact_tips", "contigs"]
+
+    def __init__(self, json_file=None, trace_memory=False, profile_stage=None,
+                 profile_output=None, labels=None, measure=True):
+        self.json_file = json_file
+        self.measure = measure
+        self.labels = labels or {}
+        self.stages = []
+        self.counters = {}
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_output = profile_output
+        # Only the tracing started here is stopped by close()
+        self._tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the tracing of the python allocations started by Metrics"""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    @contextmanager
+    def stage(self, name : str, graph=None):
+        """
+        Measure the stage run in the with block. The record of the stage is
+        given to the block, which can add its own values.
+        The graph is the one modified in place by the stage.
+        """
+        record = dict(self.labels, stage=name)
+        if not self.measure:
+            # Only the counters are kept
+            yield record
+            return
+        if graph is not None:
+            record["nodes_before"] = graph.number_of_nodes()
+            record["edges_before"] = graph.number_of_edges()
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                record["profile"] = self.profile_output or "".join(
+                    "{0}{1}_".format(key, value) for key, value
+                    in self.labels.items()) + name + ".prof"
+                profiler.dump_stats(record["profile"])
+            record["seconds"] = time.perf_counter() - start
+            if graph is not None:
+                # Unless the block gave the size of a new graph
+                record.setdefault("nodes_after", graph.number_of_nodes())
+                record.setdefault("edges_after", graph.number_of_edges())
+            for key, who in (("peak_rss_mb", None), ("peak_rss_children_mb",
+                             getattr(resource, "RUSAGE_CHILDREN", None))):
+                rss = peak_rss(who)
+                if rss is not None:
+                    record[key] = rss / 1e6
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["traced_mb"] = current / 1e6
+                record["traced_peak_mb"] = peak / 1e6
+                snapshot = tracemalloc.take_snapshot()
+                record["top_allocations"] = [
+                    {"location": str(statistic.traceback),
+                     "size_mb": statistic.size / 1e6}
+                    for statistic in snapshot.statistics("lineno")[:5]]
+            self.stages.append(record)
+            if self.json_file:
+                self.save()
+
+    def count(self, name : str, value : int):
+        """Add the value to the counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def counted(self, name : str, iterable):
+        """Generate the items of the iterable, counting them"""
+        for item in iterable:
+            self.count(name, 1)
+            yield item
+
+    def save(self):
+        """Write the stages and the counters in the JSON file"""
+        with open(self.json_file, "w") as file:
+            json.dump({"stages": self.stages, "counters": self.counters},
+                      file, indent=2)
+
+
+def n50(lengths : list):
+    """Length of the contig at half of the assembly, contigs sorted by
+    decreasing length"""
+    total = 0
+    for length in sorted(lengths, reverse=True):
+        total += length
+        if 2 * total >= sum(lengths):
+            return length
+    return 0
+
+
+def weak_components(graph):
+    """
+    This function finds the weakly connected components of the graph, by
+    breadth-first searches along the edges in both directions.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph()
+
+    Return:
+    ------
+    list of list // nodes of each component, the components in the order
+                    of their first node in the graph
+    """
+    seen = set()
+    components = []
+    for start in graph:
+        if start in seen:
+            continue
+        seen.add(start)
+        component = [start]
+        for node in component:
+            for neighbor in chain(graph.successors(node),
+                                  graph.predecessors(node)):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    component.append(neighbor)
+        components.append(component)
+    return components
+
+
+def component_graph(graph, nodes : list):
+    """
+    This function copies the subgraph of nodes (a weakly connected
+    component) with the class and the attributes of the graph.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph()
+    nodes: list // nodes of the component
+
+    Return:
+    ------
+    nx DiGraph // (or TrackedGraph, CSRGraph) copy of the component
+    """
+    if isinstance(graph, nx.DiGraph):
+        component = type(graph)()
+        edges = ((node, succ, data) for node in nodes
+                 for succ, data in graph.succ[node].items())
+    else:
+        component = nx.DiGraph()
+        edges = (edge for node in nodes
+                 for edge in graph.edges(node, data=True))
+    component.graph.update(graph.graph)
+    if graph.graph.get("compacted"):
+        component.add_nodes_from((node, graph.nodes[node]) for node in nodes)
+    else:
+        component.add_nodes_from(nodes)
+    component.add_edges_from(edges)
+    if isinstance(graph, nx.DiGraph):
+        return component
+    return type(graph)(component)
+
+
+# Graph and arguments of the processes of component_contigs()
+_COMPONENTS = {}
+
+
+def _init_components(graph, args, keep_graphs : bool):
+    """Give the graph to the process (inherited without a copy on fork)"""
+    _COMPONENTS.update(graph=graph, args=args, keep_graphs=keep_graphs)
+
+
+def _assemble_components(batch : list):
+    """
+    Simplify each component (index, nodes) of the batch and find its
+    contigs, return [(index, contigs, counters, simplified graph or None)]
+    """
+    results = []
+    for index, nodes in batch:
+        # The random choices do not depend on the scheduling
+        random.seed(9001)
+        metrics = Metrics(measure=False)
+        graph = simplify_graph(component_graph(_COMPONENTS["graph"], nodes),
+                               _COMPONENTS["args"], metrics, verbose=False)
+        contigs = list(iter_contigs(graph, get_starting_nodes(graph),
+                                    get_sink_nodes(graph)))
+        if not _COMPONENTS["keep_graphs"]:
+            graph = None
+        elif not isinstance(graph, nx.DiGraph):
+            # nx.DiGraph() does not take a CSRGraph, its views are copied
+            component = nx.DiGraph()
+            component.graph.update(graph.graph)
+            component.add_nodes_from(graph.nodes(data=True))
+            component.add_edges_from(graph.edges(data=True))
+            graph = component
+        results.append((index, contigs, metrics.counters, graph))
+    return results
+
+
+def component_contigs(graph, args, metrics, simplified=None):
+    """
+    This function simplifies each weakly connected component of the graph
+    apart (see simplify_graph()) and generates their contigs, in
+    args.threads processes. The largest components are given first to the
+    processes, small ones are grouped in batches. The contigs come in the
+    order of the components in the graph (see weak_components()), so they
+    are numbered the same whatever the number of processes.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph()
+    args: object // arguments of the program
+    metrics: Metrics // counters of the simplification are added to it
+    simplified: list // if given, the simplified components are added to it
+
+    Return:
+    ------
+    generator of tuple // contigs [(contig, len(contig))]
+    """
+    components = weak_components(graph)
+    metrics.count("components", len(components))
+    threads = max(1, args.threads)
+    batch_nodes = max(1, graph.number_of_nodes() // (threads * 16))
+    batches = []
+    batch = []
+    size = 0
+    for index in sorted(range(len(components)),
+                        key=lambda i: -len(components[i])):
+        batch.append((index, components[index]))
+        size += len(components[index])
+        if size >= batch_nodes:
+            batches.append(batch)
+            batch = []
+            size = 0
+    if batch:
+        batches.append(batch)
+
+    keep_graphs = simplified is not None
+    import multiprocessing
+    # A daemonic process (a worker of assemble_multi_k() or run_batch())
+    # can not have children
+    if threads > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(threads, _init_components,
+                                    (graph, args, keep_graphs))
+        results = pool.imap_unordered(_assemble_components, batches)
+    else:
+        pool = None
+        _init_components(graph, args, keep_graphs)
+        results = map(_assemble_components, batches)
+
+    try:
+        done = {}
+        next_index = 0
+        for batch_results in results:
+            for index, contigs, counters, component in batch_results:
+                done[index] = contigs
+                for name, value in counters.items():
+                    metrics.count(name, value)
+                if keep_graphs:
+                    simplified.append(component)
+            while next_index in done:
+                yield from done.pop(next_index)
+                next_index += 1
+    finally:
+        _COMPONENTS.clear()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def simplify_graph(graph, args, metrics, save_stage=None, verbose=True):
+    """
+    Steps 2 and 3 of main(): compact the graph (with args.compact), solve
+    its bubbles and its tips (see the options of the program) and compact
+    it again.
 
-        # 1.b Buijn'tree conception
-    graph = build_graph(dict_kmer_occur)
+    Parameter:
+    ---------
+    graph: nx DiGraph// generated by build_graph()
+    args: object // arguments of the program
+    metrics: Metrics // telemetry of the stages
+    save_stage: function // called with the name of each stage and the
+                            graph after it
+    verbose: boolean // print the steps
+
+    Return:
+    ------
+    graph: nx DiGraph // simplified graph
+    """
+    if args.compact:
+        with metrics.stage("compact_graph", graph) as stage:
+            graph = compact_graph(graph)
+            stage["nodes_after"] = graph.number_of_nodes()
+            stage["edges_after"] = graph.number_of_edges()
+        if save_stage is not None:
+            save_stage("compact_graph", graph)
 
     # 2. Manipulation of Bruijn's graph
     nodes_in = get_starting_nodes(graph)
     nodes_out = get_sink_nodes(graph)
 
-    print("STEP 2 : Bubbles resolution\n")
-    graph = simplify_bubbles(graph)
+    if verbose:
+        print("STEP 2 : Bubbles resolution\n")
+    removed_paths = graph.graph.get("removed_paths", 0)
+    with metrics.stage("simplify_bubbles", graph):
+        if args.max_bubble_length is None:
+            graph = simplify_bubbles(graph)
+        else:
+            graph = simplify_bubbles_bounded(graph, args.max_bubble_length)
+    if save_stage is not None:
+        save_stage("simplify_bubbles", graph)
+    metrics.count("bubble_paths_removed",
+                  graph.graph.get("removed_paths", 0) - removed_paths)
+
+    if verbose:
+        print("STEP 3:  Tips resolution \n")
+    removed_paths = graph.graph.get("removed_paths", 0)
+    with metrics.stage("solve_tips", graph):
+        if args.max_tip_length is None:
+            graph = solve_entry_tips(graph, nodes_in)
+            graph = solve_out_tips(graph, nodes_out)
+        else:
+            graph = clip_tips(graph, args.max_tip_length,
+                              args.tip_coverage_ratio)
+    if save_stage is not None:
+        save_stage("solve_tips", graph)
+    metrics.count("tips_removed",
+                  graph.graph.get("removed_paths", 0) - removed_paths)
+    if args.compact:
+        with metrics.stage("compact_tips", graph) as stage:
+            graph = compact_graph(graph)
+            stage["nodes_after"] = graph.number_of_nodes()
+            stage["edges_after"] = graph.number_of_edges()
+        if save_stage is not None:
+            save_stage("compact_tips", graph)
+    return graph
+
+
+def assemble(dict_kmer_occur, args, output_file : str, metrics,
+             gfa_file=None):
+    """
+    Steps 1.b to 4 of main(): build the graph of the kmers, simplify it and
+    write the contigs.
+
+    Parameter:
+    ---------
+    dict_kmer_occur: dictionary // kmers and their occurence
+    args: object // arguments of the program
+    output_file: str // contigs file
+    metrics: Metrics // telemetry of the stages
+    gfa_file: str // GFA file of the simplified graph (see save_gfa()),
+                     and of the graph after each stage with args.gfa_stages
 
-    print("STEP 3:  Tips resolution \n")
-    graph = solve_entry_tips(graph, nodes_in)
+    Return:
+    ------
+    tuple // (simplified graph, list of the contig lengths), the graph is
+             None with args.components unless it is drawn or exported
+    """
+    lengths = []
+
+    def keep_lengths(contigs):
+        for contig in contigs:
+            lengths.append(contig[1])
+            yield contig
 
-    graph = solve_out_tips(graph, nodes_out)
+    def save_stage_gfa(stage, graph):
+        if gfa_file and args.gfa_stages:
+            save_gfa(graph, gfa_stage_file(gfa_file, stage))
+
+    # 1.b Buijn'tree conception
+    with metrics.stage("build_graph") as stage:
+        graph = build_graph(dict_kmer_occur, args.graph_backend,
+                            args.node_ids)
+        stage["nodes_after"] = graph.number_of_nodes()
+        stage["edges_after"] = graph.number_of_edges()
+    save_stage_gfa("build_graph", graph)
+
+    if args.components:
+        # 2. and 3. in each weakly connected component
+        print("STEP 2-3: Bubbles and tips resolution of each component\n")
+        simplified = [] if gfa_file or getattr(args, "plot", None) else None
+        print("STEP 4: contigs in {} file \n".format(output_file))
+        with metrics.stage("contigs"):
+            contigs = metrics.counted("contigs", component_contigs(
+                graph, args, metrics, simplified))
+            save_contigs(keep_lengths(contigs), output_file, args.threads)
+        if simplified is None:
+            return None, lengths
+        graph = nx.compose_all(simplified) if simplified else nx.DiGraph()
+        if gfa_file:
+            save_gfa(graph, gfa_file)
+        return graph, lengths
+
+    graph = simplify_graph(graph, args, metrics, save_stage_gfa)
+    if gfa_file:
+        save_gfa(graph, gfa_file)
     #Update of nodes_in and nodes_out
     nodes_in = get_starting_nodes(graph)
     nodes_out = get_sink_nodes(graph)
 
-    print("STEP 4: contigs in {} file \n".format(args.output_file))
-    contigs = get_contigs(graph, nodes_in, nodes_out)
-    # Save contigs in file
-    save_contigs(contigs, args.output_file)
-
-    # NOT IN THE TP, BUT JUST OPTIONAL Drew graph or not
-    decision = input("Do you want to show the graph ? \n 1: Yes  0: No \n", )
-    if int(decision) == 1:
-        print(" Close graph to exit")
-        nx.draw(graph, with_labels=True, font_weight='bold')
-        plt.show()
+    print("STEP 4: contigs in {} file \n".format(output_file))
+    with metrics.stage("contigs"):
+        # Contigs are written as they are found
+        contigs = metrics.counted("contigs", iter_contigs(graph, nodes_in,
+                                                          nodes_out))
+        # Save contigs in file
+        save_contigs(keep_lengths(contigs), output_file, args.threads)
+
+    return graph, lengths
+
+
+def kmer_size_file(output_file : str, k_size : int):
+    """Contigs file of one kmer size: contigs.fasta -> contigs_k21.fasta"""
+    root, extension = os.path.splitext(output_file)
+    if extension == ".gz":
+        root, extension = os.path.splitext(root)
+        extension += ".gz"
+    return "{0}_k{1}{2}".format(root, k_size, extension)
+
+
+def assemble_kmer_size(job):
+    """
+    Assemble the kmers of one size, in a process of assemble_multi_k().
+    The random choices restart from the seed, so the assembly does not
+    depend on the other sizes.
+
+    Parameter:
+    ---------
+    job: tuple // (kmer dictionary, kmer size, arguments of the program)
+
+    Return:
+    ------
+    tuple // (kmer size, contig lengths, stages and counters of Metrics)
+    """
+    dict_kmer_occur, k_size, args = job
+    random.seed(9001)
+    with Metrics(None, args.tracemalloc, args.profile_stage,
+                 args.profile_output, {"kmer_size": k_size}) as metrics:
+        lengths = assemble(dict_kmer_occur, args,
+                           kmer_size_file(args.output_file, k_size), metrics,
+                           args.gfa and kmer_size_file(args.gfa, k_size))[1]
+    return k_size, lengths, metrics.stages, metrics.counters
+
+
+def assemble_multi_k(args, metrics, trim=None):
+    """
+    This function counts the kmers of each size of args.kmer_sizes in one
+    pass over the fastq file, assembles each size (in args.threads
+    processes), writes the contigs of each size in kmer_size_file() and
+    reports their statistics. The contigs of the best size (largest N50,
+    then longest contig, then fewest contigs) are copied to
+    args.output_file.
+
+    Parameter:
+    ---------
+    args: object // arguments of the program
+    metrics: Metrics // telemetry of the stages
+    trim: ReadTrimmer // trimming of the reads (see read_fastq_blocks())
+
+    Return:
+    ------
+    list of dict // statistics of the assembly of each size
+    """
+    with metrics.stage("build_kmer_dict"):
+        kmer_dicts = build_kmer_dicts(args.fastq_file, args.kmer_sizes,
+                                      args.packed, engine=args.engine,
+                                      trim=trim)
+        if trim is not None:
+            report_trimming(trim, metrics)
+        for k_size, kmer_dict in kmer_dicts.items():
+            if args.min_count > 1 and isinstance(kmer_dict, KmerTable):
+                kmer_dict.drop_below(args.min_count)
+            elif args.min_count > 1:
+                kmer_dicts[k_size] = {
+                    kmer: count for kmer, count in kmer_dict.items()
+                    if count >= args.min_count}
+            metrics.count("distinct_kmers_k{0}".format(k_size),
+                          len(kmer_dicts[k_size]))
+
+    jobs = [(kmer_dicts.pop(k_size), k_size, args)
+            for k_size in args.kmer_sizes]
+    if args.threads > 1:
+        import multiprocessing
+        with multiprocessing.Pool(min(args.threads, len(jobs))) as pool:
+            results = pool.map(assemble_kmer_size, jobs, chunksize=1)
+    else:
+        results = [assemble_kmer_size(job) for job in jobs]
+
+    statistics_list = []
+    for k_size, lengths, stages, counters in results:
+        metrics.stages.extend(stages)
+        for name, value in counters.items():
+            metrics.count("{0}_k{1}".format(name, k_size), value)
+        statistics_list.append({
+            "kmer_size": k_size, "contigs": len(lengths),
+            "assembly_length": sum(lengths),
+            "longest_contig": max(lengths, default=0), "n50": n50(lengths),
+            "contigs_file": kmer_size_file(args.output_file, k_size)})
+    best = max(statistics_list, key=lambda stat: (
+        stat["n50"], stat["longest_contig"], -stat["contigs"]))
+    metrics.counters["best_kmer_size"] = best["kmer_size"]
+    if args.metrics_json:
+        metrics.save()
+
+    print("k\tcontigs\tlength\tlongest\tN50")
+    for stat in statistics_list:
+        print("{kmer_size}\t{contigs}\t{assembly_length}\t{longest_contig}"
+              "\t{n50}".format(**stat))
+    print("Best k-mer size: {0}, contigs in {1}".format(best["kmer_size"],
+                                                        args.output_file))
+    shutil.copyfile(best["contigs_file"], args.output_file)
+    return statistics_list
+
+
+def find_node(graph, sequence : str):
+    """
+    This function returns the first node of the graph whose sequence (see
+    node_sequence()) contains the given sequence.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph // graph of the kmers or of the unitigs
+    sequence: str // sequence to look for
+
+    Return:
+    ------
+    node of the graph
+    """
+    for node in graph:
+        if sequence in node_sequence(graph, node):
+            return node
+    raise ValueError("no node of the graph contains {0}".format(sequence))
+
+
+def neighborhood(graph, center=None, max_nodes=200):
+    """
+    This function returns the max_nodes nodes closest to center, by a
+    breadth-first search which follows the edges in both directions.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph // graph of the kmers or of the unitigs
+    center: node // first node (default: the node with most neighbors)
+    max_nodes: int // number of nodes returned at most
+
+    Return:
+    ------
+    list // nodes, from the closest to center
+    """
+    if center is None:
+        center = max(graph, key=lambda node: graph.in_degree(node) +
+                     graph.out_degree(node), default=None)
+        if center is None:
+            return []
+    nodes = {center: None}
+    queue = deque([center])
+    while queue and len(nodes) < max_nodes:
+        node = queue.popleft()
+        for neighbor in list(graph.successors(node)) + \
+            list(graph.predecessors(node)):
+            if neighbor not in nodes:
+                nodes[neighbor] = None
+                queue.append(neighbor)
+                if len(nodes) == max_nodes:
+                    break
+    return list(nodes)
+
+
+def draw_graph(graph, image_file : str, center=None, max_nodes=200):
+    """
+    This function draws the neighborhood() of center in an image file, with
+    the sequence of the nodes when there are 50 of them at most, and edges
+    as wide as their weight. Drawing a whole graph is unreadable and slow
+    beyond a few thousand nodes, matplotlib is only imported here.
+
+    Parameter:
+    ---------
+    graph: nx DiGraph // graph of the kmers or of the unitigs
+    image_file: str // image file, its extension gives the format
+    center: node // first node (default: the node with most neighbors)
+    max_nodes: int // number of nodes drawn at most
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    nodes = neighborhood(graph, center, max_nodes)
+    selected = set(nodes)
+    subgraph = nx.DiGraph()
+    subgraph.add_nodes_from(nodes)
+    for node in nodes:
+        for succ in graph.successors(node):
+            if succ in selected:
+                weight = (graph.get_edge_data(node, succ) or {}).get("weight")
+                subgraph.add_edge(node, succ, weight=weight or 1)
+    max_weight = max((weight for _, _, weight in
+                      subgraph.edges(data="weight")), default=1)
+
+    figure, axes = plt.subplots(figsize=(12, 12))
+    nx.draw_networkx(
+        subgraph, nx.spring_layout(subgraph, seed=9001), ax=axes,
+        with_labels=len(nodes) <= 50,
+        labels={node: node_sequence(graph, node) for node in nodes},
+        node_size=60, font_size=6,
+        node_color=["tab:red" if node == nodes[0] else "tab:blue"
+                    for node in nodes] if nodes else "tab:blue",
+        width=[0.5 + 3 * weight / max_weight for _, _, weight in
+               subgraph.edges(data="weight")])
+    axes.set_axis_off()
+    figure.savefig(image_file, dpi=150, bbox_inches="tight")
+    plt.close(figure)
+
+
+def read_manifest(manifest_file : str, k_size : int):
+    """
+    This function reads the samples of a manifest: one line per sample with
+    the fastq file, the kmer size and the contigs file separated by tabs.
+    The kmer size ("-" or missing) is k_size by default, the contigs file
+    is <fastq file>.contigs.fasta. Relative paths are relative to the
+    manifest. Empty lines and lines starting with # are skipped.
+
+    Parameter:
+    ---------
+    manifest_file: str // manifest file
+    k_size: int // default kmer size
+
+    Return:
+    ------
+    list of tuple // [(fastq file, kmer size, contigs file)]
+    """
+    directory = os.path.dirname(os.path.abspath(manifest_file))
+    jobs = []
+    with open(manifest_file) as manifest:
+        for number, line in enumerate(manifest, 1):
+            fields = line.rstrip("\n").split("\t")
+            if not fields[0].strip() or fields[0].startswith("#"):
+                continue
+            fastq_file = os.path.join(directory, fields[0].strip())
+            sample_k_size = k_size
+            if len(fields) > 1 and fields[1].strip() not in ("", "-"):
+                try:
+                    sample_k_size = int(fields[1])
+                except ValueError:
+                    raise ValueError("{0}, line {1}: {2} is not a k-mer size"
+                                     .format(manifest_file, number, fields[1]))
+            if len(fields) > 2 and fields[2].strip():
+                output_file = os.path.join(directory, fields[2].strip())
+            else:
+                output_file = fastq_file + ".contigs.fasta"
+            jobs.append((fastq_file, sample_k_size, output_file))
+    return jobs
+
+
+def assemble_sample(fastq_file : str, k_size : int, output_file : str, args):
+    """
+    This function counts the kmers of one sample and assembles them like
+    main(), with the options of args.
+
+    Parameter:
+    ---------
+    fastq_file: str // fastq file of the sample
+    k_size: int // size of the kmer
+    output_file: str // contigs file
+    args: object // arguments of the program
+
+    Return:
+    ------
+    dict // statistics of the contigs
+    """
+    random.seed(9001)
+    trim = read_trimmer(args, fastq_file)
+    if args.max_memory:
+        dict_kmer_occur = count_kmers_external(
+            fastq_file, k_size, args.max_memory * 1e6, args.partitions,
+            min_count=args.min_count, temp_dir=args.temp_dir, trim=trim)
+    elif args.correct:
+        dict_kmer_occur = build_corrected_kmer_dict(
+            fastq_file, k_size, args.solid_count, args.packed,
+            engine=args.engine, trim=trim, min_count=args.min_count)[0]
+    elif args.min_count > 1:
+        dict_kmer_occur = build_solid_kmer_dict(
+            fastq_file, k_size, args.min_count, args.sketch_memory * 1e6,
+            encoded=args.packed, engine=args.engine, trim=trim)[0]
+    else:
+        dict_kmer_occur = build_kmer_dict(fastq_file, k_size,
+                                          encoded=args.packed,
+                                          engine=args.engine, trim=trim)
+    lengths = assemble(dict_kmer_occur, args, output_file, Metrics())[1]
+    return {"contigs": len(lengths), "assembly_length": sum(lengths),
+            "longest_contig": max(lengths, default=0), "n50": n50(lengths)}
+
+
+def batch_worker(connection, args):
+    """
+    Worker process of run_batch(): assembles the samples received on the
+    connection until None, and sends back (index, status, statistics or
+    error, seconds) for each of them. An exception only fails its sample.
+    """
+    # The messages of each step would mix up
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        while True:
+            job = connection.recv()
+            if job is None:
+                break
+            index, fastq_file, k_size, output_file = job
+            start = time.perf_counter()
+            try:
+                result = ("ok", assemble_sample(fastq_file, k_size,
+                                                output_file, args))
+            except Exception as error: # pylint: disable=broad-except
+                result = ("failed", "{0}: {1}".format(type(error).__name__,
+                                                      error))
+            connection.send((index,) + result +
+                            (time.perf_counter() - start,))
+
+
+def start_batch_worker(args):
+    """Start a batch_worker() process, return (process, connection)"""
+    import multiprocessing
+    connection, worker_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=batch_worker,
+                                      args=(worker_connection, args),
+                                      daemon=True)
+    process.start()
+    worker_connection.close()
+    return process, connection
+
+
+def run_batch(args):
+    """
+    This function assembles the samples of args.manifest in args.threads
+    worker processes, started once with the modules already imported. A
+    sample which fails or lasts more than args.job_timeout seconds is
+    reported and does not stop the others: the worker of a sample out of
+    time (or which died) is replaced by a new one.
+    The summary table is printed, and written in args.summary if given.
+
+    Parameter:
+    ---------
+    args: object // arguments of the program
+
+    Return:
+    ------
+    list of dict // summary of each sample, in the order of the manifest
+    """
+    from multiprocessing.connection import wait as wait_connections
+    jobs = read_manifest(args.manifest, args.kmer_size)
+    summary = [{"fastq": fastq_file, "k": k_size, "output": output_file,
+                "status": "pending", "seconds": 0.0}
+               for fastq_file, k_size, output_file in jobs]
+    pending = deque(range(len(jobs)))
+    workers = [start_batch_worker(args)
+               for _ in range(max(1, min(args.threads, len(jobs))))]
+    running = {} # worker number: (job index, start time)
+
+    while pending or running:
+        for number in range(len(workers)):
+            if number not in running and pending:
+                index = pending.popleft()
+                workers[number][1].send((index,) + jobs[index])
+                running[number] = (index, time.perf_counter())
+
+        timeout = None
+        if args.job_timeout is not None:
+            timeout = max(0, min(start for _, start in running.values()) +
+                          args.job_timeout - time.perf_counter())
+        ready = wait_connections([workers[number][1] for number in running],
+                                 timeout)
+        for number in list(running):
+            process, connection = workers[number]
+            index, start = running[number]
+            if connection in ready:
+                try:
+                    _, status, result, seconds = connection.recv()
+                except EOFError:
+                    process.join()
+                    status, result = "crashed", "worker exit code {0}".format(
+                        process.exitcode)
+                    seconds = time.perf_counter() - start
+                    workers[number] = start_batch_worker(args)
+            elif args.job_timeout is not None and \
+                time.perf_counter() - start >= args.job_timeout:
+                process.terminate()
+                process.join()
+                status, result = "timeout", "more than {0} s".format(
+                    args.job_timeout)
+                seconds = time.perf_counter() - start
+                workers[number] = start_batch_worker(args)
+            else:
+                continue
+            del running[number]
+            summary[index]["status"] = status
+            summary[index]["seconds"] = seconds
+            if status == "ok":
+                summary[index].update(result)
+            else:
+                summary[index]["error"] = result
+
+    for process, connection in workers:
+        connection.send(None)
+        process.join()
+
+    columns = ["fastq", "k", "output", "status", "seconds", "contigs",
+               "assembly_length", "longest_contig", "n50", "error"]
+    table = ["\t".join(columns)]
+    for sample in summary:
+        sample["seconds"] = round(sample["seconds"], 3)
+        table.append("\t".join(str(sample.get(column, "")) for column
+                                in columns))
+    print("\n".join(table))
+    if args.summary:
+        with open(args.summary, "w") as file:
+            file.write("\n".join(table) + "\n")
+    return summary
+
+
+#==============================================================
+# Main program
+#==============================================================
+def run_assembly(args, metrics):
+    """
+    This function assembles the fastq file (or the k-mer table) of args
+    with a single kmer size or several ones, the telemetry of the stages
+    going to metrics.
+
+    Parameter:
+    ---------
+    args: object // arguments of the program
+    metrics: Metrics // telemetry of the stages
+    """
+    print("STEP 1")
+    print("{} file lecture and Debuijn graph conception :\n".format(
+        args.load_kmers or args.fastq_file))
+
+    # The reads (and the trimming) are counted by the counting of the kmers
+    trim = None
+    if args.fastq_file and not args.load_kmers:
+        trim = read_trimmer(args, args.fastq_file, args.kmer_size if
+                            args.kmers_saved else None)
+        if trim is None and args.metrics_json:
+            trim = ReadTrimmer(None)
+
+    if len(args.kmer_sizes) > 1:
+        # Several kmer sizes: the graphs are not drawn
+        assemble_multi_k(args, metrics, trim)
+        return
+
+    with metrics.stage("build_kmer_dict"):
+        if args.load_kmers:
+            dict_kmer_occur = load_kmer_table(args.load_kmers,
+                                              args.fastq_file)
+            if args.min_count > 1:
+                dict_kmer_occur.drop_below(args.min_count)
+        elif args.max_memory:
+            dict_kmer_occur = count_kmers_external(
+                args.fastq_file, args.kmer_size, args.max_memory * 1e6,
+                args.partitions, min_count=args.min_count,
+                temp_dir=args.temp_dir, table_file=args.save_kmers,
+                trim=trim)
+        elif args.correct:
+            dict_kmer_occur, report = build_corrected_kmer_dict(
+                args.fastq_file, args.kmer_size, args.solid_count,
+                args.packed, threads=args.threads, engine=args.engine,
+                trim=trim, min_count=args.min_count)
+            print("{0} bases corrected in {1} reads with {2} solid k-mers, "
+                  "{3} distinct k-mers before correction, {4} after\n"
+                  .format(report["corrected_bases"], report["corrected_reads"],
+                          report["solid_kmers"], report["kmers_before"],
+                          report["kmers_after"]))
+            for name, value in report.items():
+                metrics.count(name, value)
+        elif args.min_count > 1:
+            dict_kmer_occur, report = build_solid_kmer_dict(
+                args.fastq_file, args.kmer_size, args.min_count,
+                args.sketch_memory * 1e6, encoded=args.packed,
+                engine=args.engine, trim=trim)
+            print("{0} k-mers seen at least {1} times ({2} counted), sketch of "
+                  "{3} bytes, estimated false positive rate {4:.2e}\n".format(
+                      report["solid_kmers"], args.min_count,
+                      report["counted_kmers"], report["sketch_bytes"],
+                      report["estimated_false_positive_rate"]))
+            metrics.count("counted_kmers", report["counted_kmers"])
+        else:
+            dict_kmer_occur = build_kmer_dict(args.fastq_file, args.kmer_size,
+                                              encoded=args.packed,
+                                              threads=args.threads,
+                                              engine=args.engine, trim=trim)
+        if args.save_kmers and not args.max_memory:
+            save_kmer_table(dict_kmer_occur, args.save_kmers,
+                            args.kmer_size, args.fastq_file)
+    if trim is not None:
+        report_trimming(trim, metrics, dict_kmer_occur)
+    metrics.count("distinct_kmers", len(dict_kmer_occur))
+
+    graph = assemble(dict_kmer_occur, args, args.output_file, metrics,
+                     args.gfa)[0]
+
+    # NOT IN THE TP, BUT JUST OPTIONAL Draw the graph
+    if args.plot:
+        center = None
+        if args.plot_node:
+            center = find_node(graph, args.plot_node)
+        draw_graph(graph, args.plot, center, args.plot_max_nodes)
+        print("Graph drawn in {0}".format(args.plot))
+
+
+def main():
+    """
+    Main program function
+    """
+    # Get arguments
+    args = get_arguments()
+    if args.manifest:
+        summary = run_batch(args)
+        if any(sample["status"] != "ok" for sample in summary):
+            sys.exit(1)
+        return
+
+    # 1. Bruijn's graph conception
+        # 1.a kmer occuracy disctionary
+    with Metrics(args.metrics_json, args.tracemalloc, args.profile_stage,
+                 args.profile_output) as metrics:
+        run_assembly(args, metrics)
 
 
 if __name__ == '__main__':
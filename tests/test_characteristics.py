@@ -3,12 +3,27 @@ import pytest
 import os
 import networkx as nx
 import hashlib
+import gzip
+import json
+import tracemalloc
 from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import get_starting_nodes
 from debruijn import get_sink_nodes
 from debruijn import get_contigs
+from debruijn import iter_contigs
 from debruijn import save_contigs
+from debruijn import compact_graph
+from debruijn import TrackedGraph
+from debruijn import Metrics
+from debruijn import get_arguments
+from debruijn import run_batch
+from debruijn import neighborhood
+from debruijn import draw_graph
+from debruijn import save_gfa
+from debruijn import weak_components
+from debruijn import component_contigs
+from debruijn import build_graph
 
 
 def test_get_starting_nodes():
@@ -27,6 +42,22 @@ def test_get_sink_nodes():
     assert 6 in nodes
     assert 7 in nodes
 
+def test_tracked_graph():
+    graph = TrackedGraph()
+    graph.add_edges_from([(1, 2), (3, 2), (2, 4), (4, 5), (5, 6), (5, 7)])
+    assert get_starting_nodes(graph) == [1, 3]
+    assert get_sink_nodes(graph) == [6, 7]
+    graph.remove_node(3)
+    graph.remove_nodes_from([6, 7])
+    assert get_starting_nodes(graph) == [1]
+    assert get_sink_nodes(graph) == [5]
+    graph.add_edge(8, 1)
+    graph.add_node(9)
+    graph.remove_edge(4, 5)
+    assert get_starting_nodes(graph) == [5, 8, 9]
+    assert get_sink_nodes(graph) == [4, 5, 9]
+    assert get_starting_nodes(graph.copy()) == get_starting_nodes(nx.DiGraph(graph))
+
 def test_get_contigs():
     graph = nx.DiGraph()
     graph.add_edges_from([("TC", "CA"), ("AC", "CA"), ("CA", "AG"), ("AG", "GC"), ("GC", "CG"), ("CG", "GA"), ("GA", "AT"), ("GA", "AA")])
@@ -38,6 +69,34 @@ def test_get_contigs():
         assert contig[1] == 8
 
 
+def test_iter_contigs():
+    graph = nx.DiGraph()
+    graph.add_edges_from([("TC", "CA"), ("AC", "CA"), ("CA", "AG"), ("AG", "GC"), ("GC", "CG"), ("CG", "GA"), ("GA", "AT"), ("GA", "AA"),
+                          ("CA", "AT")])
+    contigs = iter_contigs(graph, ["TC", "AC"], ["AT" , "AA"])
+    assert not isinstance(contigs, list)
+    # First simple path of each (start, sink), in the same order as before
+    assert list(contigs) == [("TCAGCGAT", 8), ("TCAGCGAA", 8), ("ACAGCGAT", 8), ("ACAGCGAA", 8)]
+    graph.add_node("GG")
+    assert list(iter_contigs(graph, ["GG"], ["GG", "AT"])) == [("GG", 2)]
+
+
+def test_compact_graph():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("TC", "CA", 2), ("AC", "CA", 2), ("CA", "AG", 4), ("AG", "GC", 4), ("GC", "CG", 3),
+                                   ("CG", "GA", 5), ("GA", "AT", 1), ("GA", "AA", 2)])
+    compacted = compact_graph(graph)
+    assert compacted.number_of_nodes() == 5
+    assert compacted.number_of_edges() == 4
+    assert compacted.nodes["CA"]["seq"] == "CAGCGA"
+    assert compacted.nodes["CA"]["length"] == 5
+    assert compacted.nodes["CA"]["coverage"] == 16
+    assert compacted.nodes["CA"]["mean_coverage"] == 4
+    assert compacted.edges["CA", "AA"]["weight"] == 2
+    contig_list = get_contigs(compacted, ["TC", "AC"], ["AT" , "AA"])
+    assert sorted(contig_list) == sorted(get_contigs(graph, ["TC", "AC"], ["AT" , "AA"]))
+
+
 # def test_get_contigs_comp():
 #     graph = nx.DiGraph()
 #     graph.add_edges_from([(("AG", "TC"), ("CA", "GT")), (("AC", "TG"), ("CA", "GT")), (("CA", "GT"), ("AG", "TC")), 
@@ -56,4 +115,133 @@ def test_save_contigs():
     contig = [("TCAGCGAT", 8), ("TCAGCGAA",8), ("ACAGCGAT", 8), ("ACAGCGAA", 8)]
     save_contigs(contig, test_file)
     with open(test_file, 'rb') as contig_test:
-        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
\ No newline at end of file
+        assert hashlib.md5(contig_test.read()).hexdigest() == "ca84dfeb5d58eca107e34de09b3cc997"
+
+
+def test_save_contigs_gzip(tmp_path):
+    contigs = [("ACGT" * (i + 30), 4 * (i + 30)) for i in range(50)]
+    save_contigs(iter(contigs), str(tmp_path / "plain.fna"), block_size=100)
+    save_contigs(iter(contigs), str(tmp_path / "one.fna"))
+    save_contigs(iter(contigs), str(tmp_path / "blocks.fna.gz"), threads=3, block_size=100)
+    plain = (tmp_path / "plain.fna").read_bytes()
+    assert plain == (tmp_path / "one.fna").read_bytes()
+    with gzip.open(str(tmp_path / "blocks.fna.gz"), "rb") as blocks:
+        assert blocks.read() == plain
+
+def test_metrics(tmp_path):
+    metrics_file = str(tmp_path / "metrics.json")
+    with Metrics(metrics_file, trace_memory=True, profile_stage="contigs",
+                 profile_output=str(tmp_path / "contigs.prof")) as metrics:
+        graph = nx.DiGraph()
+        graph.add_edges_from([(1, 2), (3, 2), (2, 4)])
+        with metrics.stage("solve_tips", graph):
+            graph.remove_node(3)
+        with metrics.stage("contigs"):
+            assert list(metrics.counted("contigs", "ab")) == ["a", "b"]
+        metrics.count("contigs", 1)
+        metrics.save()
+    assert not tracemalloc.is_tracing()
+    with open(metrics_file) as file:
+        saved = json.load(file)
+    assert saved["counters"] == {"contigs": 3}
+    tips, contigs = saved["stages"]
+    assert (tips["nodes_before"], tips["edges_before"]) == (4, 3)
+    assert (tips["nodes_after"], tips["edges_after"]) == (3, 2)
+    assert tips["seconds"] >= 0 and "traced_peak_mb" in tips
+    assert os.path.isfile(contigs["profile"])
+
+
+def test_run_batch(tmp_path, monkeypatch):
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    manifest = tmp_path / "manifest.tsv"
+    manifest.write_text("# samples\n{0}\t21\tone.fasta\nmissing.fq\t21\ttwo.fasta\n{0}\t-\tthree.fasta\n".format(fastq_file))
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "--manifest", str(manifest), "--threads", "2",
+                                     "--summary", str(tmp_path / "summary.tsv")])
+    summary = run_batch(get_arguments())
+    assert [sample["status"] for sample in summary] == ["ok", "failed", "ok"]
+    assert summary[0]["output"] == str(tmp_path / "one.fasta")
+    assert summary[2]["k"] == 21
+    assert "FileNotFoundError" in summary[1]["error"]
+    assert summary[0]["contigs"] == summary[2]["contigs"] > 0
+    # Options of a single sample are rejected
+    for options in (["-k", "21,31"], ["--save-kmers", str(tmp_path / "kmers.kmt")],
+                    ["--plot", str(tmp_path / "graph.png")], ["--metrics-json", str(tmp_path / "m.json")],
+                    ["-i", fastq_file]):
+        monkeypatch.setattr("sys.argv", ["debruijn.py", "--manifest", str(manifest)] + options)
+        with pytest.raises(SystemExit):
+            get_arguments()
+    assert os.path.isfile(summary[0]["output"])
+    assert len((tmp_path / "summary.tsv").read_text().splitlines()) == 4
+
+
+def test_neighborhood(tmp_path):
+    graph = nx.DiGraph()
+    graph.add_edges_from([("TC", "CA"), ("CA", "AG"), ("AG", "GA"), ("GA", "AT"), ("GC", "CA")])
+    assert neighborhood(graph, "AG", 3) == ["AG", "GA", "CA"]
+    assert set(neighborhood(graph, "AG")) == set(graph)
+    assert neighborhood(graph, max_nodes=1) == ["CA"]
+    assert neighborhood(nx.DiGraph()) == []
+    pytest.importorskip("matplotlib")
+    draw_graph(graph, str(tmp_path / "graph.png"), "AG", 3)
+    assert (tmp_path / "graph.png").stat().st_size > 0
+
+
+def test_save_gfa(tmp_path):
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("TCA", "CAG", 3), ("CAG", "AGA", 2), ("CAG", "AGT", 1)])
+    gfa_file = tmp_path / "graph.gfa"
+    save_gfa(graph, str(gfa_file))
+    lines = gfa_file.read_text().splitlines()
+    assert lines[0] == "H\tVN:Z:1.0"
+    assert "S\tCAG\tCAG\tLN:i:3\tKC:i:3" in lines
+    assert "S\tAGT\tAGT\tLN:i:3\tKC:i:1" in lines
+    assert "L\tCAG\t+\tAGA\t+\t2M\tKC:i:2" in lines
+    assert len(lines) == 1 + 4 + 3
+    save_gfa(compact_graph(graph), str(gfa_file))
+    lines = gfa_file.read_text().splitlines()
+    assert "S\tTCA\tTCAG\tLN:i:4\tKC:i:3\tDP:f:3.00" in lines
+    assert "L\tTCA\t+\tAGA\t+\t2M\tKC:i:2" in lines
+
+
+def test_component_contigs(monkeypatch):
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("TC", "CA", 3), ("GG", "GT", 1), ("CA", "AG", 3),
+                                   ("AT", "TC", 1), ("GT", "TT", 1)])
+    graph.add_node("CC")
+    assert weak_components(graph) == [["TC", "CA", "AT", "AG"], ["GG", "GT", "TT"], ["CC"]]
+    kmer_dict = {"TCAGA": 4, "CAGAT": 4, "AGATT": 2, "GGCCA": 3, "GCCAT": 3, "CCATG": 1,
+                 "TTTAC": 2}
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", __file__])
+    args = get_arguments()
+    counters = []
+    contigs = []
+    for threads in (1, 2):
+        args.threads = threads
+        metrics = Metrics()
+        contigs.append(list(component_contigs(build_graph(kmer_dict), args, metrics)))
+        counters.append(metrics.counters)
+    assert contigs[0] == contigs[1] == [("TCAGATT", 7), ("GGCCATG", 7), ("TTTAC", 5)]
+    assert counters[0] == counters[1]
+    assert counters[0]["components"] == 3
+    # CSR backend, simplified components kept as networkx graphs
+    simplified = []
+    assert list(component_contigs(build_graph(kmer_dict, "csr"), args, Metrics(),
+                                  simplified)) == contigs[0]
+    assert all(isinstance(component, nx.DiGraph) for component in simplified)
+    assert sorted(nx.compose_all(simplified).edges(data="weight")) == \
+        sorted(build_graph(kmer_dict).edges(data="weight"))
+
+
+def test_get_arguments(monkeypatch):
+    # Options which would be ignored or fail later are rejected
+    for options in (["--kmers-saved"], ["--min-qual", "20", "--kmers-saved", "--min-count", "2"],
+                    ["--min-qual", "20", "--kmers-saved", "--correct"],
+                    ["--packed", "-k", "33"], ["--max-memory", "1", "-k", "33"],
+                    ["--load-kmers", __file__, "--engine", "numpy"]):
+        monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", __file__] + options)
+        with pytest.raises(SystemExit):
+            get_arguments()
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", __file__, "--min-qual", "20", "--kmers-saved"])
+    assert get_arguments().kmers_saved
+    monkeypatch.setattr("sys.argv", ["debruijn.py", "-i", __file__, "-k", "21,31,21"])
+    assert get_arguments().kmer_sizes == [21, 31]
@@ -3,12 +3,35 @@ import pytest
 import os
 import networkx as nx
 import pickle
+import gzip
 from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import read_fastq
+from debruijn import read_fastq_blocks
 from debruijn import cut_kmer
 from debruijn import build_kmer_dict
 from debruijn import build_graph
+from debruijn import encode_kmer
+from debruijn import decode_kmer
+from debruijn import get_contigs
+from debruijn import fastq_chunks
+from debruijn import count_kmers_numpy
+from debruijn import CountMinSketch
+from debruijn import MIN_SKETCH_WIDTH
+from debruijn import build_solid_kmer_dict
+from debruijn import save_kmer_table
+from debruijn import load_kmer_table
+from debruijn import build_kmer_dicts
+from debruijn import count_kmers_external
+from debruijn import external_partitions
+from debruijn import MAX_PARTITIONS
+from debruijn import super_kmers
+from debruijn import NodeDictionary
+from debruijn import node_sequence
+from debruijn import ReadTrimmer
+from debruijn import detect_phred_offset
+from debruijn import correct_read
+from debruijn import build_corrected_kmer_dict
 
 
 def test_read_fastq():
@@ -18,6 +41,51 @@ def test_read_fastq():
     assert next(fastq_reader) == "TTTGAATTACAACATCCATATGTTCTTGATGCTGGAATTCCAATATCTCAGTTGACAGTGTGCCCTCACCAGTGGATCAATTTACGAACCAACAATTGTG"
 
 
+def test_read_fastq_blocks(tmp_path):
+    """Test block and gzip fastq reading"""
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    sequences = list(read_fastq(fastq_file))
+    assert [seq for block in read_fastq_blocks(fastq_file, block_size=5) for seq in block] == sequences
+    with open(fastq_file, "rb") as fastq:
+        content = fastq.read()
+    # bgzip like file: several gzip members
+    gzip_file = tmp_path / "test_two_reads.fq.gz"
+    gzip_file.write_bytes(gzip.compress(content[:150]) + gzip.compress(content[150:]))
+    assert list(read_fastq(str(gzip_file))) == sequences
+    assert list(read_fastq_blocks(str(gzip_file))) == [sequences]
+
+
+def test_read_trimmer(tmp_path):
+    """Test the splitting of the reads at low quality bases and N"""
+    fastq_file = tmp_path / "reads.fq"
+    fastq_file.write_text("@r1\nACGTACGTNACGTAC\n+\nJJJJJJJJJJJJJJ#\n"
+                          "@r2\nTTTTGGGG\n+\nJJ#JJJJJ\n")
+    assert detect_phred_offset(str(fastq_file)) == 33
+    trim = ReadTrimmer(20, 33, min_length=3)
+    assert list(read_fastq(str(fastq_file), trim)) == ["ACGTACGT", "ACGTA", "TGGGG"]
+    assert trim.report() == {"reads": 2, "bases": 23, "fragments": 3,
+                             "kept_bases": 18, "trimmed_bases": 5}
+    assert list(read_fastq_blocks(str(fastq_file), block_size=7, trim=ReadTrimmer(20))) \
+        == [["ACGTACGT", "ACGTA"], ["TT", "TGGGG"]]
+    assert dict(build_kmer_dict(str(fastq_file), 5, trim=ReadTrimmer(20))) \
+        == {"ACGTA": 2, "CGTAC": 1, "GTACG": 1, "TACGT": 1, "TGGGG": 1}
+    # Distinct kmers saved by the trimming, counted in the processes too
+    for threads in (1, 2):
+        trim = ReadTrimmer(20, k_size=5)
+        kmer_dict = build_kmer_dict(str(fastq_file), 5, threads=threads, trim=trim)
+        assert trim.reads == 2
+        assert trim.kmers_saved(kmer_dict) == len(build_kmer_dict(str(fastq_file), 5)) - len(kmer_dict) == 8
+    # Reads only counted
+    counter = ReadTrimmer(None)
+    assert list(read_fastq(str(fastq_file), counter)) == list(read_fastq(str(fastq_file)))
+    assert (counter.reads, counter.bases) == (2, 23)
+    fastq_file.write_text("@r1\nACGT\n+\nhhhB\n")
+    assert detect_phred_offset(str(fastq_file)) == 64
+    assert list(read_fastq(str(fastq_file), ReadTrimmer(20, 64))) == ["ACG"]
+    with pytest.raises(ValueError):
+        ReadTrimmer(94, 33)
+
+
 def test_cut_kmer():
     """test Kmer cut"""
     kmer_reader = cut_kmer("TCAGA", 3)
@@ -26,6 +94,14 @@ def test_cut_kmer():
     assert next(kmer_reader) == "AGA"
 
 
+def test_cut_kmer_encoded():
+    """test packed Kmer cut"""
+    assert encode_kmer("TCA") == 0b110100
+    assert decode_kmer(0b110100, 3) == "TCA"
+    kmer_reader = cut_kmer("TCAGNAGA", 3, encoded=True)
+    assert [decode_kmer(kmer, 3) for kmer in kmer_reader] == ["TCA", "CAG", "AGA"]
+
+
 def test_build_kmer_dict():
     kmer_dict = build_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3)
     assert(len(kmer_dict.keys()) == 4)
@@ -35,6 +111,108 @@ def test_build_kmer_dict():
     assert "GAG" in kmer_dict
     assert kmer_dict["AGA"] == 2
 
+def test_build_kmer_dict_encoded():
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = build_kmer_dict(fastq_file, 21)
+    kmer_table = build_kmer_dict(fastq_file, 21, encoded=True, flush_size=7)
+    assert len(kmer_table) == len(kmer_dict)
+    for kmer, count in kmer_dict.items():
+        assert kmer_table[kmer] == count
+        assert kmer_table[encode_kmer(kmer)] == count
+    assert list(kmer_table) == sorted(kmer_table)
+    assert "TCAG" not in kmer_table
+
+
+def test_build_kmer_dict_parallel():
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    chunks = fastq_chunks(fastq_file, 4)
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == os.path.getsize(fastq_file)
+    assert len(chunks) == 2
+    kmer_dict = build_kmer_dict(fastq_file, 21)
+    assert list(build_kmer_dict(fastq_file, 21, threads=2).items()) == list(kmer_dict.items())
+    kmer_table = build_kmer_dict(fastq_file, 21, encoded=True, threads=2)
+    assert dict(kmer_table.items()) == dict(build_kmer_dict(fastq_file, 21, encoded=True).items())
+
+
+def test_build_kmer_dicts():
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    for engine in ("python", "numpy"):
+        kmer_dicts = build_kmer_dicts(fastq_file, [3, 21, 22], engine=engine)
+        assert list(kmer_dicts) == [3, 21, 22]
+        for k_size, kmer_dict in kmer_dicts.items():
+            assert list(kmer_dict.items()) == list(build_kmer_dict(fastq_file, k_size).items())
+        kmer_tables = build_kmer_dicts(fastq_file, [3, 21], encoded=True, flush_size=7, engine=engine)
+        assert dict(kmer_tables[21].items()) == dict(build_kmer_dict(fastq_file, 21, encoded=True).items())
+
+
+def test_count_kmers_numpy():
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = build_kmer_dict(fastq_file, 21)
+    numpy_dict = build_kmer_dict(fastq_file, 21, engine="numpy")
+    assert list(numpy_dict.items()) == list(kmer_dict.items())
+    kmer_table = count_kmers_numpy(read_fastq(fastq_file), 21, encoded=True, batch_size=1)
+    assert list(kmer_table.items()) == list(build_kmer_dict(fastq_file, 21, encoded=True).items())
+    # Kmers with N are counted like build_kmer_dict(), in the same order
+    kmer_dict = {"TCA": 1, "CAG": 1, "AGN": 1, "GNA": 1, "NAG": 1, "AGA": 2}
+    for batch_size in (1, 10):
+        assert list(count_kmers_numpy(["TCAGNAGA", "AGA"], 3, batch_size=batch_size).items()) \
+            == list(kmer_dict.items())
+    assert dict(count_kmers_numpy(["TCAGNAGA", "AGA"], 3, encoded=True).items()) \
+        == {encode_kmer(kmer): count for kmer, count in kmer_dict.items() if "N" not in kmer}
+
+
+def test_count_kmers_numpy_non_nucleotides(tmp_path):
+    fastq_file = tmp_path / "reads.fq"
+    fastq_file.write_text("@r1\nACGTNACGTACG\n+\nJJJJJJJJJJJJ\n@r2\nACGTNACGT\n+\nJJJJJJJJJ\n")
+    for k_size, kmer_dict in build_kmer_dicts(str(fastq_file), [3, 5], engine="numpy").items():
+        assert list(kmer_dict.items()) == list(build_kmer_dict(str(fastq_file), k_size).items())
+    assert list(build_solid_kmer_dict(str(fastq_file), 5, 2, engine="numpy")[0].items()) \
+        == list(build_solid_kmer_dict(str(fastq_file), 5, 2)[0].items())
+
+
+def test_build_solid_kmer_dict():
+    sketch = CountMinSketch(4096)
+    for kmer in ["TCA", "CAG", "TCA"]:
+        sketch.add(kmer)
+    assert sketch.estimate("TCA") >= 2
+    assert sketch.estimate("CAG") >= 1
+    # Rows of at least MIN_SKETCH_WIDTH counters, whatever the memory
+    import numpy as np
+    small = CountMinSketch(1)
+    assert small.width == MIN_SKETCH_WIDTH and small.shift < 64
+    small.add_codes(np.array([encode_kmer("TCA")] * 2, dtype=np.uint64))
+    assert small.estimate_codes(np.array([encode_kmer("TCA")], dtype=np.uint64))[0] == 2
+    kmer_dict, report = build_solid_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3, 2, 4096)
+    assert kmer_dict == {"AGA": 2}
+    assert report["solid_kmers"] == 1
+    assert 0 <= report["estimated_false_positive_rate"] <= 1
+    kmer_table, _ = build_solid_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3, 2, 4096,
+                                          encoded=True, engine="numpy")
+    assert dict(kmer_table.items()) == {encode_kmer("AGA"): 2}
+
+
+def test_correct_read(tmp_path):
+    """Test the correction of substitutions with the solid kmers"""
+    genome = "ACGTTGCATGTCGCATGATGCATGAGAGCTTACGGTACCAGTAG"
+    solid = set(cut_kmer(genome, 7))
+    assert correct_read(genome, 7, solid) == (genome, 0)
+    # Errors close to each other and in the first kmer
+    read = "ACCTTGCATGTCGCTTGAAGCATGAGAGCTTACGGTACCAGTAG"
+    assert correct_read(read, 7, solid) == (genome, 3)
+    # No solid kmer
+    assert correct_read("TTTTTTTTTTTT", 7, solid) == ("TTTTTTTTTTTT", 0)
+    fastq_file = tmp_path / "reads.fq"
+    fastq_file.write_text("".join("@r{0}\n{1}\n+\n{2}\n".format(i, seq, "J" * len(seq))
+                                  for i, seq in enumerate([genome] * 3 + [read])))
+    kmer_dict, report = build_corrected_kmer_dict(str(fastq_file), 7, solid_count=3)
+    assert kmer_dict == {kmer: 4 for kmer in cut_kmer(genome, 7)}
+    assert report == {"kmers_before": len(solid | set(cut_kmer(read, 7))), "solid_kmers": len(solid),
+                      "corrected_reads": 1, "corrected_bases": 3,
+                      "kmers_after": len(solid)}
+    assert dict(build_corrected_kmer_dict(str(fastq_file), 7, 3, threads=2)[0]) == kmer_dict
+
+
 def test_build_graph():
     file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer.pck")),'rb')
     kmer_dict = pickle.load(file)
@@ -52,6 +230,99 @@ def test_build_graph():
     assert graph.edges["AG", "GA"]['weight'] == 2
     file.close()
 
+def test_build_graph_csr():
+    file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer.pck")),'rb')
+    kmer_dict = pickle.load(file)
+    file.close()
+    graph = build_graph(kmer_dict, backend="csr")
+    assert graph.number_of_nodes() == 4
+    assert graph.number_of_edges() == 4
+    assert "AG" in graph
+    assert graph.edges["AG", "GA"]['weight'] == 2
+    assert list(graph.successors("GA")) == ["AG"]
+    assert "TC" in graph.pred["CA"] and "CA" not in graph.pred["TC"]
+    assert "CA" in graph.succ["TC"] and "TC" not in graph.succ["CA"]
+    # Reading the attributes creates none
+    assert dict(graph.nodes(data=True)) == {node: {} for node in graph}
+    assert graph._node_attributes == {}
+    graph.remove_node("GA")
+    assert "GA" not in graph
+    assert ("AG", "GA") not in graph.edges()
+    assert graph.number_of_edges() == 2
+    assert len(graph.succ["AG"]) == 0
+
+
+def test_build_graph_encoded():
+    kmer_table = build_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3, encoded=True)
+    graph = build_graph(kmer_table)
+    assert graph.number_of_nodes() == 4
+    assert graph.number_of_edges() == 4
+    assert graph.edges[encode_kmer("AG"), encode_kmer("GA")]['weight'] == 2
+    contigs = get_contigs(graph, [encode_kmer("TC")], [encode_kmer("GA")])
+    assert contigs == [("TCAGA", 5)]
+
+def test_build_graph_node_ids():
+    kmer_dict = build_kmer_dict(os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq")), 3)
+    for backend in ("networkx", "csr"):
+        graph = build_graph(kmer_dict, backend, node_ids=True)
+        nodes = graph.graph["node_dictionary"]
+        assert list(graph) == [0, 1, 2, 3]
+        assert [nodes[node] for node in graph] == ["TC", "CA", "AG", "GA"]
+        assert len(nodes.buffer) == 8
+        assert graph.edges[2, 3]['weight'] == 2
+        assert node_sequence(graph, 3) == "GA"
+        assert get_contigs(graph, [0], [3]) == [("TCAGA", 5)]
+    # The csr graph keeps no label of its nodes
+    assert isinstance(graph._labels, range)
+    nodes = NodeDictionary()
+    assert [nodes.add(kmer) for kmer in ("ACG", "CGT", "ACG")] == [0, 1, 0]
+    assert nodes.last_base(1) == "T"
+    nodes.freeze()
+    assert len(nodes) == 2
+    with pytest.raises(ValueError):
+        nodes.add("GTA")
+
+def test_kmer_table_file(tmp_path):
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_build.fq"))
+    kmer_dict = build_kmer_dict(fastq_file, 3)
+    table_file = str(tmp_path / "kmers.kmt")
+    save_kmer_table(kmer_dict, table_file, fastq_file=fastq_file)
+    kmer_table = load_kmer_table(table_file, fastq_file)
+    assert kmer_table.k_size == 3
+    assert dict(kmer_table.items()) == {encode_kmer(kmer): count for kmer, count in kmer_dict.items()}
+    assert kmer_table["AGA"] == 2
+    graph = build_graph(table_file)
+    assert graph.edges[encode_kmer("AG"), encode_kmer("GA")]['weight'] == 2
+    with pytest.raises(ValueError):
+        load_kmer_table(table_file, os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq")))
+    with pytest.raises(ValueError):
+        load_kmer_table(fastq_file)
+    # --min-count on a mapped table
+    kmer_table.drop_below(2)
+    assert dict(kmer_table.items()) == {encode_kmer("AGA"): 2}
+
+
+def test_count_kmers_external(tmp_path):
+    fastq_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "test_two_reads.fq"))
+    kmer_dict = dict(build_kmer_dict(fastq_file, 5, encoded=True).items())
+    for partitions in (1, 4):
+        kmer_table = count_kmers_external(fastq_file, 5, 1e6, partitions, minimizer_size=3,
+                                          temp_dir=str(tmp_path))
+        assert dict(kmer_table.items()) == kmer_dict
+    assert os.listdir(str(tmp_path)) == []
+    kmer_table = count_kmers_external(fastq_file, 5, 1e6, 3, min_count=2,
+                                      table_file=str(tmp_path / "kmers.kmt"))
+    assert dict(kmer_table.items()) == {kmer: count for kmer, count in kmer_dict.items() if count >= 2}
+    assert kmer_table.input_digest != "0" * 64
+    assert os.listdir(str(tmp_path)) == ["kmers.kmt"]
+    # Less than two bytes of memory, as many partitions as allowed
+    assert external_partitions(fastq_file, 1) == MAX_PARTITIONS
+    # Each kmer is in one super-kmer, the kmers with an N are skipped
+    pieces = list(super_kmers("TCAGANCAGAGCTTGAG", 4, 2, 3))
+    assert all(0 <= partition < 3 for partition, _ in pieces)
+    assert [kmer for _, piece in pieces for kmer in cut_kmer(piece, 4)] == \
+        ["TCAG", "CAGA", "CAGA", "AGAG", "GAGC", "AGCT", "GCTT", "CTTG", "TTGA", "TGAG"]
+
 # def test_build_graph_comp():
 #     file = open(os.path.abspath(os.path.join(os.path.dirname(__file__), "kmer_comp.pck")),'rb')
 #     kmer_dict = pickle.load(file)
@@ -7,12 +7,21 @@ from .context import debruijn
 #from .context import debruijn_comp
 from debruijn import std
 from debruijn import path_average_weight
+from debruijn import score_paths
 from debruijn import remove_paths
 from debruijn import select_best_path
 from debruijn import solve_bubble
 from debruijn import simplify_bubbles
+from debruijn import simplify_bubbles_bounded
 from debruijn import solve_entry_tips
 from debruijn import solve_out_tips
+from debruijn import clip_tips
+from debruijn import cut_kmer
+from debruijn import build_graph
+from debruijn import compact_graph
+from debruijn import get_contigs
+from debruijn import get_starting_nodes
+from debruijn import get_sink_nodes
 
 def test_std():
     assert round(std([9, 5, 15, 20]), 1) == 6.6
@@ -24,6 +33,16 @@ def test_path_average_weight():
                                    (5, 6, 10), (5, 7, 10)])
     assert path_average_weight(graph, [1, 2, 4, 5] ) == 6.0
 
+def test_score_paths():
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 5), (3, 2, 10), (2, 4, 10), (4, 5, 3), 
+                                   (5, 6, 10), (5, 7, 10)])
+    paths = [[1, 2, 4, 5, 6], [1, 2, 4, 5, 7], [1, 2, 4], [3, 2, 4, 5]]
+    lengths, weights = score_paths(graph, paths)
+    assert lengths == [5, 5, 3, 4]
+    assert weights == [path_average_weight(graph, path) for path in paths]
+    assert score_paths(graph, []) == ([], [])
+
 def test_remove_paths():
     graph_1 = nx.DiGraph()
     graph_2 = nx.DiGraph()
@@ -143,6 +162,40 @@ def test_simplify_bubbles():
     assert (2,10) not in graph_1.edges()
     assert (10, 5) not in graph_1.edges()
 
+def test_simplify_bubbles_bounded():
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from([(3, 2, 10), (2, 4, 15), (4, 5, 15),
+                                     (2, 10,10), (10, 5,10), (2, 8, 3),
+                                     (8, 9, 3), (9, 5, 3), (5, 6, 10),
+                                     (5, 7, 10)])
+    graph_1 = simplify_bubbles_bounded(graph_1)
+    assert sorted(graph_1.edges()) == [(2, 4), (3, 2), (4, 5), (5, 6), (5, 7)]
+    # The inside of the path 2 -> 8 -> 9 -> 5 is longer than the bound
+    graph_2 = nx.DiGraph()
+    graph_2.add_weighted_edges_from([(2, 4, 15), (4, 5, 15), (2, 8, 3),
+                                     (8, 9, 3), (9, 5, 3)])
+    graph_2 = simplify_bubbles_bounded(graph_2, max_bubble_length=1)
+    assert (8, 9) in graph_2.edges()
+    graph_2 = simplify_bubbles_bounded(graph_2, max_bubble_length=2)
+    assert 8 not in graph_2.nodes()
+    assert 9 not in graph_2.nodes()
+
+def test_simplify_bubbles_bounded_compacted():
+    # A substitution in a unitig: the bubble merges in a long unitig
+    genome = "ACGTTGCAGTCCGATAAGCTTACGGTACCAGTAGGACTTCAGGCTAACTGGATCCTTGA"
+    kmer_dict = {}
+    for seq, count in ((genome, 10), (genome[:20] + "G" + genome[21:], 2)):
+        for kmer in cut_kmer(seq, 7):
+            kmer_dict[kmer] = kmer_dict.get(kmer, 0) + count
+    graph = compact_graph(build_graph(kmer_dict))
+    assert graph.number_of_nodes() == 4
+    assert max(length for _, length in graph.nodes(data="length")) > 6
+    assert simplify_bubbles_bounded(graph.copy(), 5).number_of_nodes() == 4
+    graph = simplify_bubbles_bounded(graph, 6)
+    assert graph.number_of_nodes() == 3
+    assert get_contigs(graph, get_starting_nodes(graph), get_sink_nodes(graph)) == \
+        [(genome, len(genome))]
+
 def test_solve_entry_tips():
     graph_1 = nx.DiGraph()
     graph_1.add_weighted_edges_from([(1, 2, 10), (3, 2, 2), (2, 4, 15), (4, 5, 15)])
@@ -168,3 +221,41 @@ def test_solve_out_tips():
     graph_2 = solve_out_tips(graph_2, [5, 7])  
     assert (4, 5) not in graph_2.edges()
     assert (6, 7) in graph_2.edges() 
+
+def test_clip_tips():
+    graph_1 = nx.DiGraph()
+    graph_1.add_weighted_edges_from([(1, 2, 10), (3, 2, 2), (2, 4, 15), (4, 5, 15)])
+    graph_1 = clip_tips(graph_1)
+    assert (3, 2) not in graph_1.edges()
+    assert (1, 2) in graph_1.edges()
+    graph_2 = nx.DiGraph()
+    graph_2.add_weighted_edges_from([(1, 2, 2), (6, 3, 2), (3, 2, 2),
+                                     (2, 4, 15), (4, 5, 15)])
+    graph_2 = clip_tips(graph_2)
+    assert (1, 2) not in graph_2.edges()
+    assert (6, 3) in graph_2.edges()
+    assert (3, 2) in graph_2.edges()
+    graph_3 = nx.DiGraph()
+    graph_3.add_weighted_edges_from([(1, 2, 15), (2, 3, 15), (3, 4, 15), (4, 5, 15), (4, 6, 2)])
+    graph_3 = clip_tips(graph_3)
+    assert (4, 6) not in graph_3.edges()
+    assert (4, 5) in graph_3.edges()
+    graph_4 = nx.DiGraph()
+    graph_4.add_weighted_edges_from([(1, 2, 15), (2, 3, 15), (3, 4, 15), (4, 5, 2), (4, 6, 2) , (6, 7, 2)])
+    graph_4 = clip_tips(graph_4)
+    assert (4, 5) not in graph_4.edges()
+    assert (6, 7) in graph_4.edges()
+
+
+def test_clip_tips_bounds():
+    # Entry tips on two different branching nodes, one too long
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([(1, 2, 10), (2, 3, 10), (3, 4, 10), (4, 5, 10),
+                                   (6, 3, 1), (7, 8, 1), (8, 9, 1), (9, 5, 1),
+                                   (5, 10, 10), (10, 11, 10), (10, 12, 6)])
+    graph = clip_tips(graph, max_tip_length=2, coverage_ratio=0.5)
+    assert 6 not in graph.nodes()
+    assert (9, 5) in graph.edges()
+    # 12 is kept: its weight is above half the weight of 11
+    assert (10, 12) in graph.edges()
+    assert (10, 11) in graph.edges()